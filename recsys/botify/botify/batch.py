@@ -0,0 +1,85 @@
+"""
+Batch requests: the events of many sessions served by one call
+to /next or /last, as sent by simulators driving many sessions.
+"""
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from botify.data import DataLogger, Datum
+from botify.experiment import Treatment
+from botify.recommenders.recommender import Recommender
+from botify.recommenders.registry import Router
+
+# (user, previous track, time the previous track was listened)
+Event = Tuple[int, int, float]
+
+
+def parse_events(body, max_events: int) -> List[Event]:
+    """
+    Parse the body of a batch request: {"events": [{"user", "track", "time"}, ...]}.
+    Raises ValueError with a message for the client on invalid input.
+    """
+    events = body.get("events") if isinstance(body, dict) else None
+    if not isinstance(events, list):
+        raise ValueError("Expected a JSON object with a list of events")
+    if len(events) > max_events:
+        raise ValueError(f"At most {max_events} events per request, got {len(events)}")
+
+    parsed = []
+    for i, event in enumerate(events):
+        try:
+            parsed.append((int(event["user"]), int(event["track"]), float(event["time"])))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Event {i} needs an int user, an int track and a float time")
+    return parsed
+
+
+def rounds(events: List[Event]) -> List[List[int]]:
+    """
+    Split the positions of events into rounds in which every user
+    occurs at most once. The k-th event of a user goes to the k-th
+    round, so the events of one session are served in order.
+    """
+    result = []
+    seen = {}
+    for i, (user, _, _) in enumerate(events):
+        k = seen.get(user, 0)
+        seen[user] = k + 1
+        if k == len(result):
+            result.append([])
+        result[k].append(i)
+    return result
+
+
+def groups(router: Router, events: List[Event]) -> Iterator[Tuple[Treatment, Recommender, List[int]]]:
+    """
+    Yield the events of every round grouped by treatment,
+    so that each recommender serves its events with one call.
+    """
+    for positions in rounds(events):
+        routed: Dict[Treatment, Tuple[Recommender, List[int]]] = {}
+        for i in positions:
+            treatment, recommender = router.route(events[i][0])
+            routed.setdefault(treatment, (recommender, []))[1].append(i)
+        for treatment, (recommender, group) in routed.items():
+            yield treatment, recommender, group
+
+
+def columns(events: List[Event], positions: List[int]) -> Tuple[List[int], List[int], List[float]]:
+    return (
+        [events[i][0] for i in positions],
+        [events[i][1] for i in positions],
+        [events[i][2] for i in positions],
+    )
+
+
+def log_events(data_logger: DataLogger, kind: str, events: List[Event], positions: List[int], start: float,
+               recommendations: Optional[List[int]] = None, experiments: Optional[dict] = None):
+    """Log every event of a batch as a request of its own, timed from the start of the batch"""
+    timestamp = int(datetime.now().timestamp() * 1000)
+    latency = time.time() - start
+    for n, i in enumerate(positions):
+        user, track, track_time = events[i]
+        recommendation = recommendations[n] if recommendations is not None else None
+        data_logger.log(kind, Datum(timestamp, user, track, track_time, latency, recommendation), experiments)
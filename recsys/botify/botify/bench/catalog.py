@@ -0,0 +1,142 @@
+"""
+Compare cold start of the catalog from the JSON sources and from
+the binary catalog compiled by botify.binary_catalog: the time to
+load it, the time to stream every record to a redis stand-in that
+discards them and collect the track ids the sampler needs, peak RSS
+and the RSS left once the catalog is released.
+Every path runs in a fresh interpreter::
+
+    python -m botify.bench.catalog
+
+The tracks file of the repository has no recommendations, so every
+track gets --recommendations random ones, as in the served catalogs.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from botify.binary_catalog import compile_catalog
+
+SETUP = """
+import logging
+from botify.catalog import Catalog
+
+class App:
+    config = {config!r}
+    logger = logging.getLogger("bench")
+
+# Discards the records, so RSS is what the catalog itself takes
+class Sink:
+    def pipeline(self, transaction=True):
+        return self
+
+    def set(self, key, value):
+        pass
+
+    def execute(self):
+        pass
+
+catalog = Catalog(App())
+"""
+
+JSON = """
+catalog.load_data_from_filesystem(
+    App.config["TRACKS_CATALOG"],
+    App.config["TOP_TRACKS_CATALOG"],
+    App.config["TRACKS_WITH_DIVERSE_RECS_CATALOG"],
+    App.config["RECOMMENDATIONS_CONTEXTUAL_V2_FILE_PATH"],
+)
+"""
+
+BINARY = """
+catalog.load_data_from_binary(App.config["CATALOG_BINARY_PATH"])
+"""
+
+MEASURE = """
+import gc, time
+from botify.metrics import memory_usage
+{setup}
+start = time.perf_counter()
+{load}
+loaded = time.perf_counter() - start
+
+start = time.perf_counter()
+catalog.upload_tracks_to_cache(Sink(), Sink(), Sink())
+catalog.upload_artists_to_cache(Sink())
+catalog.upload_recommendations_to_cache(Sink(), "RECOMMENDATIONS_FILE_PATH")
+catalog.upload_recommendations_to_cache(Sink(), "RECOMMENDATIONS_SVD_FILE_PATH")
+track_ids = catalog.track_ids()
+uploaded = time.perf_counter() - start
+
+catalog.release()
+gc.collect()
+usage = memory_usage()
+print(loaded, uploaded, usage["peak_rss_mb"], usage["rss_mb"])
+"""
+
+
+def with_recommendations(tracks_path: str, output_path: str, count: int):
+    with open(tracks_path) as tracks_file:
+        tracks = [json.loads(line) for line in tracks_file]
+    recommendations = np.random.randint(0, len(tracks), (len(tracks), count))
+    with open(output_path, "w") as output_file:
+        for track, track_recommendations in zip(tracks, recommendations):
+            track["recommendations"] = track_recommendations.tolist()
+            output_file.write(json.dumps(track) + "\n")
+
+
+def run(config: dict, load: str) -> dict:
+    code = MEASURE.format(setup=SETUP.format(config=config), load=load)
+    output = subprocess.check_output([sys.executable, "-c", code], env=os.environ)
+    loaded, uploaded, peak_rss_mb, rss_mb = output.decode().split()
+    return {
+        "load_seconds": float(loaded),
+        "upload_seconds": float(uploaded),
+        "peak_rss_mb": float(peak_rss_mb),
+        "steady_rss_mb": float(rss_mb),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, default="./botify/config.json")
+    parser.add_argument("--tracks", type=str, default="./data/tracks.json")
+    parser.add_argument("--top-tracks", type=str, default="./data/top_tracks.json")
+    parser.add_argument("--user-recommendations", type=str,
+                        default="./data/recommendations_collaborative_user_based.json")
+    parser.add_argument("--recommendations", type=int, default=100)
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = json.load(config_file)
+
+    with tempfile.TemporaryDirectory() as directory:
+        tracks = os.path.join(directory, "tracks.json")
+        with_recommendations(args.tracks, tracks, args.recommendations)
+        config.update(
+            TRACKS_CATALOG=tracks,
+            TRACKS_WITH_DIVERSE_RECS_CATALOG=tracks,
+            RECOMMENDATIONS_CONTEXTUAL_V2_FILE_PATH=tracks,
+            TOP_TRACKS_CATALOG=args.top_tracks,
+            RECOMMENDATIONS_FILE_PATH=args.user_recommendations,
+            RECOMMENDATIONS_SVD_FILE_PATH=args.user_recommendations,
+            CATALOG_BINARY_PATH=os.path.join(directory, "catalog.bin"),
+        )
+        compile_catalog(config, config["CATALOG_BINARY_PATH"])
+
+        results = {
+            "json": run(config, JSON),
+            "binary": run(config, BINARY),
+            "binary_size_mb": os.path.getsize(config["CATALOG_BINARY_PATH"]) / 2 ** 20,
+            "json_size_mb": (3 * os.path.getsize(tracks) + 2 * os.path.getsize(args.user_recommendations)) / 2 ** 20,
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
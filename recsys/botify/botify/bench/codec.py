@@ -0,0 +1,90 @@
+"""
+Compare the binary redis value encoding with pickle.
+
+Run from the botify directory::
+
+    python -m botify.bench.codec --tracks ./data/tracks.json \
+        --recommendations ./data/recommendations_collaborative_user_based.json
+
+"""
+import argparse
+import json
+import pickle
+import time
+
+from botify.track import Track
+from botify.utils import to_bytes, from_bytes
+
+
+def load_tracks(path: str, limit: int) -> list:
+    tracks = []
+    with open(path) as file_handle:
+        for line in file_handle:
+            data = json.loads(line)
+            tracks.append(Track(data["track"], data["artist"], data["title"], data.get("recommendations", [])))
+            if len(tracks) == limit:
+                break
+    return tracks
+
+
+def load_recommendations(path: str, limit: int) -> list:
+    recommendations = []
+    with open(path) as file_handle:
+        for line in file_handle:
+            recommendations.append(json.loads(line)["tracks"])
+            if len(recommendations) == limit:
+                break
+    return recommendations
+
+
+def measure(values: list, encode, decode, repeats: int) -> dict:
+    encoded = [encode(value) for value in values]
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for value in values:
+            encode(value)
+    encode_time = (time.perf_counter() - start) / (repeats * len(values))
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for value in encoded:
+            decode(value)
+    decode_time = (time.perf_counter() - start) / (repeats * len(values))
+
+    return {
+        "encode_us": encode_time * 1e6,
+        "decode_us": decode_time * 1e6,
+        "bytes_per_key": sum(len(value) for value in encoded) / len(encoded),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tracks", type=str, default="./data/tracks.json")
+    parser.add_argument("--recommendations", type=str, default="./data/recommendations_collaborative_user_based.json")
+    parser.add_argument("--limit", type=int, default=10000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    datasets = {
+        "tracks": load_tracks(args.tracks, args.limit),
+        "recommendations": load_recommendations(args.recommendations, args.limit),
+    }
+    codecs = {
+        "pickle": (pickle.dumps, pickle.loads),
+        "binary": (to_bytes, from_bytes),
+    }
+
+    print(f"{'dataset':<16}{'codec':<8}{'encode, us':>12}{'decode, us':>12}{'bytes/key':>12}")
+    for dataset, values in datasets.items():
+        for codec, (encode, decode) in codecs.items():
+            result = measure(values, encode, decode, args.repeats)
+            print(
+                f"{dataset:<16}{codec:<8}{result['encode_us']:>12.2f}"
+                f"{result['decode_us']:>12.2f}{result['bytes_per_key']:>12.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Compare context embeddings computed by the ContextualRanker
+context tower with the factorized ContextEncoder and its
+torch-free NumpyContextEncoder export::
+
+    python -m botify.bench.context_encoder --checkpoint ./checkpoints/epoch=47-step=16944.ckpt
+
+Without --checkpoint an untrained model of the serving
+architecture is used, with randomized batch norm statistics.
+"""
+import argparse
+import time
+
+import torch
+
+from botify.model.encoder import ContextEncoder
+from botify.model.export import context_tower_weights
+from botify.model.model import ContextualRanker
+from botify.model.numpy_encoder import NumpyContextEncoder
+from botify.model.checkpoint import load_model, model_config
+
+
+def randomize_batch_norm(model: ContextualRanker):
+    for module in model.context_transformation:
+        if isinstance(module, torch.nn.BatchNorm1d):
+            module.running_mean.normal_()
+            module.running_var.uniform_(0.5, 2.0)
+            module.weight.data.normal_()
+            module.bias.data.normal_()
+
+
+def timed(function, users: torch.Tensor, tracks: torch.Tensor, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function(users, tracks)
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--checkpoint", type=str)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 64])
+    parser.add_argument("--repeats", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    if args.checkpoint:
+        model = load_model(args.checkpoint)
+    else:
+        model = ContextualRanker(model_config())
+        randomize_batch_norm(model)
+        model.eval()
+
+    start = time.perf_counter()
+    encoder = ContextEncoder.from_model(model)
+    numpy_encoder = NumpyContextEncoder.from_weights(context_tower_weights(model))
+    print(f"precomputed tables in {time.perf_counter() - start:.2f}s, "
+          f"{(encoder.user_table.nelement() + encoder.track_table.nelement()) * 4 / 2 ** 20:.0f} MB")
+
+    users_count = model.user_embedding.num_embeddings
+    tracks_count = model.context_track_embedding.num_embeddings
+
+    with torch.no_grad():
+        users = torch.randint(0, users_count, (4096,))
+        tracks = torch.randint(0, tracks_count, (4096,))
+        expected = model.get_context_embeddings(users, tracks)
+        for name, actual in [
+            ("encoder", encoder.get_context_embeddings(users, tracks)),
+            ("numpy", torch.from_numpy(numpy_encoder.encode(users.numpy(), tracks.numpy()))),
+        ]:
+            error = (expected - actual).abs().max()
+            print(f"{name} max abs error {error:.2e}, max relative error {error / expected.abs().max():.2e}")
+
+        print(f"{'batch':>6}{'model, us':>12}{'encoder, us':>14}{'numpy, us':>12}")
+        for batch_size in args.batch_sizes:
+            users = torch.randint(0, users_count, (batch_size,))
+            tracks = torch.randint(0, tracks_count, (batch_size,))
+            model_time = timed(model.get_context_embeddings, users, tracks, args.repeats)
+            encoder_time = timed(encoder.get_context_embeddings, users, tracks, args.repeats)
+            numpy_time = timed(numpy_encoder.encode, users.numpy(), tracks.numpy(), args.repeats)
+            print(f"{batch_size:>6}{model_time * 1e6:>12.1f}{encoder_time * 1e6:>14.1f}{numpy_time * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Measure how long a request thread spends in DataLogger.log
+and how fast the background writer drains the queue::
+
+    python -m botify.bench.data_logger --events 200000
+
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from botify.data import DataLogger, Datum
+from botify.experiment import Experiments
+
+
+class App:
+    def __init__(self, config: dict):
+        self.config = config
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = App({
+            "DATA_LOG_FILE": os.path.join(directory, "data.json"),
+            "DATA_LOG_FILE_MAX_BYTES": 50000000,
+            "DATA_LOG_FILE_BACKUP_COPIES": 2,
+            "DATA_LOG_QUEUE_SIZE": args.events,
+            "DATA_LOG_BATCH_SIZE": args.batch_size,
+        })
+        data_logger = DataLogger(app)
+        experiment = Experiments.CONTEXTUAL_V2
+
+        start = time.perf_counter()
+        for i in range(args.events):
+            user = i % 10000
+            datum = Datum(int(time.time() * 1000), user, i, 0.5, 0.001, i + 1)
+            data_logger.log("next", datum, {experiment.name: experiment.assign(user)})
+        enqueued = time.perf_counter() - start
+
+        data_logger.close()
+        drained = time.perf_counter() - start
+
+        print(f"log() on the request thread: {enqueued / args.events * 1e6:.2f} us/event")
+        print(f"written to disk:             {args.events / drained:.0f} events/s")
+        print(f"stats: {data_logger.stats()}")
+
+
+if __name__ == "__main__":
+    main()
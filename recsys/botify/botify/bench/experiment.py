@@ -0,0 +1,49 @@
+"""
+Compare assigning users to treatments one by one with
+the vectorized assign_many and the precomputed table::
+
+    python -m botify.bench.experiment --users 1000000
+
+"""
+import argparse
+import time
+
+import numpy as np
+
+from botify.experiment import Experiments
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--table-users", type=int, default=10000)
+    args = parser.parse_args()
+
+    experiment = Experiments.CONTEXTUAL_V2
+    users = np.arange(args.users)
+
+    start = time.perf_counter()
+    expected = [experiment.assign(user).value for user in users.tolist()]
+    one_by_one = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = experiment.assign_many(users)
+    vectorized = time.perf_counter() - start
+
+    if not np.array_equal(actual, expected):
+        raise AssertionError("assign_many does not match assign")
+
+    experiment.precompute(args.table_users)
+    lookups = (users % args.table_users).tolist()
+    start = time.perf_counter()
+    for user in lookups:
+        experiment.assign(user)
+    table = time.perf_counter() - start
+
+    print(f"assign:       {one_by_one / args.users * 1e9:.0f} ns/user")
+    print(f"assign_many:  {vectorized / args.users * 1e9:.0f} ns/user")
+    print(f"table lookup: {table / args.users * 1e9:.0f} ns/user")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+def to_key(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+
+class InMemoryRedis:
+    """
+    A dict backed stand-in for the subset of the redis client
+    used by the catalog, the caches and the session store.
+    Keeps benchmarks free of network and server noise.
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(to_key(key))
+
+    def set(self, key, value):
+        self.data[to_key(key)] = value if isinstance(value, bytes) else to_key(value)
+        return True
+
+    def delete(self, *keys):
+        return sum(self.data.pop(to_key(key), None) is not None for key in keys)
+
+    def expire(self, key, seconds):
+        return to_key(key) in self.data
+
+    def sadd(self, key, *members):
+        members = {to_key(member) for member in members}
+        values = self.data.setdefault(to_key(key), set())
+        added = len(members - values)
+        values |= members
+        return added
+
+    def spop(self, key):
+        values = self.data.get(to_key(key))
+        if not values:
+            return None
+        member = values.pop()
+        if not values:
+            del self.data[to_key(key)]
+        return member
+
+    def pipeline(self, transaction=True):
+        return Pipeline(self)
+
+
+class Pipeline:
+    def __init__(self, redis: InMemoryRedis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self.redis, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((method, args, kwargs))
+            return self
+
+        return queue
+
+    def execute(self, raise_on_error=True):
+        results = []
+        for method, args, kwargs in self.commands:
+            try:
+                results.append(method(*args, **kwargs))
+            except Exception as e:
+                if raise_on_error:
+                    raise
+                results.append(e)
+        self.commands = []
+        return results
@@ -0,0 +1,244 @@
+"""
+Measure how prefork serving scales with the number of workers:
+throughput of /next over keep-alive HTTP connections, and the memory of every worker
+split into what it shares with the leader and the others and
+what is its own (from /proc/<pid>/smaps_rollup)::
+
+    python -m botify.bench.prefork --workers 1 2 4 8
+    python -m botify.bench.prefork --workers 1 2 4 8 --batch 64
+
+With --batch every request carries that many events for the batch
+/next endpoint, and events/s is the throughput to compare.
+
+The generation is loaded once, as in botify.bench.recommenders,
+with in-memory redis stand-ins, and every leader is forked from
+this process. Each worker therefore has its own copy of the
+sessions, which only matters for what ContextualV2 recommends.
+Clients run in separate processes on the same machine and take
+CPU from the workers, so use fewer clients than there are cores
+to spare, and no more workers than cores to see the scaling.
+
+RSS counts shared pages in full in every process, PSS divides
+them between the processes sharing them, and private memory is
+what a worker would free on exit: the cost of one more worker.
+"""
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import tempfile
+import time
+
+import numpy as np
+from flask import Flask
+
+from botify.bench.memory_redis import InMemoryRedis
+from botify.bench.recommenders import REDIS_PREFIXES, App, load_catalog, load_retriever, load_stream
+from botify.cache import LocalCache
+from botify.data import DataLogger
+from botify.generation import Generation, Generations, namespaced
+from botify.prefork import Prefork
+from botify.recommenders.registry import Router, build_resources
+from botify.sampler import build_sampler
+from botify.server import add_resources
+
+
+def load_generation(config: dict, args) -> Generation:
+    redis = {prefix: InMemoryRedis() for prefix in REDIS_PREFIXES}
+    caches = {
+        name: LocalCache()
+        for name in ["tracks_with_recs", "tracks_with_diverse_recs", "artists"]
+    }
+    catalog = load_catalog(App(config), redis, args)
+    catalog.release()
+    sampler = build_sampler(config, catalog.track_ids(), catalog.top_track_ids)
+    resources = build_resources(
+        namespaced(redis, catalog.namespaces), caches, sampler, load_retriever(config, args), catalog.top_track_ids
+    )
+    return Generation(1, catalog, caches, resources, Router.from_config(config, resources))
+
+
+def serve(app: Flask, generations: Generations, workers: int, port: int):
+    def build(worker_generations, index: int):
+        data_logger = DataLogger(app, worker=index)
+        add_resources(app, worker_generations, data_logger)
+        return app, data_logger.close
+
+    Prefork(generations, build, workers, "127.0.0.1", port, app.logger).run()
+
+
+def wait_ready(port: int, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/")
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Server on port {port} did not start")
+
+
+def drive(port: int, stream: list, duration: float, seed: int, batch: int, results: multiprocessing.Queue):
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    headers = {"Content-Type": "application/json"}
+    rng = np.random.default_rng(seed)
+    latencies = []
+    events = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        if batch:
+            body = {"events": [
+                {"user": user, "track": track, "time": track_time}
+                for user, track, track_time in (stream[i] for i in rng.integers(len(stream), size=batch))
+            ]}
+            path = "/next"
+        else:
+            user, track, track_time = stream[rng.integers(len(stream))]
+            body = {"track": track, "time": track_time}
+            path = f"/next/{user}"
+        start = time.perf_counter()
+        connection.request("POST", path, json.dumps(body), headers)
+        response = connection.getresponse()
+        response.read()
+        if response.status == 200:
+            latencies.append(time.perf_counter() - start)
+            events += batch or 1
+    results.put((latencies, events))
+
+
+def children(pid: int) -> list:
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                # The command may contain spaces, the ppid follows its closing parenthesis
+                if int(stat.read().rsplit(")", 1)[1].split()[1]) == pid:
+                    pids.append(int(entry))
+        except (OSError, IndexError):
+            continue
+    return pids
+
+
+def memory(pid: int) -> dict:
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as smaps:
+        for line in smaps:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {
+        "rss_mb": fields["Rss"],
+        "pss_mb": fields["Pss"],
+        "private_mb": fields["Private_Clean"] + fields["Private_Dirty"],
+        "shared_mb": fields["Shared_Clean"] + fields["Shared_Dirty"],
+    }
+
+
+def run(app: Flask, generations: Generations, workers: int, stream: list, args) -> dict:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    leader = multiprocessing.Process(target=serve, args=(app, generations, workers, port))
+    leader.start()
+    try:
+        wait_ready(port)
+        results = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(target=drive, args=(port, stream, args.duration, seed, args.batch, results))
+            for seed in range(args.clients)
+        ]
+        for client in clients:
+            client.start()
+        outcomes = [results.get() for _ in clients]
+        latencies = np.concatenate([latencies for latencies, _ in outcomes])
+        for client in clients:
+            client.join()
+
+        worker_memory = [memory(pid) for pid in children(leader.pid)]
+        leader_memory = memory(leader.pid)
+    finally:
+        os.kill(leader.pid, signal.SIGTERM)
+        leader.join()
+
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    return {
+        "workers": workers,
+        "throughput": len(latencies) / args.duration,
+        "events_per_second": sum(events for _, events in outcomes) / args.duration,
+        "p50_ms": p50,
+        "p99_ms": p99,
+        "leader": leader_memory,
+        "worker_mean": {key: float(np.mean([m[key] for m in worker_memory])) for key in leader_memory},
+        "total_pss_mb": leader_memory["pss_mb"] + sum(m["pss_mb"] for m in worker_memory),
+        "total_rss_mb": leader_memory["rss_mb"] + sum(m["rss_mb"] for m in worker_memory),
+    }
+
+
+def print_results(results: list):
+    print(
+        f"{'workers':>8}{'req/s':>10}{'events/s':>10}{'scaling':>9}{'p50, ms':>9}{'p99, ms':>9}"
+        f"{'worker RSS':>12}{'PSS':>8}{'private':>9}{'total PSS':>11}{'total RSS':>11}"
+    )
+    base = results[0]["events_per_second"] / results[0]["workers"]
+    for result in results:
+        worker = result["worker_mean"]
+        print(
+            f"{result['workers']:>8}{result['throughput']:>10.0f}{result['events_per_second']:>10.0f}"
+            f"{result['events_per_second'] / base:>8.2f}x"
+            f"{result['p50_ms']:>9.2f}{result['p99_ms']:>9.2f}{worker['rss_mb']:>12.1f}{worker['pss_mb']:>8.1f}"
+            f"{worker['private_mb']:>9.1f}{result['total_pss_mb']:>11.1f}{result['total_rss_mb']:>11.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, default="./botify/config.json")
+    parser.add_argument("--tracks", type=str, default="./data/tracks.json")
+    parser.add_argument("--top-tracks", type=str, default="./data/top_tracks.json")
+    parser.add_argument("--recommendations", type=str, default="./data/recommendations_collaborative_user_based.json")
+    parser.add_argument("--log", type=str, default="./data/AB_test/log/data.json")
+    parser.add_argument("--checkpoint", type=str)
+    parser.add_argument("--track-embeddings", type=str)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--batch", type=int, default=0, help="Events per batch request to /next, 0 for /next/<user>")
+    parser.add_argument("--output", type=str)
+    args = parser.parse_args()
+
+    logging.basicConfig(level="WARNING")
+    logging.getLogger("werkzeug").setLevel("WARNING")
+    with open(args.config) as config_file:
+        config = json.load(config_file)
+    config["RECOMMENDATIONS_FILE_PATH"] = args.recommendations
+    config["RECOMMENDATIONS_SVD_FILE_PATH"] = args.recommendations
+
+    generation = load_generation(config, args)
+    generations = Generations(lambda number: generation, {}, logging.getLogger("bench"))
+    generations.current = generation
+    stream = load_stream(args.log, args.requests)
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = Flask(__name__)
+        app.config.update(config, DATA_LOG_FILE=os.path.join(directory, "data.json"))
+        results = [run(app, generations, workers, stream, args) for workers in args.workers]
+
+    print(f"{os.cpu_count()} cores, {args.clients} client processes, batches of {args.batch or 1} events")
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
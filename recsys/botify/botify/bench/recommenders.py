@@ -0,0 +1,245 @@
+"""
+Benchmark every recommender in-process.
+
+The catalog is uploaded through Catalog into in-memory redis
+stand-ins, then recommend_next of each recommender is driven
+with the (user, track, time) stream of a data log. Results
+are printed and saved as json; pass a previous result file
+as --baseline to compare two commits::
+
+    python -m botify.bench.recommenders --output bench.json
+    python -m botify.bench.recommenders --baseline bench.json
+
+Without --checkpoint ContextualV2 runs an untrained model
+of the serving architecture over random track embeddings,
+which costs the same as the trained one.
+
+Contextual serves the recommendations of the --tracks file. The
+default data/tracks.json has none, so Contextual would only measure
+its random fallback; pass the TRACKS_CATALOG of the server config
+for a real measurement::
+
+    python -m botify.bench.recommenders --tracks ./data/recommendations_contextual.json
+"""
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import torch
+
+from botify.bench.memory_redis import InMemoryRedis
+from botify.cache import LocalCache
+from botify.catalog import Catalog, TrackFile
+from botify.generation import namespaced
+from botify.index import TrackIndex
+from botify.model.checkpoint import load_model, model_config
+from botify.model.encoder import build_context_encoder
+from botify.model.export import context_tower_weights
+from botify.model.model import ContextualRanker
+from botify.model.numpy_encoder import NumpyContextEncoder
+from botify.recommenders.registry import RECOMMENDERS, build_resources
+from botify.retrieval import ContextRetriever
+from botify.sampler import build_sampler
+
+REDIS_PREFIXES = [
+    "REDIS_TRACKS_WITH_RECS",
+    "REDIS_TRACKS_WITH_RECS_CONTEXTUAL_V2",
+    "REDIS_TRACKS_WITH_DIVERSE_RECS",
+    "REDIS_ARTIST",
+    "REDIS_RECOMMENDATIONS",
+    "REDIS_RECOMMENDATIONS_SVD",
+    "REDIS_SESSION",
+    "REDIS_CATALOG",
+]
+
+
+class App:
+    def __init__(self, config: dict):
+        self.config = config
+        self.logger = logging.getLogger("bench")
+
+
+def load_stream(path: str, limit: int) -> list:
+    events = []
+    with open(path) as file_handle:
+        for line in file_handle:
+            event = json.loads(line)
+            if event["message"] == "next":
+                events.append((event["user"], event["track"], event["time"]))
+                if len(events) == limit:
+                    break
+    return events
+
+
+def load_catalog(app: App, redis: dict, args) -> Catalog:
+    catalog = Catalog(app, redis["REDIS_CATALOG"])
+    catalog.load_data_from_filesystem(args.tracks, args.top_tracks, args.tracks, args.tracks)
+    catalog.upload_tracks_to_cache(
+        redis["REDIS_TRACKS_WITH_RECS"],
+        redis["REDIS_TRACKS_WITH_DIVERSE_RECS"],
+        redis["REDIS_TRACKS_WITH_RECS_CONTEXTUAL_V2"],
+    )
+    catalog.upload_artists_to_cache(redis["REDIS_ARTIST"])
+    catalog.upload_recommendations_to_cache(redis["REDIS_RECOMMENDATIONS"], "RECOMMENDATIONS_FILE_PATH")
+    catalog.upload_recommendations_to_cache(redis["REDIS_RECOMMENDATIONS_SVD"], "RECOMMENDATIONS_SVD_FILE_PATH")
+    return catalog
+
+
+def has_recommendations(path: str) -> bool:
+    return any(len(track.recommendations) for track in TrackFile(path))
+
+
+def load_retriever(config: dict, args) -> ContextRetriever:
+    if args.checkpoint:
+        model = load_model(args.checkpoint)
+        track_embeddings = torch.load(args.track_embeddings).cpu().numpy()
+    else:
+        model = ContextualRanker(model_config())
+        model.eval()
+        track_embeddings = np.random.randn(
+            model.track_embedding.num_embeddings, model.hidden_dims[-1]
+        ).astype(np.float32)
+
+    if config["CONTEXT_ENCODER"] == "numpy":
+        encoder = NumpyContextEncoder.from_weights(context_tower_weights(model))
+    else:
+        encoder = build_context_encoder(config, model)
+
+    track_index = TrackIndex.build(config, track_embeddings)
+    return ContextRetriever(encoder, track_index, config["TOP_TRACKS_PER_USER"])
+
+
+def measure(recommender, stream: list, warmup: int, alloc_requests: int) -> dict:
+    for user, track, track_time in stream[:warmup]:
+        recommender.recommend_next(user, track, track_time)
+
+    latencies = np.empty(len(stream), dtype=np.int64)
+    start = time.perf_counter()
+    for i, (user, track, track_time) in enumerate(stream):
+        call_start = time.perf_counter_ns()
+        recommender.recommend_next(user, track, track_time)
+        latencies[i] = time.perf_counter_ns() - call_start
+    elapsed = time.perf_counter() - start
+
+    # Tracing slows every allocation down, so it gets a separate pass
+    peak = 0
+    retained = 0
+    tracemalloc.start()
+    for user, track, track_time in stream[:alloc_requests]:
+        tracemalloc.clear_traces()
+        recommender.recommend_next(user, track, track_time)
+        current, call_peak = tracemalloc.get_traced_memory()
+        peak += call_peak
+        retained += current
+    tracemalloc.stop()
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) / 1000
+    calls = min(alloc_requests, len(stream)) or 1
+    return {
+        "requests": len(stream),
+        "throughput": len(stream) / elapsed,
+        "p50_us": p50,
+        "p95_us": p95,
+        "p99_us": p99,
+        "peak_alloc_bytes": peak / calls,
+        "retained_bytes": retained / calls,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_results(results: dict, baseline: dict):
+    header = f"{'recommender':<16}{'req/s':>10}{'p50, us':>10}{'p95, us':>10}{'p99, us':>10}{'peak B':>10}"
+    if baseline:
+        header += f"{'p50 vs base':>13}"
+    print(header)
+
+    for name, result in results.items():
+        line = (
+            f"{name:<16}{result['throughput']:>10.0f}{result['p50_us']:>10.1f}{result['p95_us']:>10.1f}"
+            f"{result['p99_us']:>10.1f}{result['peak_alloc_bytes']:>10.0f}"
+        )
+        if name in baseline:
+            line += f"{result['p50_us'] / baseline[name]['p50_us']:>12.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, default="./botify/config.json")
+    parser.add_argument("--tracks", type=str, default="./data/tracks.json")
+    parser.add_argument("--top-tracks", type=str, default="./data/top_tracks.json")
+    parser.add_argument("--recommendations", type=str, default="./data/recommendations_collaborative_user_based.json")
+    parser.add_argument("--log", type=str, default="./data/AB_test/log/data.json")
+    parser.add_argument("--checkpoint", type=str)
+    parser.add_argument("--track-embeddings", type=str)
+    parser.add_argument("--recommenders", nargs="+", default=list(RECOMMENDERS))
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--warmup", type=int, default=1000)
+    parser.add_argument("--alloc-requests", type=int, default=1000)
+    parser.add_argument("--output", type=str)
+    parser.add_argument("--baseline", type=str)
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = json.load(config_file)
+    config["RECOMMENDATIONS_FILE_PATH"] = args.recommendations
+    config["RECOMMENDATIONS_SVD_FILE_PATH"] = args.recommendations
+
+    if "contextual" in args.recommenders and not has_recommendations(args.tracks):
+        logging.getLogger("bench").warning(
+            f"{args.tracks} has no track recommendations, contextual only measures its random fallback: "
+            f"pass --tracks with the TRACKS_CATALOG of the server config"
+        )
+
+    redis = {prefix: InMemoryRedis() for prefix in REDIS_PREFIXES}
+    caches = {
+        name: LocalCache()
+        for name in ["tracks_with_recs", "tracks_with_diverse_recs", "artists"]
+    }
+    catalog = load_catalog(App(config), redis, args)
+    sampler = build_sampler(config, catalog.track_ids(), catalog.top_track_ids)
+    retriever = load_retriever(config, args) if "contextual_v2" in args.recommenders else None
+    resources = build_resources(
+        namespaced(redis, catalog.namespaces), caches, sampler, retriever, catalog.top_track_ids
+    )
+
+    stream = load_stream(args.log, args.requests)
+    results = {}
+    for name in args.recommenders:
+        recommender = RECOMMENDERS[name].from_resources(resources)
+        results[name] = measure(recommender, stream, args.warmup, args.alloc_requests)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(
+                {
+                    "commit": git_commit(),
+                    "timestamp": datetime.now().isoformat(),
+                    "python": platform.python_version(),
+                    "results": results,
+                },
+                output_file,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Measure the per-request overhead of picking a recommender:
+constructing recommenders on every request versus looking
+them up in the routing table built at startup.
+
+Redis is not touched, only the routing itself is timed::
+
+    python -m botify.bench.routing --requests 100000
+
+"""
+import argparse
+import time
+
+from botify.cache import LocalCache
+from botify.experiment import Experiments, Treatment
+from botify.recommenders.contextual import Contextual
+from botify.recommenders.contextual_v2 import ContextualV2
+from botify.recommenders.registry import Router, build_resources
+from botify.sampler import TrackSampler
+
+CONFIG = {
+    "RECOMMENDERS": {
+        "contextual": {"type": "contextual"},
+        "contextual_v2": {"type": "contextual_v2"},
+    },
+    "ROUTING": {
+        "experiment": "CONTEXTUAL_V2",
+        "treatments": {"C": "contextual", "T1": "contextual_v2"},
+    },
+}
+
+
+def per_request(resources, user: int):
+    treatment = Experiments.CONTEXTUAL_V2.assign(user)
+    if treatment == Treatment.T1:
+        return ContextualV2(resources.session, resources.retriever, resources.sampler)
+    else:
+        return Contextual(resources.tracks_with_recs, resources.sampler)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--tracks", type=int, default=50000)
+    args = parser.parse_args()
+
+    caches = {
+        name: LocalCache()
+        for name in ["tracks_with_recs", "tracks_with_diverse_recs", "artists"]
+    }
+    redis = {
+        prefix: object()
+        for prefix in [
+            "REDIS_TRACKS_WITH_RECS",
+            "REDIS_TRACKS_WITH_RECS_CONTEXTUAL_V2",
+            "REDIS_TRACKS_WITH_DIVERSE_RECS",
+            "REDIS_ARTIST",
+            "REDIS_RECOMMENDATIONS",
+            "REDIS_RECOMMENDATIONS_SVD",
+            "REDIS_SESSION",
+        ]
+    }
+    resources = build_resources(redis, caches, TrackSampler(range(args.tracks)))
+    router = Router.from_config(CONFIG, resources)
+    users = [i % args.users for i in range(args.requests)]
+
+    start = time.perf_counter()
+    for user in users:
+        per_request(resources, user)
+    before = (time.perf_counter() - start) / args.requests
+
+    start = time.perf_counter()
+    for user in users:
+        router.route(user)
+    after = (time.perf_counter() - start) / args.requests
+
+    print(f"per-request construction: {before * 1e6:.2f} us/request")
+    print(f"routing table lookup:     {after * 1e6:.2f} us/request")
+
+
+if __name__ == "__main__":
+    main()
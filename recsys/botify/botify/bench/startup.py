@@ -0,0 +1,109 @@
+"""
+Compare startup time and peak RSS of loading the context encoder
+and the track index from the Lightning checkpoint with torch and
+from the files written by botify.model.export. Every path runs in
+a fresh interpreter::
+
+    python -m botify.bench.startup --checkpoint ./checkpoints/epoch=47-step=16944.ckpt \
+        --track-embeddings ./checkpoints/track_embeddings.pt
+
+Without a checkpoint, an untrained model is saved to a temporary
+directory and exported from there.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import pytorch_lightning as pl
+import torch
+
+from botify.model.checkpoint import load_model, model_config
+from botify.model.export import export, export_track_index
+from botify.model.model import ContextualRanker
+
+TORCH = """
+import torch
+from botify.index import TrackIndex
+from botify.model.checkpoint import load_model
+from botify.model.encoder import build_context_encoder
+config = {config!r}
+model = load_model(config["CHECKPOINT_PATH"])
+track_embeddings = torch.load(config["TRACK_EMBEDDINGS_PATH"]).cpu().numpy()
+encoder = build_context_encoder(config, model)
+track_index = TrackIndex.build(config, track_embeddings)
+"""
+
+NUMPY = """
+from botify.index import TrackIndex
+from botify.model.numpy_encoder import load_exported
+config = {config!r}
+encoder = load_exported(config["CONTEXT_ENCODER_PATH"])
+track_index = TrackIndex.load(config)
+"""
+
+# ru_maxrss survives exec, so the peak of a forked child would include
+# its parent; VmHWM of /proc/self/status belongs to the new image only
+MEASURE = """
+import sys, time
+start = time.perf_counter()
+{code}
+track_index.search(encoder.encode([1], [2]), 40)
+elapsed = time.perf_counter() - start
+with open("/proc/self/status") as status:
+    max_rss_kb = next(line.split()[1] for line in status if line.startswith("VmHWM"))
+print(elapsed, max_rss_kb, "torch" in sys.modules)
+"""
+
+
+def save_untrained(directory: str):
+    model = ContextualRanker(model_config())
+    checkpoint = os.path.join(directory, "model.ckpt")
+    track_embeddings = os.path.join(directory, "track_embeddings.pt")
+    torch.save({"state_dict": model.state_dict(), "pytorch-lightning_version": pl.__version__}, checkpoint)
+    torch.save(torch.randn(model.track_embedding.num_embeddings, model.hidden_dims[-1]), track_embeddings)
+    return checkpoint, track_embeddings
+
+
+def run(code: str) -> dict:
+    output = subprocess.check_output([sys.executable, "-c", MEASURE.format(code=code)], env=os.environ)
+    elapsed, max_rss_kb, torch_imported = output.decode().split()
+    return {"seconds": float(elapsed), "max_rss_mb": int(max_rss_kb) / 1024, "torch_imported": torch_imported == "True"}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, default="./botify/config.json")
+    parser.add_argument("--checkpoint", type=str)
+    parser.add_argument("--track-embeddings", type=str)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.checkpoint:
+            checkpoint, track_embeddings = args.checkpoint, args.track_embeddings
+        else:
+            checkpoint, track_embeddings = save_untrained(directory)
+
+        with open(args.config) as config_file:
+            config = json.load(config_file)
+        config.update(
+            CHECKPOINT_PATH=checkpoint,
+            TRACK_EMBEDDINGS_PATH=track_embeddings,
+            CONTEXT_ENCODER_PATH=os.path.join(directory, "context_encoder.npz"),
+            TRACK_INDEX_PATH=os.path.join(directory, "track_index.faiss"),
+            TRACK_EMBEDDINGS_STORE_PATH=os.path.join(directory, "track_embeddings.npy"),
+        )
+        export(load_model(checkpoint), config["CONTEXT_ENCODER_PATH"])
+        export_track_index(config, torch.load(track_embeddings).cpu().numpy())
+
+        results = {
+            "torch": run(TORCH.format(config=dict(config, CONTEXT_ENCODER="factorized"))),
+            "numpy": run(NUMPY.format(config=config)),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Measure recall@k against exact float32 search, latency and memory
+of the track index for every storage type, with and without
+the exact re-rank::
+
+    python -m botify.bench.track_index --track-embeddings ./checkpoints/track_embeddings.pt \
+        --encoder ./checkpoints/context_encoder.npz
+
+Without embeddings random ones are used, with queries drawn
+from the same distribution.
+"""
+import argparse
+import json
+
+import numpy as np
+
+from botify.index import STORAGE, TrackIndex
+from botify.model.numpy_encoder import load_exported
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, default="./botify/config.json")
+    parser.add_argument("--track-embeddings", type=str)
+    parser.add_argument("--encoder", type=str)
+    parser.add_argument("--index-types", nargs="+", default=["flat", "ivf", "hnsw"])
+    parser.add_argument("--reranks", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = json.load(config_file)
+    k = config["TOP_TRACKS_PER_USER"]
+
+    if args.track_embeddings:
+        import torch
+
+        embeddings = torch.load(args.track_embeddings).cpu().numpy()
+    else:
+        embeddings = np.random.randn(50000, 128).astype(np.float32)
+
+    if args.encoder:
+        encoder = load_exported(args.encoder)
+        queries = encoder.encode(
+            np.random.randint(0, encoder.users_count, args.queries),
+            np.random.randint(0, encoder.tracks_count, args.queries),
+        )
+    else:
+        queries = np.random.randn(args.queries, embeddings.shape[1]).astype(np.float32)
+
+    print(f"{'index':<8}{'storage':<10}{'rerank':>8}{f'recall@{k}':>12}{'ms/query':>10}{'codes, MB':>11}{'saved':>8}")
+    for index_type in args.index_types:
+        for storage in STORAGE:
+            for rerank in args.reranks:
+                track_index = TrackIndex.build(
+                    dict(config, TRACK_INDEX_TYPE=index_type, TRACK_INDEX_STORAGE=storage, TRACK_INDEX_RERANK=rerank),
+                    embeddings,
+                )
+                report = track_index.recall_report(queries, k)
+                print(
+                    f"{index_type:<8}{storage:<10}{rerank:>8}{report.recall:>12.3f}{report.latency_ms:>10.3f}"
+                    f"{report.code_bytes / 2 ** 20:>11.1f}{1 - report.code_bytes / report.float32_bytes:>8.0%}"
+                )
+
+
+if __name__ == "__main__":
+    main()
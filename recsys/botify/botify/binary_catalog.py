@@ -0,0 +1,277 @@
+"""
+A columnar binary catalog compiled from the JSON sources of Catalog.
+
+The file starts with a magic string, the header size and a json
+header describing the arrays that follow, each aligned to ALIGNMENT
+bytes and located relative to the end of the header. The file
+is memory-mapped and every column is a view into the mapping,
+so opening it parses nothing but the header, and pages are shared
+by every process that maps the same file.
+
+For every track dataset there is an id array, artist ids into
+a string table shared by all datasets, a title string table and
+a CSR of recommendations (offsets + values). User recommendation
+files become a user id array and a CSR of tracks, top tracks
+become a plain id array.
+
+Run from the botify directory, paths default to config.json::
+
+    python -m botify.binary_catalog
+
+"""
+import argparse
+import json
+import os
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+from botify.track import Track
+
+MAGIC = b"BOTIFYC1"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+HEADER_SIZE = np.dtype("<u8")
+
+OFFSET = np.dtype("<i8")
+ID = np.dtype("<i4")
+BYTE = np.dtype("u1")
+
+# Dataset names are the ones Catalog uploads under, mapped to the config keys of their sources
+TRACK_DATASETS = {
+    "tracks_with_recs": "TRACKS_CATALOG",
+    "tracks_with_diverse_recs": "TRACKS_WITH_DIVERSE_RECS_CATALOG",
+    "tracks_with_recs_contextual_v2": "RECOMMENDATIONS_CONTEXTUAL_V2_FILE_PATH",
+}
+USER_DATASETS = ["RECOMMENDATIONS_FILE_PATH", "RECOMMENDATIONS_SVD_FILE_PATH"]
+TOP_TRACKS = "top_tracks"
+
+
+class Ragged:
+    """
+    Variable-length rows stored as offsets + values.
+    """
+
+    def __init__(self, offsets: np.ndarray, values: np.ndarray):
+        self.offsets = offsets
+        self.values = values
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    @staticmethod
+    def pack(rows: Sequence[Sequence[int]], dtype=ID) -> Tuple[np.ndarray, np.ndarray]:
+        offsets = np.zeros(len(rows) + 1, dtype=OFFSET)
+        np.cumsum([len(row) for row in rows], out=offsets[1:])
+        values = np.fromiter((value for row in rows for value in row), dtype=dtype, count=int(offsets[-1]))
+        return offsets, values
+
+
+class StringTable(Ragged):
+    def __getitem__(self, i: int) -> str:
+        return bytes(super().__getitem__(i)).decode("utf-8")
+
+    @staticmethod
+    def pack(strings: Sequence[str], dtype=BYTE) -> Tuple[np.ndarray, np.ndarray]:
+        return Ragged.pack([string.encode("utf-8") for string in strings], dtype)
+
+
+class TrackTable:
+    """
+    A read-only sequence of Track over the columns of one dataset.
+    Tracks are built on access, recommendations are views
+    into the mapped file.
+    """
+
+    def __init__(self, ids: np.ndarray, artist_ids: np.ndarray, artists: StringTable,
+                 titles: StringTable, recommendations: Ragged):
+        self.ids = ids
+        self.artist_ids = artist_ids
+        self.artists = artists
+        self.titles = titles
+        self.recommendations = recommendations
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, i: int) -> Track:
+        return Track(int(self.ids[i]), self.artists[self.artist_ids[i]], self.titles[i], self.recommendations[i])
+
+    def __iter__(self) -> Iterator[Track]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def artist_tracks(self) -> Iterator[Tuple[str, np.ndarray]]:
+        """
+        Track ids of every artist, in the order of the dataset.
+        """
+        order = np.argsort(self.artist_ids, kind="stable")
+        artist_ids = self.artist_ids[order]
+        starts = np.flatnonzero(np.r_[True, artist_ids[1:] != artist_ids[:-1]])
+        for start, end in zip(starts, np.r_[starts[1:], len(order)]):
+            yield self.artists[artist_ids[start]], self.ids[order[start:end]]
+
+
+class UserRecommendations:
+    def __init__(self, users: np.ndarray, tracks: Ragged):
+        self.users = users
+        self.tracks = tracks
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def __iter__(self) -> Iterator[Tuple[int, np.ndarray]]:
+        for i in range(len(self)):
+            yield int(self.users[i]), self.tracks[i]
+
+
+class BinaryCatalog:
+    def __init__(self, path: str):
+        self.path = path
+        self.buffer = np.memmap(path, dtype=BYTE, mode="r")
+        if bytes(self.buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a binary catalog")
+
+        header_start = len(MAGIC) + HEADER_SIZE.itemsize
+        header_size = int(self.buffer[len(MAGIC):header_start].view(HEADER_SIZE)[0])
+        header = json.loads(bytes(self.buffer[header_start:header_start + header_size]))
+        if header["version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported binary catalog version: {header['version']}")
+
+        self.digests = header["digests"]
+        self.arrays = {}
+        data_start = aligned(header_start + header_size)
+        for name, (dtype, offset, count) in header["arrays"].items():
+            offset += data_start
+            # Plain ndarray views: slicing a memmap subclass is several times slower
+            self.arrays[name] = np.frombuffer(self.buffer, dtype=dtype, count=count, offset=offset)
+
+        self.artists = StringTable(self.arrays["artists.offsets"], self.arrays["artists.values"])
+
+    def tracks(self, dataset: str) -> TrackTable:
+        return TrackTable(
+            self.arrays[f"{dataset}.ids"],
+            self.arrays[f"{dataset}.artists"],
+            self.artists,
+            StringTable(self.arrays[f"{dataset}.titles.offsets"], self.arrays[f"{dataset}.titles.values"]),
+            Ragged(self.arrays[f"{dataset}.recommendations.offsets"], self.arrays[f"{dataset}.recommendations.values"]),
+        )
+
+    def user_recommendations(self, dataset: str) -> UserRecommendations:
+        return UserRecommendations(
+            self.arrays[f"{dataset}.users"],
+            Ragged(self.arrays[f"{dataset}.tracks.offsets"], self.arrays[f"{dataset}.tracks.values"]),
+        )
+
+    @property
+    def top_track_ids(self) -> np.ndarray:
+        return self.arrays[TOP_TRACKS]
+
+
+def aligned(size: int) -> int:
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def write(path: str, arrays: Dict[str, np.ndarray], digests: Dict[str, str]):
+    """
+    Write the arrays to a temporary file and move it over the path,
+    so processes that have the old catalog mapped keep reading it.
+    """
+    layout = {}
+    size = 0
+    for name, array in arrays.items():
+        layout[name] = [array.dtype.str, size, len(array)]
+        size += aligned(array.nbytes)
+    header = json.dumps({"version": FORMAT_VERSION, "digests": digests, "arrays": layout}).encode("utf-8")
+    data_start = aligned(len(MAGIC) + HEADER_SIZE.itemsize + len(header))
+
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as file_handle:
+        file_handle.write(MAGIC)
+        file_handle.write(np.array([len(header)], dtype=HEADER_SIZE).tobytes())
+        file_handle.write(header)
+        for name, array in arrays.items():
+            file_handle.seek(data_start + layout[name][1])
+            file_handle.write(np.ascontiguousarray(array).tobytes())
+        file_handle.truncate(data_start + size)
+    os.replace(temporary_path, path)
+
+
+def pack_tracks(dataset: str, tracks: List[Track], artist_ids: Dict[str, int]) -> Dict[str, np.ndarray]:
+    arrays = {
+        f"{dataset}.ids": np.array([track.track for track in tracks], dtype=ID),
+        f"{dataset}.artists": np.array(
+            [artist_ids.setdefault(track.artist, len(artist_ids)) for track in tracks], dtype=ID
+        ),
+    }
+    arrays[f"{dataset}.titles.offsets"], arrays[f"{dataset}.titles.values"] = StringTable.pack(
+        [track.title for track in tracks]
+    )
+    arrays[f"{dataset}.recommendations.offsets"], arrays[f"{dataset}.recommendations.values"] = Ragged.pack(
+        [track.recommendations for track in tracks]
+    )
+    return arrays
+
+
+def pack_user_recommendations(dataset: str, path: str) -> Dict[str, np.ndarray]:
+    users = []
+    tracks = []
+    with open(path) as recommendations_file:
+        for line in recommendations_file:
+            recommendations = json.loads(line)
+            users.append(recommendations["user"])
+            tracks.append(recommendations["tracks"])
+
+    arrays = {f"{dataset}.users": np.array(users, dtype=ID)}
+    arrays[f"{dataset}.tracks.offsets"], arrays[f"{dataset}.tracks.values"] = Ragged.pack(tracks)
+    return arrays
+
+
+def compile_catalog(config, path: str):
+    # catalog imports this module for TrackTable
+    from botify.catalog import Catalog
+
+    arrays = {}
+    digests = {}
+    artist_ids = {}
+    for dataset, config_key in TRACK_DATASETS.items():
+        source = config[config_key]
+        arrays.update(pack_tracks(dataset, Catalog.load_track_data_from_file(source), artist_ids))
+        digests[dataset] = Catalog.content_hash(source)
+
+    for dataset in USER_DATASETS:
+        arrays.update(pack_user_recommendations(dataset, config[dataset]))
+        digests[dataset] = Catalog.content_hash(config[dataset])
+
+    with open(config["TOP_TRACKS_CATALOG"]) as top_tracks_file:
+        arrays[TOP_TRACKS] = np.array(json.load(top_tracks_file), dtype=ID)
+
+    arrays["artists.offsets"], arrays["artists.values"] = StringTable.pack(list(artist_ids))
+    write(path, arrays, digests)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, default="./botify/config.json")
+    parser.add_argument("--output", type=str)
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = json.load(config_file)
+    output = args.output or config["CATALOG_BINARY_PATH"]
+
+    compile_catalog(config, output)
+    catalog = BinaryCatalog(output)
+    print(f"Compiled {output}, {os.path.getsize(output) / 2 ** 20:.1f} MB")
+    for dataset in TRACK_DATASETS:
+        print(f"{dataset}: {len(catalog.tracks(dataset))} tracks")
+    for dataset in USER_DATASETS:
+        print(f"{dataset}: {len(catalog.user_recommendations(dataset))} users")
+    print(f"{TOP_TRACKS}: {len(catalog.top_track_ids)} tracks")
+
+
+if __name__ == "__main__":
+    main()
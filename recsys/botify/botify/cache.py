@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Union
+
+from flask_redis import Redis
+from redis.client import StrictRedis
+
+from botify.metrics import stage
+from botify.utils import from_bytes
+
+
+class LocalCache:
+    """
+    A bounded in-process LRU cache.
+
+    The cache holds at most max_entries values and, if max_bytes
+    is set, at most max_bytes of encoded payload. Entries older than
+    ttl seconds are treated as missing. Every entry is tagged with
+    the generation it was loaded in, bumping the generation
+    invalidates all of them at once (the catalog does so on reload).
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: Optional[int] = None, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self.entries = OrderedDict()
+        self.size = 0
+        self.generation = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, _, generation, expires = entry
+            if generation != self.generation or (expires is not None and expires < time.monotonic()):
+                self.remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size: int = 0, generation: Optional[int] = None):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                # The value was read before a reload and may be stale
+                return
+
+            if key in self.entries:
+                self.remove(key)
+
+            self.entries[key] = (value, size, self.generation, expires)
+            self.size += size
+
+            while len(self.entries) > self.max_entries or (self.max_bytes is not None and self.size > self.max_bytes):
+                _, (_, evicted_size, _, _) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def remove(self, key):
+        _, size, _, _ = self.entries.pop(key)
+        self.size -= size
+
+    def bump_generation(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "generation": self.generation,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class ReadThroughCache:
+    """
+    Serve decoded redis values from a local cache,
+    going to redis only on a cache miss.
+    """
+
+    def __init__(self, redis: Union[Redis, StrictRedis], cache: LocalCache, decode: Callable = from_bytes,
+                 name: str = "cache"):
+        self.redis = redis
+        self.cache = cache
+        self.decode = decode
+        self.stage = f"redis_get_{name}"
+
+    def get(self, key):
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+
+        generation = self.cache.generation
+        with stage(self.stage):
+            data = self.redis.get(key)
+        if data is None:
+            return None
+
+        value = self.decode(data)
+        self.cache.put(key, value, len(data), generation)
+        return value
+
+    async def get_async(self, key):
+        """
+        Same as get, for a cache wrapping an asyncio redis client.
+        """
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+
+        generation = self.cache.generation
+        with stage(self.stage):
+            data = await self.redis.get(key)
+        if data is None:
+            return None
+
+        value = self.decode(data)
+        self.cache.put(key, value, len(data), generation)
+        return value
+
+
+def build_cache(config, prefix: str) -> LocalCache:
+    return LocalCache(
+        max_entries=config.get(f"{prefix}_MAX_ENTRIES", 10000),
+        max_bytes=config.get(f"{prefix}_MAX_BYTES"),
+        ttl=config.get(f"{prefix}_TTL"),
+    )
@@ -1,100 +1,325 @@
-import itertools
+import array
+import collections
+import hashlib
 import json
-from typing import Union
+import time
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Tuple, Union
+
+import numpy as np
 
 from flask_redis import Redis
 from redis.client import StrictRedis
 
+from botify.binary_catalog import BinaryCatalog, TrackTable
+from botify.cache import LocalCache
 from botify.track import Track
-from botify.utils import to_bytes
+from botify.utils import VERSION, to_bytes
+
+
+class TrackFile:
+    """
+    Tracks of a JSON-lines file, parsed one line at a time
+    on every iteration, so a dataset is never held in memory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __iter__(self) -> Iterator[Track]:
+        with open(self.path) as file_handle:
+            for line in file_handle:
+                data = json.loads(line)
+                yield Track(
+                    data["track"],
+                    data["artist"],
+                    data["title"],
+                    np.array(data.get("recommendations", []), dtype=np.int32),
+                )
 
 
 class Catalog:
     """
     A helper class used to load track data upon server startup
     and store the data to redis.
+
+    Records are streamed from the source to redis with pipelined
+    SETs in chunks of REDIS_UPLOAD_CHUNK_SIZE. Every dataset goes
+    to a namespace derived from the content hash of its source:
+    keys are "<namespace>:<key>", and the bare namespace key is set
+    last and marks the upload complete. A dataset whose source did
+    not change is found in its namespace and not uploaded again,
+    and a changed one is written next to the old data, which keeps
+    being served until the switch to the new namespace. If a catalog
+    redis is provided, the namespaces of every dataset are recorded
+    there, so that the stale ones can be collected.
+
+    Local caches attached to the catalog are invalidated
+    whenever a dataset is (re)uploaded.
+
+    The data comes either from the JSON sources or from a binary
+    catalog compiled from them by botify.binary_catalog, which is
+    memory-mapped instead of parsed. The binary catalog carries
+    the content hashes of its sources, so switching between the two
+    does not trigger a re-upload.
+
+    Track ids and the tracks of every artist are collected while
+    tracks_with_recs streams by; after the upload, release() drops
+    everything but the track ids and the top tracks.
     """
 
-    def __init__(self, app):
+    def __init__(self, app, catalog_redis: Optional[Union[Redis, StrictRedis]] = None):
         self.app = app
+        self.catalog_redis = catalog_redis
+        self.chunk_size = app.config.get("REDIS_UPLOAD_CHUNK_SIZE", 10000)
+        self.caches = []
 
         self.tracks_with_recs = []
         self.tracks_with_diverse_recs = []
         self.top_track_ids = []
         self.tracks_with_recs_contextual_v2 = []
 
+        self.tracks_with_recs_path = None
+        self.tracks_with_diverse_recs_path = None
+        self.tracks_with_recs_contextual_v2_path = None
+        self.binary = None
+
+        self.indexed_track_ids = None
+        self.indexed_artists = None
+        self.namespaces = {}
+
+    def attach_cache(self, cache: LocalCache):
+        self.caches.append(cache)
+        return self
+
     def load_data_from_filesystem(self, tracks_with_recs_path: str, top_tracks_path: str,
                                   tracks_with_diverse_recs_path: str, tracks_with_recs_contextual_v2_path: str):
-        self.app.logger.info(f"Loading tracks from {tracks_with_recs_path}")
-        self.tracks_with_recs = self.load_track_data_from_file(tracks_with_recs_path)
-        self.app.logger.info(f"Loaded {len(self.tracks_with_recs)} tracks")
-
-        self.app.logger.info(f"Loading tracks with diverse recommendations from {tracks_with_diverse_recs_path}")
-        self.tracks_with_diverse_recs = self.load_track_data_from_file(tracks_with_diverse_recs_path)
-        self.app.logger.info(f"Loaded {len(self.tracks_with_diverse_recs)} tracks with diverse recs")
+        self.tracks_with_recs = TrackFile(tracks_with_recs_path)
+        self.tracks_with_recs_path = tracks_with_recs_path
+        self.tracks_with_diverse_recs = TrackFile(tracks_with_diverse_recs_path)
+        self.tracks_with_diverse_recs_path = tracks_with_diverse_recs_path
+        self.tracks_with_recs_contextual_v2 = TrackFile(tracks_with_recs_contextual_v2_path)
+        self.tracks_with_recs_contextual_v2_path = tracks_with_recs_contextual_v2_path
 
         self.app.logger.info(f"Loading top tracks from {top_tracks_path}")
         with open(top_tracks_path) as top_tracks_file:
             self.top_track_ids = json.load(top_tracks_file)
         self.app.logger.info(f"Loaded {len(self.top_track_ids)} top tracks")
 
-        self.app.logger.info(f"Loading tracks from {tracks_with_recs_contextual_v2_path}")
-        self.tracks_with_recs_contextual_v2 = self.load_track_data_from_file(tracks_with_recs_contextual_v2_path)
-        self.app.logger.info(f"Loaded {len(self.tracks_with_recs_contextual_v2)} tracks")
+        return self
+
+    def load_data_from_binary(self, path: str):
+        self.app.logger.info(f"Mapping binary catalog {path}")
+        self.binary = BinaryCatalog(path)
+        self.tracks_with_recs = self.binary.tracks("tracks_with_recs")
+        self.tracks_with_diverse_recs = self.binary.tracks("tracks_with_diverse_recs")
+        self.tracks_with_recs_contextual_v2 = self.binary.tracks("tracks_with_recs_contextual_v2")
+        self.top_track_ids = self.binary.top_track_ids.tolist()
+        self.tracks_with_recs_path = path
+        self.tracks_with_diverse_recs_path = path
+        self.tracks_with_recs_contextual_v2_path = path
+        # Copied out of the mapping, so release() can unmap it
+        self.indexed_track_ids = self.tracks_with_recs.ids.copy()
+        self.app.logger.info(
+            f"Mapped {len(self.tracks_with_recs)} tracks, "
+            f"{len(self.tracks_with_diverse_recs)} tracks with diverse recs, "
+            f"{len(self.tracks_with_recs_contextual_v2)} contextual v2 tracks, "
+            f"{len(self.top_track_ids)} top tracks"
+        )
 
         return self
 
+    def track_ids(self) -> list:
+        if self.indexed_track_ids is None:
+            collections.deque(self.index_tracks(self.tracks_with_recs), maxlen=0)
+        return self.indexed_track_ids.tolist()
+
+    def index_tracks(self, tracks: Iterable[Track]) -> Iterator[Track]:
+        """
+        Pass tracks through, collecting track ids and the tracks
+        of every artist once the whole dataset has been seen.
+        """
+        track_ids = array.array("i")
+        artists = collections.defaultdict(lambda: array.array("i"))
+        for track in tracks:
+            track_ids.append(track.track)
+            artists[track.artist].append(track.track)
+            yield track
+
+        self.indexed_track_ids = np.frombuffer(track_ids, dtype=np.int32)
+        self.indexed_artists = artists
+
+    def release(self):
+        """
+        Drop the datasets and the artist index, which are only needed
+        for the upload, and unmap the binary catalog.
+        """
+        self.track_ids()
+        self.tracks_with_recs = []
+        self.tracks_with_diverse_recs = []
+        self.tracks_with_recs_contextual_v2 = []
+        self.indexed_artists = None
+        self.binary = None
+
     @staticmethod
     def load_track_data_from_file(path: str) -> list:
-        tracks = []
-        with open(path) as file_handle:
-            for j, line in enumerate(file_handle):
-                data = json.loads(line)
-                tracks.append(Track(data["track"], data["artist"], data["title"], data["recommendations"], ))
-
-        return tracks
+        return list(TrackFile(path))
 
     def upload_tracks_to_cache(self, redis_tracks_with_recs: Union[Redis, StrictRedis],
                                redis_tracks_with_diverse_recs: Union[Redis, StrictRedis],
                                redis_tracks_with_recs_contextual_v2: Union[Redis, StrictRedis]):
         self.app.logger.info(f"Uploading tracks to redis")
 
-        for track in self.tracks_with_recs:
-            redis_tracks_with_recs.set(track.track, to_bytes(track))
-
-        for track in self.tracks_with_diverse_recs:
-            redis_tracks_with_diverse_recs.set(track.track, to_bytes(track))
-
-        for track in self.tracks_with_recs_contextual_v2:
-            redis_tracks_with_recs_contextual_v2.set(track.track, to_bytes(track))
-
-        self.app.logger.info(
-            f"Uploaded {len(self.tracks_with_recs)} tracks with recs, "
-            f"{len(self.tracks_with_diverse_recs)} tracks with diverse recs, "
-            f"{len(self.tracks_with_recs)} tracks with diverse contextual recs"
+        self.upload_dataset(
+            "tracks_with_recs",
+            redis_tracks_with_recs,
+            self.source_hash("tracks_with_recs", self.tracks_with_recs_path),
+            ((track.track, to_bytes(track)) for track in self.indexed(self.tracks_with_recs)),
+        )
+        self.upload_dataset(
+            "tracks_with_diverse_recs",
+            redis_tracks_with_diverse_recs,
+            self.source_hash("tracks_with_diverse_recs", self.tracks_with_diverse_recs_path),
+            ((track.track, to_bytes(track)) for track in self.tracks_with_diverse_recs),
+        )
+        self.upload_dataset(
+            "tracks_with_recs_contextual_v2",
+            redis_tracks_with_recs_contextual_v2,
+            self.source_hash("tracks_with_recs_contextual_v2", self.tracks_with_recs_contextual_v2_path),
+            ((track.track, to_bytes(track)) for track in self.tracks_with_recs_contextual_v2),
         )
 
     def upload_artists_to_cache(self, redis: Union[Redis, StrictRedis]):
         self.app.logger.info(f"Uploading artists to redis")
 
-        sorted_tracks = sorted(self.tracks_with_recs, key=lambda t: t.artist)
-        for j, (artist, artist_catalog) in enumerate(
-                itertools.groupby(sorted_tracks, key=lambda t: t.artist)
-        ):
-            artist_tracks = [t.track for t in artist_catalog]
-            redis.set(artist, to_bytes(artist_tracks))
+        self.upload_dataset(
+            "artists",
+            redis,
+            self.source_hash("tracks_with_recs", self.tracks_with_recs_path),
+            ((artist, to_bytes(track_ids)) for artist, track_ids in self.artist_tracks()),
+        )
+
+    def artist_tracks(self) -> Iterable[Tuple[str, Sequence[int]]]:
+        if isinstance(self.tracks_with_recs, TrackTable):
+            return self.tracks_with_recs.artist_tracks()
+
+        if self.indexed_artists is None:
+            collections.deque(self.index_tracks(self.tracks_with_recs), maxlen=0)
+        return (
+            (artist, np.frombuffer(track_ids, dtype=np.int32))
+            for artist, track_ids in sorted(self.indexed_artists.items())
+        )
 
-        self.app.logger.info(f"Uploaded {j + 1} artists")
+    def indexed(self, tracks: Iterable[Track]) -> Iterable[Track]:
+        if isinstance(tracks, TrackTable) or self.indexed_artists is not None:
+            return tracks
+        return self.index_tracks(tracks)
 
     def upload_recommendations_to_cache(self, redis: Union[Redis, StrictRedis], recommendations_path: str):
         self.app.logger.info(f"Uploading recommendations to redis")
 
         recommendations_file_path = self.app.config[recommendations_path]
-        with open(recommendations_file_path) as recommendations_file:
-            for j, line in enumerate(recommendations_file):
-                recommendations = json.loads(line)
-                redis.set(
-                    recommendations["user"], to_bytes(recommendations["tracks"])
+
+        def read_recommendations():
+            if self.binary is not None:
+                for user, tracks in self.binary.user_recommendations(recommendations_path):
+                    yield user, to_bytes(tracks)
+                return
+
+            with open(recommendations_file_path) as recommendations_file:
+                for line in recommendations_file:
+                    recommendations = json.loads(line)
+                    yield recommendations["user"], to_bytes(recommendations["tracks"])
+
+        self.upload_dataset(
+            recommendations_path,
+            redis,
+            self.source_hash(recommendations_path, recommendations_file_path),
+            read_recommendations(),
+        )
+
+    def upload_dataset(self, dataset: str, redis: Union[Redis, StrictRedis], digest: str,
+                       records: Iterable[Tuple[object, bytes]]):
+        namespace = self.namespace(dataset, digest)
+        self.namespaces[dataset] = namespace
+        if self.catalog_redis is not None:
+            self.catalog_redis.sadd(f"namespaces:{dataset}", namespace)
+
+        if redis.get(namespace) is not None:
+            self.app.logger.info(f"Dataset {dataset} is unchanged since the last upload, skipping")
+            return
+
+        start = time.time()
+        count = 0
+        size = 0
+
+        pipeline = redis.pipeline(transaction=False)
+        for key, value in records:
+            pipeline.set(f"{namespace}:{key}", value)
+            count += 1
+            size += len(value)
+            if count % self.chunk_size == 0:
+                pipeline.execute()
+        pipeline.set(namespace, count)
+        pipeline.execute()
+
+        elapsed = max(time.time() - start, 1e-6)
+        for cache in self.caches:
+            cache.bump_generation()
+
+        self.app.logger.info(
+            f"Uploaded {count} records of {dataset} to namespace {namespace} in {elapsed:.2f}s: "
+            f"{count / elapsed:.0f} records/s, {size / elapsed / 2 ** 20:.2f} MB/s"
+        )
+
+    def collect_garbage(self, redis: Dict[str, Union[Redis, StrictRedis]], batch_size: int = 10000):
+        """
+        Delete every recorded namespace of a dataset but the one
+        this catalog uploaded to. redis maps datasets to the
+        databases they live in.
+        """
+        if self.catalog_redis is None:
+            return
+
+        for dataset, namespace in self.namespaces.items():
+            for stale in self.catalog_redis.smembers(f"namespaces:{dataset}"):
+                stale = stale.decode()
+                if stale == namespace:
+                    continue
+
+                start = time.time()
+                count = self.delete_namespace(redis[dataset], stale, batch_size)
+                self.catalog_redis.srem(f"namespaces:{dataset}", stale)
+                self.app.logger.info(
+                    f"Deleted {count} keys of namespace {stale} of {dataset} in {time.time() - start:.2f}s"
                 )
 
-        self.app.logger.info(f"Uploaded recommendations for {j + 1} users")
+    @staticmethod
+    def delete_namespace(redis: Union[Redis, StrictRedis], namespace: str, batch_size: int) -> int:
+        # The marker goes first, so a half-deleted namespace is never taken for a complete one
+        redis.delete(namespace)
+        count = 0
+        pipeline = redis.pipeline(transaction=False)
+        for key in redis.scan_iter(match=f"{namespace}:*", count=batch_size):
+            pipeline.unlink(key)
+            count += 1
+            if count % batch_size == 0:
+                pipeline.execute()
+        pipeline.execute()
+        return count
+
+    @staticmethod
+    def namespace(dataset: str, digest: str) -> str:
+        return hashlib.sha1(f"{dataset}:{digest}".encode()).hexdigest()[:16]
+
+    def source_hash(self, dataset: str, path: str) -> str:
+        if self.binary is not None:
+            return self.binary.digests[dataset]
+        return self.content_hash(path)
+
+    @staticmethod
+    def content_hash(path: str) -> str:
+        digest = hashlib.sha1(f"v{VERSION}".encode())
+        with open(path, "rb") as file_handle:
+            for chunk in iter(lambda: file_handle.read(2 ** 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
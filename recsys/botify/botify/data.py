@@ -1,10 +1,16 @@
+import atexit
+import json
 import logging
-from dataclasses import dataclass, asdict
+import os
+import queue
+import threading
+from dataclasses import dataclass
 from logging.handlers import RotatingFileHandler
+from typing import Dict, List, Optional
 
-from pythonjsonlogger import jsonlogger
+from botify.experiment import Experiments, Treatment
 
-from botify.experiment import Experiments
+STOP = None
 
 
 @dataclass
@@ -25,26 +31,114 @@ class DataLogger:
     Use an object of this class to write logs of
     user events. These logs are subsequently loaded
     to HDFS for analysis.
-    """
 
-    def __init__(self, app):
-        self.logger = logging.getLogger("data")
+    Request threads only put the event to a bounded queue.
+    A background writer serializes events in batches of up to
+    DATA_LOG_BATCH_SIZE records and appends them to the file.
+    When the writer falls behind and the queue is full, events
+    are dropped and counted instead of blocking the request.
+
+    Prefork workers pass their index and write to a file of their
+    own next to DATA_LOG_FILE, since processes appending to and
+    rotating the same file would corrupt it.
+    """
 
-        handler = RotatingFileHandler(
-            app.config["DATA_LOG_FILE"],
+    def __init__(self, app, worker: Optional[int] = None):
+        self.handler = RotatingFileHandler(
+            self.log_file(app.config["DATA_LOG_FILE"], worker),
             maxBytes=app.config["DATA_LOG_FILE_MAX_BYTES"],
             backupCount=app.config["DATA_LOG_FILE_BACKUP_COPIES"],
         )
-        formatter = jsonlogger.JsonFormatter()
-        handler.setFormatter(formatter)
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
 
-        self.logger.addHandler(handler)
+        self.batch_size = app.config.get("DATA_LOG_BATCH_SIZE", 1000)
+        self.queue = queue.Queue(maxsize=app.config.get("DATA_LOG_QUEUE_SIZE", 100000))
         self.experiment_context = Experiments()
 
-    def log(self, location, datum: Datum):
-        values = asdict(datum)
-        values["experiments"] = {
-            experiment.name: experiment.assign(datum.user).name
-            for experiment in self.experiment_context.experiments
+        self.dropped = 0
+        self.written = 0
+        self.lock = threading.Lock()
+        self.writer = None
+        atexit.register(self.close)
+
+    @staticmethod
+    def log_file(path: str, worker: Optional[int]) -> str:
+        if worker is None:
+            return path
+        root, extension = os.path.splitext(path)
+        return f"{root}.worker{worker}{extension}"
+
+    def log(self, location, datum: Datum, experiments: Optional[Dict[str, Treatment]] = None):
+        """
+        Queue the event for writing. Pass the treatments already
+        assigned while serving the request as experiments, so
+        the writer does not have to assign them again.
+        """
+        self.ensure_writer()
+        try:
+            self.queue.put_nowait((location, datum, experiments))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def ensure_writer(self):
+        # Started on first use rather than in __init__, so that
+        # a logger created before fork gets a writer in every worker
+        if self.writer is not None and self.writer.is_alive():
+            return
+        with self.lock:
+            if self.writer is None or not self.writer.is_alive():
+                self.writer = threading.Thread(target=self.write_forever, name="data-logger", daemon=True)
+                self.writer.start()
+
+    def write_forever(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = STOP in batch
+            events = [event for event in batch if event is not STOP]
+            if events:
+                self.write(events)
+            if stop:
+                return
+
+    def write(self, events: List[tuple]):
+        lines = "\n".join(json.dumps(self.to_record(*event)) for event in events)
+        self.handler.emit(logging.makeLogRecord({"msg": lines}))
+        self.written += len(events)
+
+    def to_record(self, location, datum: Datum, experiments: Optional[Dict[str, Treatment]]) -> dict:
+        assigned = experiments or {}
+        return {
+            "message": location,
+            "timestamp": datum.timestamp,
+            "user": datum.user,
+            "track": datum.track,
+            "time": datum.time,
+            "latency": datum.latency,
+            "recommendation": datum.recommendation,
+            "experiments": {
+                experiment.name: assigned[experiment.name].name
+                if experiment.name in assigned
+                else experiment.assign(datum.user).name
+                for experiment in self.experiment_context.experiments
+            },
         }
-        self.logger.info(location, extra=values)
+
+    def stats(self) -> dict:
+        return {"queued": self.queue.qsize(), "dropped": self.dropped, "written": self.written}
+
+    def close(self):
+        """
+        Write the queued events and stop the writer.
+        """
+        writer = self.writer
+        if writer is not None and writer.is_alive():
+            self.queue.put(STOP)
+            writer.join()
+        self.handler.close()
@@ -1,6 +1,11 @@
 from enum import Enum
+from typing import Dict, List, Optional
 
 import mmh3
+import numpy as np
+
+C1 = np.uint32(0xCC9E2D51)
+C2 = np.uint32(0x1B873593)
 
 
 class Treatment(Enum):
@@ -43,11 +48,29 @@ class Experiment:
         self.name = name
         self.split = split
         self.hash = mmh3.hash(self.name)
+        self.table: Optional[List[Treatment]] = None
 
     def assign(self, user: int) -> Treatment:
+        if self.table is not None and 0 <= user < len(self.table):
+            return self.table[user]
         user_hash = mmh3.hash(str(user), self.hash, False)
         return Treatment(user_hash % self.split.value)
 
+    def assign_many(self, users: np.ndarray) -> np.ndarray:
+        """
+        Assign an array of non-negative user ids at once.
+        Returns treatment values, the same as assign(user).value.
+        """
+        return (murmur3_users(users, self.hash) % np.uint32(self.split.value)).astype(np.uint8)
+
+    def precompute(self, users_count: int):
+        """
+        Assign users 0..users_count-1 up front, so that assign
+        is a list lookup for them.
+        """
+        treatments = list(Treatment)
+        self.table = [treatments[code] for code in self.assign_many(np.arange(users_count))]
+
     def __repr__(self):
         return f"{self.name}:{self.split}"
 
@@ -68,3 +91,71 @@ class Experiments:
 
     def __init__(self):
         self.experiments = [Experiments.CONTEXTUAL_V2]
+
+    def assign_many(self, users: np.ndarray) -> Dict[str, np.ndarray]:
+        return {experiment.name: experiment.assign_many(users) for experiment in self.experiments}
+
+    @staticmethod
+    def all() -> List[Experiment]:
+        return [value for value in vars(Experiments).values() if isinstance(value, Experiment)]
+
+    @staticmethod
+    def precompute(users_count: int):
+        for experiment in Experiments.all():
+            experiment.precompute(users_count)
+
+
+def rotl(x: np.ndarray, r: int) -> np.ndarray:
+    return (x << np.uint32(r)) | (x >> np.uint32(32 - r))
+
+
+def murmur3_users(users: np.ndarray, seed: int) -> np.ndarray:
+    """
+    Vectorized mmh3.hash(str(user), seed, False). Users are grouped
+    by the number of decimal digits, so every group hashes keys of
+    the same length.
+    """
+    users = np.asarray(users, dtype=np.int64)
+    if (users < 0).any():
+        raise ValueError("User ids must be non-negative")
+
+    hashes = np.empty(len(users), dtype=np.uint32)
+    lengths = np.ones(len(users), dtype=np.int64)
+    for power in range(1, 19):
+        lengths += users >= 10 ** power
+
+    for length in np.unique(lengths):
+        mask = lengths == length
+        group = users[mask]
+        # ASCII codes of the decimal digits, most significant first
+        powers = 10 ** np.arange(length - 1, -1, -1, dtype=np.int64)
+        digits = ((group[:, None] // powers) % 10 + ord("0")).astype(np.uint32)
+        hashes[mask] = murmur3_digits(digits, seed)
+    return hashes
+
+
+def murmur3_digits(data: np.ndarray, seed: int) -> np.ndarray:
+    rows, length = data.shape
+    h = np.full(rows, seed & 0xFFFFFFFF, dtype=np.uint32)
+
+    blocks = length // 4
+    for block in range(blocks):
+        b = data[:, block * 4:block * 4 + 4]
+        k = b[:, 0] | (b[:, 1] << np.uint32(8)) | (b[:, 2] << np.uint32(16)) | (b[:, 3] << np.uint32(24))
+        k = rotl(k * C1, 15) * C2
+        h = rotl(h ^ k, 13) * np.uint32(5) + np.uint32(0xE6546B64)
+
+    tail = data[:, blocks * 4:]
+    if tail.shape[1]:
+        k = np.zeros(rows, dtype=np.uint32)
+        for i in reversed(range(tail.shape[1])):
+            k ^= tail[:, i] << np.uint32(8 * i)
+        h ^= rotl(k * C1, 15) * C2
+
+    h ^= np.uint32(length)
+    h ^= h >> np.uint32(16)
+    h *= np.uint32(0x85EBCA6B)
+    h ^= h >> np.uint32(13)
+    h *= np.uint32(0xC2B2AE35)
+    h ^= h >> np.uint32(16)
+    return h
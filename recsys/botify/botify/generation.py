@@ -0,0 +1,252 @@
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from botify import metrics
+from botify.cache import LocalCache
+from botify.catalog import Catalog
+from botify.recommenders.registry import Resources, Router
+
+# Datasets the catalog uploads and the redis config prefixes of their databases
+DATASET_REDIS = {
+    "tracks_with_recs": "REDIS_TRACKS_WITH_RECS",
+    "tracks_with_diverse_recs": "REDIS_TRACKS_WITH_DIVERSE_RECS",
+    "tracks_with_recs_contextual_v2": "REDIS_TRACKS_WITH_RECS_CONTEXTUAL_V2",
+    "artists": "REDIS_ARTIST",
+    "RECOMMENDATIONS_FILE_PATH": "REDIS_RECOMMENDATIONS",
+    "RECOMMENDATIONS_SVD_FILE_PATH": "REDIS_RECOMMENDATIONS_SVD",
+}
+
+
+class Namespaced:
+    """
+    A read-only view of a redis client, sync or asyncio,
+    with every key prefixed by the namespace of a dataset.
+    """
+
+    def __init__(self, redis, namespace: str):
+        self.redis = redis
+        self.namespace = namespace
+
+    def get(self, key):
+        return self.redis.get(f"{self.namespace}:{key}")
+
+
+def namespaced(redis: Dict[str, object], namespaces: Dict[str, str]) -> Dict[str, object]:
+    """
+    Wrap the clients of uploaded datasets, keyed by their config
+    prefix, into views of the namespaces they were uploaded to.
+    """
+    clients = dict(redis)
+    for dataset, namespace in namespaces.items():
+        prefix = DATASET_REDIS[dataset]
+        clients[prefix] = Namespaced(redis[prefix], namespace)
+    return clients
+
+
+@dataclass
+class Generation:
+    """
+    Everything requests are served from: the catalog namespaces,
+    local caches, the model, the index and the recommenders.
+    """
+
+    number: int
+    catalog: Catalog
+    caches: Dict[str, LocalCache]
+    resources: Resources
+    router: Router
+    loaded_at: float = field(default_factory=time.time)
+    load_seconds: float = 0.0
+    switch_seconds: float = 0.0
+
+    @property
+    def namespaces(self) -> Dict[str, str]:
+        return self.catalog.namespaces
+
+    def close(self):
+        if self.resources.retriever is not None:
+            self.resources.retriever.close()
+
+
+class Generations:
+    """
+    The generation requests are served from, and its reloads.
+
+    A reload loads a complete new generation in a background thread
+    while requests keep going to the current one, then switches to
+    it with a single reference assignment. A request reads current
+    once and is served by that generation from start to end.
+
+    grace_seconds after the switch, when requests of the previous
+    generation are long finished, it is closed and the namespaces
+    no dataset of the new one uses are deleted from redis. The same
+    happens after the first load for namespaces of earlier runs.
+    One reload runs at a time, including its garbage collection.
+
+    A server whose processes keep serving the previous generation
+    after the switch sets drained to a function that blocks until
+    all of them serve the given generation number; it is waited
+    for instead of grace_seconds.
+    """
+
+    def __init__(self, load: Callable[[int], Generation], redis: Dict[str, object], logger,
+                 grace_seconds: float = 10.0):
+        self.load = load
+        self.redis = redis
+        self.logger = logger
+        self.grace_seconds = grace_seconds
+
+        self.current: Optional[Generation] = None
+        self.drained: Optional[Callable[[int], None]] = None
+        self.reloading = False
+        self.last_error = None
+        self.lock = threading.Lock()
+
+    def start(self) -> Generation:
+        self.current = self.load_generation(1)
+        self.reloading = True
+        threading.Thread(target=self.retire, args=(None,), name="generation-gc", daemon=True).start()
+        return self.current
+
+    def reload(self) -> bool:
+        """
+        Start a reload unless one is already running.
+        """
+        with self.lock:
+            if self.reloading:
+                return False
+            self.reloading = True
+
+        threading.Thread(target=self.run_reload, name="generation-reload", daemon=True).start()
+        return True
+
+    def run_reload(self):
+        try:
+            generation = self.load_generation(self.current.number + 1)
+        except Exception as e:
+            self.logger.exception(f"Reload failed, still serving generation {self.current.number}")
+            self.last_error = repr(e)
+            self.reloading = False
+            return
+
+        self.last_error = None
+        self.retire(self.switch(generation))
+
+    def load_generation(self, number: int) -> Generation:
+        self.logger.info(f"Loading generation {number}")
+        start = time.perf_counter()
+        generation = self.load(number)
+        generation.load_seconds = time.perf_counter() - start
+        metrics.observe("generation_load", generation.load_seconds)
+        self.logger.info(f"Loaded generation {number} in {generation.load_seconds:.2f}s")
+        return generation
+
+    def switch(self, generation: Generation) -> Generation:
+        start = time.perf_counter()
+        previous, self.current = self.current, generation
+        generation.switch_seconds = time.perf_counter() - start
+        metrics.observe("generation_switch", generation.switch_seconds)
+        self.logger.info(
+            f"Switched from generation {previous.number} to {generation.number} "
+            f"in {generation.switch_seconds * 1e6:.1f}us"
+        )
+        return previous
+
+    def retire(self, previous: Optional[Generation]):
+        try:
+            if previous is not None and self.drained is not None:
+                self.drained(self.current.number)
+            else:
+                time.sleep(self.grace_seconds)
+            if previous is not None:
+                previous.close()
+            self.current.catalog.collect_garbage(self.redis)
+        except Exception:
+            self.logger.exception("Failed to collect stale namespaces")
+        finally:
+            self.reloading = False
+
+    def watch(self, paths: List[str], interval: float):
+        FileWatcher(paths, interval, self.reload).start()
+        self.logger.info(f"Watching {len(paths)} files for changes every {interval}s")
+
+    def status(self) -> dict:
+        generation = self.current
+        return {
+            "generation": generation.number,
+            "loaded_at": generation.loaded_at,
+            "load_seconds": generation.load_seconds,
+            "switch_seconds": generation.switch_seconds,
+            "namespaces": generation.namespaces,
+            "reloading": self.reloading,
+            "last_error": self.last_error,
+        }
+
+
+class FileWatcher:
+    """
+    Poll modification times of files and call back once they
+    changed and then stayed the same for one more interval, so
+    a file that is still being written is not picked up. If the
+    callback declines, it is called again on the next poll.
+    """
+
+    def __init__(self, paths: List[str], interval: float, callback: Callable[[], bool]):
+        self.paths = paths
+        self.interval = interval
+        self.callback = callback
+
+    def start(self):
+        threading.Thread(target=self.run, name="file-watcher", daemon=True).start()
+
+    def snapshot(self) -> Dict[str, Optional[int]]:
+        mtimes = {}
+        for path in self.paths:
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def run(self):
+        seen = self.snapshot()
+        pending = None
+        while True:
+            time.sleep(self.interval)
+            current = self.snapshot()
+            if current == seen:
+                pending = None
+            elif current != pending:
+                pending = current
+            elif self.callback():
+                seen = current
+                pending = None
+
+
+def watched_paths(config) -> List[str]:
+    """
+    Files a generation is loaded from.
+    """
+    if config.get("CATALOG_FORMAT", "json") == "binary":
+        paths = [config["CATALOG_BINARY_PATH"]]
+    else:
+        paths = [
+            config[key]
+            for key in [
+                "TRACKS_CATALOG",
+                "TOP_TRACKS_CATALOG",
+                "TRACKS_WITH_DIVERSE_RECS_CATALOG",
+                "RECOMMENDATIONS_CONTEXTUAL_V2_FILE_PATH",
+                "RECOMMENDATIONS_FILE_PATH",
+                "RECOMMENDATIONS_SVD_FILE_PATH",
+            ]
+        ]
+
+    if config["CONTEXT_ENCODER"] == "numpy":
+        paths += [config["CONTEXT_ENCODER_PATH"], config["TRACK_INDEX_PATH"], config["TRACK_EMBEDDINGS_STORE_PATH"]]
+    else:
+        paths += [config["CHECKPOINT_PATH"], config["TRACK_EMBEDDINGS_PATH"]]
+    return paths
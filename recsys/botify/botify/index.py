@@ -0,0 +1,254 @@
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import faiss
+import numpy as np
+
+FLAT = "flat"
+IVF = "ivf"
+HNSW = "hnsw"
+
+# Map the codes and the graph of every index type from the file, not
+# only the inverted lists of IVF as IO_FLAG_MMAP does. Older faiss
+# releases lack the flag and copy flat and HNSW codes into memory.
+MMAP_FLAG = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
+# faiss index factory codes for the stored track vectors. The int8
+# scalar quantizer trains a value range per dimension.
+STORAGE = {
+    "float32": "Flat",
+    "float16": "SQfp16",
+    "int8": "SQ8",
+}
+
+# Parameters every index type is built with: the saved name, the config
+# key and the default. They are saved with the index and checked on
+# load; the search time ones are applied to the loaded index instead.
+BUILD_PARAMETERS = {
+    FLAT: {},
+    IVF: {"ivf_lists": ("TRACK_INDEX_IVF_LISTS", 256)},
+    HNSW: {
+        "hnsw_neighbours": ("TRACK_INDEX_HNSW_NEIGHBOURS", 32),
+        "hnsw_ef_construction": ("TRACK_INDEX_HNSW_EF_CONSTRUCTION", 80),
+    },
+}
+
+
+@dataclass
+class RecallReport:
+    index_type: str
+    k: int
+    queries: int
+    recall: float
+    latency_ms: float
+    exact_latency_ms: float
+    storage: str = "float32"
+    code_bytes: int = 0
+    float32_bytes: int = 0
+
+
+class TrackIndex:
+    """
+    Maximum inner product search over the track embeddings.
+
+    The exact flat index scans the whole matrix; the IVF and
+    HNSW indices trade recall for latency, the trade-off is
+    controlled by the number of probed lists (IVF) and the size
+    of the search queue (HNSW).
+
+    Track vectors are stored as float32, float16 or int8 codes
+    (TRACK_INDEX_STORAGE) and scored in that form. With
+    TRACK_INDEX_RERANK > 1 the index returns that many times
+    more candidates, which are re-ranked exactly against the
+    float32 embeddings.
+
+    botify.model.export builds the index and saves it together
+    with the float32 embeddings and a json file of the parameters
+    it was built with. load() memory-maps the index and the
+    embeddings, so all server processes share a single copy in
+    the page cache, and refuses an index built with parameters
+    other than the ones in config.
+    """
+
+    def __init__(self, index_type: str, embeddings: np.ndarray, index: faiss.Index,
+                 storage: str = "float32", rerank: int = 1, build_parameters: Optional[dict] = None):
+        self.index_type = index_type
+        self.embeddings = embeddings
+        self.index = index
+        self.storage = storage
+        self.rerank = rerank
+        self.build_parameters = build_parameters or {}
+
+    @classmethod
+    def build(cls, config, embeddings: np.ndarray):
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        index_type = config.get("TRACK_INDEX_TYPE", FLAT)
+        storage = config.get("TRACK_INDEX_STORAGE", "float32")
+        dimension = embeddings.shape[1]
+
+        if storage not in STORAGE:
+            raise ValueError(f"Unknown track index storage: {storage}")
+        if index_type not in BUILD_PARAMETERS:
+            raise ValueError(f"Unknown track index type: {index_type}")
+        parameters = cls.build_parameters_of(config, index_type)
+
+        if index_type == FLAT:
+            factory = STORAGE[storage]
+        elif index_type == IVF:
+            factory = f"IVF{parameters['ivf_lists']},{STORAGE[storage]}"
+        else:
+            factory = f"HNSW{parameters['hnsw_neighbours']},{STORAGE[storage]}"
+
+        index = faiss.index_factory(dimension, factory, faiss.METRIC_INNER_PRODUCT)
+        if index_type == HNSW:
+            index.hnsw.efConstruction = parameters["hnsw_ef_construction"]
+        if not index.is_trained:
+            index.train(embeddings)
+        index.add(embeddings)
+
+        rerank = config.get("TRACK_INDEX_RERANK", 1)
+        return cls(index_type, embeddings, cls.configure(config, index), storage, rerank, parameters)
+
+    @classmethod
+    def load(cls, config):
+        """
+        Memory-map the index and the embeddings saved by save().
+        """
+        index_path = config["TRACK_INDEX_PATH"]
+        try:
+            with open(cls.parameters_path(index_path)) as parameters_file:
+                saved = json.load(parameters_file)
+        except FileNotFoundError:
+            raise ValueError(f"No parameters saved with {index_path}, run python -m botify.model.export")
+
+        expected = cls.parameters(config)
+        mismatches = {name: (saved.get(name), value) for name, value in expected.items() if saved.get(name) != value}
+        if mismatches:
+            details = ", ".join(
+                f"{name} {old!r} in the file, {new!r} in config" for name, (old, new) in mismatches.items()
+            )
+            raise ValueError(f"Track index {index_path} was built with other parameters: {details}. "
+                             f"Run python -m botify.model.export")
+
+        index = faiss.read_index(index_path, MMAP_FLAG | faiss.IO_FLAG_READ_ONLY)
+        embeddings = np.load(config["TRACK_EMBEDDINGS_STORE_PATH"], mmap_mode="r")
+        if embeddings.shape != (index.ntotal, index.d):
+            raise ValueError(f"Track embeddings of shape {embeddings.shape} do not match the index "
+                             f"of {index.ntotal} tracks of {index.d} dimensions")
+        build_parameters = {name: saved[name] for name in BUILD_PARAMETERS[saved["index_type"]]}
+        return cls(
+            saved["index_type"], embeddings, cls.configure(config, index), saved["storage"], saved["rerank"],
+            build_parameters,
+        )
+
+    def save(self, config):
+        """
+        Write the index, the embeddings and the parameters to temporary
+        files and move them over the saved ones: a running server has
+        those mapped, and rewriting them in place would crash it with SIGBUS.
+        """
+        index_path = config["TRACK_INDEX_PATH"]
+        embeddings_path = config["TRACK_EMBEDDINGS_STORE_PATH"]
+        parameters_path = self.parameters_path(index_path)
+        faiss.write_index(self.index, f"{index_path}.tmp")
+        with open(f"{embeddings_path}.tmp", "wb") as embeddings_file:
+            np.save(embeddings_file, self.embeddings)
+        with open(f"{parameters_path}.tmp", "w") as parameters_file:
+            json.dump(
+                dict(self.build_parameters, index_type=self.index_type, storage=self.storage, rerank=self.rerank),
+                parameters_file,
+            )
+        os.replace(f"{index_path}.tmp", index_path)
+        os.replace(f"{embeddings_path}.tmp", embeddings_path)
+        os.replace(f"{parameters_path}.tmp", parameters_path)
+
+    @classmethod
+    def parameters(cls, config) -> dict:
+        """The parameters of config an index is built with and stored along"""
+        index_type = config.get("TRACK_INDEX_TYPE", FLAT)
+        return dict(
+            cls.build_parameters_of(config, index_type),
+            index_type=index_type,
+            storage=config.get("TRACK_INDEX_STORAGE", "float32"),
+            rerank=config.get("TRACK_INDEX_RERANK", 1),
+        )
+
+    @staticmethod
+    def build_parameters_of(config, index_type: str) -> dict:
+        return {name: config.get(key, default) for name, (key, default) in BUILD_PARAMETERS.get(index_type, {}).items()}
+
+    @staticmethod
+    def parameters_path(index_path: str) -> str:
+        return f"{index_path}.json"
+
+    @staticmethod
+    def configure(config, index: faiss.Index) -> faiss.Index:
+        """
+        Apply the search time parameters, which are not
+        stored in the index file.
+        """
+        if isinstance(index, faiss.IndexIVF):
+            index.nprobe = config.get("TRACK_INDEX_IVF_PROBES", 16)
+        elif isinstance(index, faiss.IndexHNSW):
+            index.hnsw.efSearch = config.get("TRACK_INDEX_HNSW_EF_SEARCH", 64)
+        return index
+
+    @property
+    def code_bytes(self) -> int:
+        index = self.index
+        if isinstance(index, faiss.IndexHNSW):
+            # HNSW keeps the codes in a storage index and has no code size of its own
+            index = faiss.downcast_index(index.storage)
+        return self.index.ntotal * index.sa_code_size()
+
+    def search(self, queries: np.ndarray, k: int) -> np.ndarray:
+        """
+        Return ids of the k tracks with the highest inner product
+        for every row of queries. Missing neighbours are marked with -1.
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        _, ids = self.index.search(queries, k * self.rerank)
+        if self.rerank > 1:
+            ids = self.rerank_exact(queries, ids, k)
+        return ids
+
+    def rerank_exact(self, queries: np.ndarray, candidates: np.ndarray, k: int) -> np.ndarray:
+        # Only the rows of the candidates are read from the mapped embeddings
+        scores = np.einsum("qd,qcd->qc", queries, self.embeddings[np.maximum(candidates, 0)])
+        scores[candidates < 0] = -np.inf
+        order = np.argsort(-scores, axis=1)[:, :k]
+        return np.take_along_axis(candidates, order, axis=1)
+
+    def exact_search(self, queries: np.ndarray, k: int) -> np.ndarray:
+        scores = np.dot(queries, self.embeddings.T)
+        top = np.argpartition(-scores, k, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+        return np.take_along_axis(top, order, axis=1)
+
+    def recall_report(self, queries: np.ndarray, k: int) -> RecallReport:
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+
+        start = time.time()
+        approximate = [self.search(query[np.newaxis, :], k)[0] for query in queries]
+        latency = (time.time() - start) / len(queries)
+
+        start = time.time()
+        exact = [self.exact_search(query[np.newaxis, :], k)[0] for query in queries]
+        exact_latency = (time.time() - start) / len(queries)
+
+        hits = sum(len(np.intersect1d(a, e)) for a, e in zip(approximate, exact))
+
+        return RecallReport(
+            self.index_type,
+            k,
+            len(queries),
+            hits / (k * len(queries)),
+            latency * 1000,
+            exact_latency * 1000,
+            self.storage,
+            self.code_bytes,
+            self.embeddings.shape[0] * self.embeddings.shape[1] * 4,
+        )
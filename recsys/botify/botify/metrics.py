@@ -0,0 +1,130 @@
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+from typing import Dict, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+# (recommender, treatment) of the request being served. A context
+# variable follows both flask request threads and asyncio tasks.
+request_labels = contextvars.ContextVar("request_labels", default=("", ""))
+
+
+class Histogram:
+    """
+    A Prometheus histogram with a fixed label set. Every
+    observation is a bisect over the buckets and an increment
+    under a lock; buckets are only accumulated when rendered.
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str], buckets: Sequence[float] = BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_values: Tuple[str, ...], value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                # Bucket counts, then the +Inf bucket, then the sum
+                series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self.lock:
+            series = {labels: list(values) for labels, values in self.series.items()}
+
+        for label_values, values in sorted(series.items()):
+            labels = ",".join(f'{name}="{value}"' for name, value in zip(self.label_names, label_values))
+            count = 0
+            for bound, observations in zip(self.buckets + (float("inf"),), values):
+                count += observations
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{labels},le="{le}"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {values[-1]}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "botify_stage_seconds",
+    "Time spent in a stage of serving a request.",
+    ["stage", "recommender", "treatment"],
+)
+
+
+class stage:
+    """
+    Time the wrapped block as the given stage of the current request::
+
+        with stage("session_pop"):
+            track = sessions.pop(user)
+
+    """
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        STAGE_SECONDS.observe((self.name,) + request_labels.get(), time.perf_counter() - self.start)
+
+
+def observe(name: str, seconds: float):
+    """
+    Record a stage that was timed by the caller.
+    """
+    STAGE_SECONDS.observe((name,) + request_labels.get(), seconds)
+
+
+@contextlib.contextmanager
+def labelled(recommender: str = "", treatment: str = ""):
+    """
+    Label the stages timed within the block with the recommender
+    and the treatment that serve the request.
+    """
+    token = request_labels.set((recommender, treatment))
+    try:
+        yield
+    finally:
+        request_labels.reset(token)
+
+
+def memory_usage() -> Dict[str, float]:
+    """
+    Resident set size of the process and its peak, in MB.
+    """
+    usage = {}
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(("VmRSS", "VmHWM")):
+                name, kb, _ = line.split()
+                usage["rss_mb" if name == "VmRSS:" else "peak_rss_mb"] = int(kb) / 1024
+    return usage
+
+
+def render() -> str:
+    return "\n".join(STAGE_SECONDS.render()) + "\n"
@@ -0,0 +1,21 @@
+from botify.model.model import ContextualRanker, ModelConfig
+
+
+def model_config() -> ModelConfig:
+    return ModelConfig(
+        unique_users_count=10000,
+        unique_tracks_count=50000,
+        unique_artists_count=12000,
+        user_embedding_dim=30,
+        context_track_embedding_dim=100,
+        track_embedding_dim=100,
+        artist_embedding_dim=30,
+        hidden_dims=[512, 256, 128],
+        dropout_prob=0.0
+    )
+
+
+def load_model(checkpoint_path: str) -> ContextualRanker:
+    model = ContextualRanker.load_from_checkpoint(checkpoint_path, config=model_config())
+    model.eval()
+    return model
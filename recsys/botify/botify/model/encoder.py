@@ -0,0 +1,109 @@
+from typing import List, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from botify.model.model import ContextualRanker
+
+NEGATIVE_SLOPE = 0.1
+
+
+def fold_batch_norm(linear: nn.Linear, batch_norm: nn.BatchNorm1d) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Merge an eval-mode BatchNorm1d into the preceding linear layer:
+    BN(Wx + b) == W'x + b'.
+    """
+    scale = batch_norm.weight / torch.sqrt(batch_norm.running_var + batch_norm.eps)
+    weight = linear.weight * scale[:, None]
+    bias = (linear.bias - batch_norm.running_mean) * scale + batch_norm.bias
+    return weight, bias
+
+
+def folded_layers(model: ContextualRanker) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    modules = [module for module in model.context_transformation if isinstance(module, (nn.Linear, nn.BatchNorm1d))]
+    return [fold_batch_norm(linear, batch_norm) for linear, batch_norm in zip(modules[::2], modules[1::2])]
+
+
+class ContextEncoder:
+    """
+    A serving-time replacement for the context tower of ContextualRanker.
+
+    The first linear layer acts on concat(user, track) embeddings,
+    so it splits into W_u * user + W_t * track. Both projections
+    are precomputed for every user and every track, which turns
+    the first layer into two table lookups and an add. BatchNorm
+    layers are folded into the linear layers before them, leaving
+    a chain of small matmuls with LeakyReLU in between.
+
+    Dropout is a no-op at inference and is dropped.
+    """
+
+    def __init__(self, user_table: torch.Tensor, track_table: torch.Tensor,
+                 layers: List[Tuple[torch.Tensor, torch.Tensor]]):
+        self.user_table = user_table
+        self.track_table = track_table
+        self.layers = layers
+
+    @property
+    def users_count(self) -> int:
+        return len(self.user_table)
+
+    @property
+    def tracks_count(self) -> int:
+        return len(self.track_table)
+
+    @classmethod
+    def from_model(cls, model: ContextualRanker) -> "ContextEncoder":
+        blocks = folded_layers(model)
+
+        with torch.no_grad():
+            weight, bias = blocks[0]
+            user_weight, track_weight = weight.split(
+                [model.user_embedding_dim, model.context_track_embedding_dim], dim=1
+            )
+            user_table = model.user_embedding.weight @ user_weight.T
+            # The bias is added once, so it goes to the track table only
+            track_table = model.context_track_embedding.weight @ track_weight.T + bias
+            layers = [(weight.detach().contiguous(), bias.detach()) for weight, bias in blocks[1:]]
+
+        return cls(user_table.contiguous(), track_table.contiguous(), layers)
+
+    def get_context_embeddings(self, user_ids: torch.Tensor, track_ids: torch.Tensor) -> torch.Tensor:
+        hidden = F.leaky_relu(self.user_table[user_ids] + self.track_table[track_ids], NEGATIVE_SLOPE)
+        for weight, bias in self.layers:
+            hidden = F.leaky_relu(F.linear(hidden, weight, bias), NEGATIVE_SLOPE)
+        return hidden
+
+    def get_context_embedding(self, user_id: torch.Tensor, track_id: torch.Tensor) -> torch.Tensor:
+        return self.get_context_embeddings(user_id.view(1), track_id.view(1))[0]
+
+    def encode(self, users: np.ndarray, tracks: np.ndarray) -> np.ndarray:
+        with torch.no_grad():
+            return self.get_context_embeddings(torch.as_tensor(users), torch.as_tensor(tracks)).numpy()
+
+
+class ModelContextEncoder:
+    """
+    Compute context embeddings with the context tower of the model as is.
+    """
+
+    def __init__(self, model: ContextualRanker):
+        self.model = model
+        self.users_count = model.user_embedding.num_embeddings
+        self.tracks_count = model.context_track_embedding.num_embeddings
+
+    def encode(self, users: np.ndarray, tracks: np.ndarray) -> np.ndarray:
+        with torch.no_grad():
+            return self.model.get_context_embeddings(torch.as_tensor(users), torch.as_tensor(tracks)).cpu().numpy()
+
+
+def build_context_encoder(config, model: ContextualRanker):
+    """
+    Pick what computes context embeddings at serving time:
+    the factorized encoder or the model itself.
+    """
+    if config.get("CONTEXT_ENCODER", "factorized") == "factorized":
+        return ContextEncoder.from_model(model)
+    return ModelContextEncoder(model)
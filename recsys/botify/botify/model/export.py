@@ -0,0 +1,97 @@
+"""
+Export what serving needs from a ContextualRanker checkpoint:
+a plain numpy archive of the context tower with batch norm folded
+into the linear layers, and the track index with the float32 track
+embeddings next to it. The server loads the archive with numpy
+alone and memory-maps the index when CONTEXT_ENCODER is "numpy".
+
+Run from the botify directory, paths default to config.json::
+
+    python -m botify.model.export
+
+"""
+import argparse
+import os
+import json
+
+import numpy as np
+import torch
+
+from botify.index import TrackIndex
+from botify.model.checkpoint import load_model
+from botify.model.encoder import ModelContextEncoder, folded_layers
+from botify.model.model import ContextualRanker
+from botify.model.numpy_encoder import NumpyContextEncoder
+
+
+def context_tower_weights(model: ContextualRanker) -> dict:
+    layers = folded_layers(model)
+    weights = {
+        "user_embedding": model.user_embedding.weight,
+        "context_track_embedding": model.context_track_embedding.weight,
+    }
+    for i, (weight, bias) in enumerate(layers):
+        weights[f"weight_{i}"], weights[f"bias_{i}"] = weight, bias
+
+    weights = {name: value.detach().cpu().numpy().astype(np.float32) for name, value in weights.items()}
+    weights["layers"] = np.array(len(layers))
+    return weights
+
+
+def export(model: ContextualRanker, path: str):
+    # Replaced as a whole, so a reload never reads a half written file
+    with open(f"{path}.tmp", "wb") as weights_file:
+        np.savez(weights_file, **context_tower_weights(model))
+    os.replace(f"{path}.tmp", path)
+
+
+def export_track_index(config, track_embeddings: np.ndarray) -> TrackIndex:
+    track_index = TrackIndex.build(config, track_embeddings)
+    track_index.save(config)
+    return track_index
+
+
+def max_error(model: ContextualRanker, encoder: NumpyContextEncoder, queries: int = 4096) -> float:
+    users = np.random.randint(0, encoder.users_count, queries)
+    tracks = np.random.randint(0, encoder.tracks_count, queries)
+    expected = ModelContextEncoder(model).encode(users, tracks)
+    return float(np.abs(expected - encoder.encode(users, tracks)).max())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, default="./botify/config.json")
+    parser.add_argument("--checkpoint", type=str)
+    parser.add_argument("--track-embeddings", type=str)
+    parser.add_argument("--output", type=str)
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = json.load(config_file)
+    checkpoint = args.checkpoint or config["CHECKPOINT_PATH"]
+    track_embeddings = args.track_embeddings or config["TRACK_EMBEDDINGS_PATH"]
+    output = args.output or config["CONTEXT_ENCODER_PATH"]
+
+    model = load_model(checkpoint)
+    export(model, output)
+    with np.load(output) as weights:
+        encoder = NumpyContextEncoder.from_weights(weights)
+    print(f"Exported {checkpoint} to {output}, max abs error {max_error(model, encoder):.2e}")
+
+    track_index = export_track_index(config, torch.load(track_embeddings).cpu().numpy())
+    report = track_index.recall_report(
+        encoder.encode(
+            np.random.randint(0, encoder.users_count, config["TRACK_INDEX_RECALL_QUERIES"]),
+            np.random.randint(0, encoder.tracks_count, config["TRACK_INDEX_RECALL_QUERIES"]),
+        ),
+        config["TOP_TRACKS_PER_USER"],
+    )
+    print(
+        f"Exported {report.index_type} track index with {report.storage} storage to {config['TRACK_INDEX_PATH']}: "
+        f"recall@{report.k} {report.recall:.3f}, {report.code_bytes / 2 ** 20:.1f} MB of codes "
+        f"vs {report.float32_bytes / 2 ** 20:.1f} MB float32"
+    )
+
+
+if __name__ == "__main__":
+    main()
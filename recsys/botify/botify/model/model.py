@@ -120,6 +120,11 @@ class ContextualRanker(pl.LightningModule):
 
         return context_embeddings[0]
 
+    def get_context_embeddings(self, user_ids: torch.Tensor, track_ids: torch.Tensor) -> torch.Tensor:
+        input = torch.cat((self.user_embedding(user_ids), self.context_track_embedding(track_ids)), dim=1)
+
+        return self.context_transformation(input)
+
     def get_track_embeddings(self, tracks: torch.Tensor, artists: torch.Tensor) -> torch.Tensor:
         track_embeddings = self.track_transformation(
             torch.cat((self.track_embedding(tracks), self.artist_embedding(artists)), dim=1))
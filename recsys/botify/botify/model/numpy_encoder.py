@@ -0,0 +1,65 @@
+from typing import List, Mapping, Tuple
+
+import numpy as np
+
+NEGATIVE_SLOPE = 0.1
+
+
+def leaky_relu(x: np.ndarray) -> np.ndarray:
+    return np.maximum(x, x * NEGATIVE_SLOPE)
+
+
+class NumpyContextEncoder:
+    """
+    The context tower of ContextualRanker in plain numpy, built
+    from the weights written by botify.model.export.
+
+    The first layer is factorized into per-user and per-track
+    lookup tables at load time, the other layers are matmuls
+    with the batch norm already folded into their weights.
+    """
+
+    def __init__(self, user_table: np.ndarray, track_table: np.ndarray, layers: List[Tuple[np.ndarray, np.ndarray]]):
+        self.user_table = user_table
+        self.track_table = track_table
+        self.layers = layers
+
+    @property
+    def users_count(self) -> int:
+        return len(self.user_table)
+
+    @property
+    def tracks_count(self) -> int:
+        return len(self.track_table)
+
+    @classmethod
+    def from_weights(cls, weights: Mapping[str, np.ndarray]) -> "NumpyContextEncoder":
+        user_embedding = weights["user_embedding"]
+        track_embedding = weights["context_track_embedding"]
+        layers_count = int(weights["layers"])
+
+        first_weight = weights["weight_0"]
+        user_weight = first_weight[:, :user_embedding.shape[1]]
+        track_weight = first_weight[:, user_embedding.shape[1]:]
+
+        user_table = user_embedding @ user_weight.T
+        track_table = track_embedding @ track_weight.T + weights["bias_0"]
+        layers = [
+            (np.ascontiguousarray(weights[f"weight_{i}"].T), weights[f"bias_{i}"])
+            for i in range(1, layers_count)
+        ]
+        return cls(user_table.astype(np.float32), track_table.astype(np.float32), layers)
+
+    def encode(self, users: np.ndarray, tracks: np.ndarray) -> np.ndarray:
+        hidden = leaky_relu(self.user_table[users] + self.track_table[tracks])
+        for weight, bias in self.layers:
+            hidden = leaky_relu(hidden @ weight + bias)
+        return hidden
+
+
+def load_exported(path: str) -> NumpyContextEncoder:
+    """
+    Load the context encoder written by botify.model.export.
+    """
+    with np.load(path) as weights:
+        return NumpyContextEncoder.from_weights(weights)
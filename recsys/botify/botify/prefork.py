@@ -0,0 +1,259 @@
+"""
+Prefork serving of the flask app.
+
+The leader process uploads the catalog and loads the model and
+the index once, binds the listening socket and forks the workers.
+The workers serve the generation they were forked with and share
+its memory with the leader copy-on-write: the weights, the embedding
+matrix and the mapped index are never written to, so their pages
+stay shared however many workers there are. gc.freeze() before
+every fork moves the loaded objects out of the collector's reach,
+so collections in a worker do not touch their headers and unshare
+the pages they live on.
+
+The leader does not serve requests. It restarts workers that die,
+reloads the generation on SIGHUP (workers forward /admin/reload
+to it) or when watched files change, and once a new generation
+is loaded replaces the workers one at a time: the old worker stops
+accepting, finishes its requests and exits, then a worker forked
+from the new generation takes its place. Connections arriving in
+between wait in the backlog of the shared socket, so none are
+refused. Workers that die during the roll are restarted with the
+new generation. The namespaces of the old generation are deleted
+only once the roll has finished, since until then some workers
+still read them. SIGTERM and SIGINT stop the workers gracefully
+and then the leader. A worker that has not exited DRAIN_SECONDS
+after SIGTERM is killed.
+"""
+import gc
+import os
+import signal
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Set, Tuple
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from botify.generation import Generations
+
+POLL_SECONDS = 0.2
+KEEPALIVE_SECONDS = 5
+DRAIN_SECONDS = 30
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """
+    Answer over HTTP/1.1, so that clients can send many requests over
+    one connection. werkzeug closes the connection after responses
+    without Content-Length. Idle connections are closed after
+    KEEPALIVE_SECONDS. Once the server is draining, every response
+    closes its connection, so that a busy client cannot keep a
+    stopping worker alive.
+
+    The headers and the body of a response are written separately,
+    so Nagle's algorithm is disabled: otherwise the body waits for
+    the client's delayed ACK of the headers on a reused connection.
+    """
+
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_SECONDS
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def end_headers(self):
+        if getattr(self.server, "draining", False) and not self.close_connection:
+            # Also sets close_connection
+            self.send_header("Connection", "close")
+        super().end_headers()
+
+
+class WorkerGenerations:
+    """
+    Generations as seen by a worker: the generation it was forked
+    with. Reloads are forwarded to the leader, which replaces the
+    workers once the new generation is loaded.
+    """
+
+    def __init__(self, generations: Generations, leader: int):
+        self.current = generations.current
+        self.generations = generations
+        self.leader = leader
+
+    def reload(self) -> bool:
+        os.kill(self.leader, signal.SIGHUP)
+        return True
+
+    def status(self) -> dict:
+        # Whether the leader is reloading is not known to a worker
+        status = self.generations.status()
+        del status["reloading"], status["last_error"]
+        return dict(status, leader=self.leader, worker=os.getpid())
+
+
+class Prefork:
+    """
+    build is called in every worker with its WorkerGenerations and
+    index, and returns the WSGI app to serve and a function to call
+    once the worker has finished its last request. Workers still
+    running drain_seconds after SIGTERM are killed.
+    """
+
+    def __init__(self, generations: Generations, build: Callable[[WorkerGenerations, int], Tuple[object, Callable]],
+                 workers: int, host: str, port: int, logger, backlog: int = 1024,
+                 drain_seconds: float = DRAIN_SECONDS):
+        self.generations = generations
+        self.build = build
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.logger = logger
+        self.backlog = backlog
+        self.drain_seconds = drain_seconds
+
+        self.socket = None
+        self.leader = None
+        self.pids: Dict[int, int] = {}
+        self.generation = None
+        self.rolled = None
+        self.roll_condition = threading.Condition()
+        self.stopping = False
+
+    def bind(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(self.backlog)
+        self.port = self.socket.getsockname()[1]
+
+    def run(self):
+        if self.socket is None:
+            self.bind()
+        self.leader = os.getpid()
+        signal.signal(signal.SIGHUP, lambda *_: self.generations.reload())
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.generation = self.generations.current.number
+        self.rolled = self.generation
+        self.generations.drained = self.wait_rolled
+        for index in range(self.workers):
+            self.spawn(index)
+        self.logger.info(f"Serving generation {self.generation} on {self.host}:{self.port} with {self.workers} workers")
+
+        while not self.stopping:
+            time.sleep(POLL_SECONDS)
+            self.reap()
+            if not self.stopping and self.generations.current.number != self.generation:
+                self.roll()
+
+        pids = list(self.pids)
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+        self.wait(pids)
+        self.socket.close()
+        self.logger.info("Stopped")
+
+    def stop(self, *_):
+        self.stopping = True
+
+    def spawn(self, index: int):
+        gc.collect()
+        gc.freeze()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self.serve(index)
+            finally:
+                # Never return into the leader's code
+                os._exit(0)
+        self.pids[pid] = index
+
+    def reap(self) -> Set[int]:
+        """
+        Collect the workers that exited, restart the ones that were
+        still expected to serve and return the pids of all of them.
+        """
+        exited = set()
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return exited
+            if pid == 0:
+                return exited
+            exited.add(pid)
+            index = self.pids.pop(pid, None)
+            if index is not None and not self.stopping:
+                self.logger.warning(f"Worker {index} ({pid}) exited with status {status}, restarting")
+                self.spawn(index)
+
+    def wait(self, pids: List[int]):
+        """
+        Wait for the given workers to exit, reaping and restarting
+        any other worker that dies in the meantime. The ones still
+        running after drain_seconds are killed.
+        """
+        pending = set(pids)
+        deadline = time.monotonic() + self.drain_seconds
+        while pending:
+            pending -= self.reap()
+            if pending and deadline is not None and time.monotonic() >= deadline:
+                self.logger.warning(f"Workers {sorted(pending)} did not drain in {self.drain_seconds}s, killing them")
+                for pid in pending:
+                    os.kill(pid, signal.SIGKILL)
+                deadline = None
+            if pending:
+                time.sleep(POLL_SECONDS)
+
+    def roll(self):
+        self.generation = self.generations.current.number
+        self.logger.info(f"Replacing workers with ones serving generation {self.generation}")
+        for pid, index in list(self.pids.items()):
+            if pid not in self.pids:
+                # Died during the roll and was restarted with the new generation
+                continue
+            # No longer expected to serve, so it is not restarted when it exits
+            del self.pids[pid]
+            os.kill(pid, signal.SIGTERM)
+            self.wait([pid])
+            if self.stopping:
+                return
+            self.spawn(index)
+
+        with self.roll_condition:
+            self.rolled = self.generation
+            self.roll_condition.notify_all()
+        self.logger.info(f"All workers serve generation {self.generation}")
+
+    def wait_rolled(self, number: int):
+        """
+        Block until every worker serves generation number or a later
+        one, so that the namespaces of the earlier ones can be deleted.
+        """
+        with self.roll_condition:
+            self.roll_condition.wait_for(lambda: self.rolled >= number)
+
+    def serve(self, index: int):
+        for signum in [signal.SIGHUP, signal.SIGINT]:
+            signal.signal(signum, signal.SIG_IGN)
+
+        app, close = self.build(WorkerGenerations(self.generations, self.leader), index)
+        server = make_server(
+            self.host, self.port, app, threaded=True, request_handler=KeepAliveRequestHandler, fd=self.socket.fileno()
+        )
+        # Request threads are joined on shutdown, so in-flight requests finish
+        server.daemon_threads = False
+        server.block_on_close = True
+        server.draining = False
+
+        def drain(*_):
+            server.draining = True
+            threading.Thread(target=server.shutdown).start()
+
+        signal.signal(signal.SIGTERM, drain)
+
+        server.serve_forever()
+        close()
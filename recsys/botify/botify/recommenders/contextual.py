@@ -1,13 +1,9 @@
-from typing import Union
-
-from flask_redis import Redis
-from redis.client import StrictRedis
-
 from .random import Random
 from .recommender import Recommender
 import random
 
-from ..utils import from_bytes
+from ..cache import ReadThroughCache
+from ..sampler import TrackSampler
 
 
 class Contextual(Recommender):
@@ -17,18 +13,28 @@ class Contextual(Recommender):
     recommendations found for the track.
     """
 
-    def __init__(self, tracks_redis: Union[Redis, StrictRedis]):
-        self.tracks_redis = tracks_redis
-        self.fallback = Random(tracks_redis)
+    def __init__(self, tracks: ReadThroughCache, sampler: TrackSampler):
+        self.tracks = tracks
+        self.fallback = Random(sampler)
+
+    @classmethod
+    def from_resources(cls, resources, tracks="tracks_with_recs"):
+        return cls(getattr(resources, tracks), resources.sampler)
 
     def recommend_next(self, user: int, prev_track: int, prev_track_time: float) -> int:
-        previous_track_raw_data = self.tracks_redis.get(prev_track)
-        if previous_track_raw_data is None:
+        previous_track = self.tracks.get(prev_track)
+        if previous_track is None:
             return self.fallback.recommend_next(user, prev_track, prev_track_time)
 
-        previous_track = from_bytes(previous_track_raw_data)
         recommendations = previous_track.recommendations
-        if not recommendations:
+        if len(recommendations) == 0:
             return self.fallback.recommend_next(user, prev_track, prev_track_time)
 
-        return random.choice(list(recommendations))
+        return int(random.choice(recommendations))
+
+    async def recommend_next_async(self, user: int, prev_track: int, prev_track_time: float) -> int:
+        previous_track = await self.tracks.get_async(prev_track)
+        if previous_track is None or len(previous_track.recommendations) == 0:
+            return await self.fallback.recommend_next_async(user, prev_track, prev_track_time)
+
+        return int(random.choice(previous_track.recommendations))
@@ -1,15 +1,11 @@
 import random
-from typing import Union
-
-import numpy as np
-import torch
-from flask_redis import Redis
-from redis.client import StrictRedis
+from typing import List, Optional, Tuple
 
 from .random import Random
 from .recommender import Recommender
-from ..model.model import ContextualRanker
-from ..utils import from_bytes, to_bytes
+from ..retrieval import ContextRetriever
+from ..sampler import TrackSampler
+from ..session import SessionStore
 
 
 class ContextualV2(Recommender):
@@ -17,35 +13,102 @@ class ContextualV2(Recommender):
     Recommend tracks closest to the previous one and to the current user.
     Fall back to the random recommender if no
     recommendations found for the track.
+
+    Candidates are computed once per session and served without
+    repeats from the session store; once they run out, new
+    candidates are computed for the current track.
     """
 
-    def __init__(self, session_redis: Union[Redis, StrictRedis], model: ContextualRanker,
-                 track_embeddings: torch.Tensor, top_tracks_per_user=40):
-        self.session_redis = session_redis
-        self.model = model
-        self.track_embeddings = track_embeddings
-        self.top_tracks_per_user = top_tracks_per_user
+    def __init__(self, sessions: SessionStore, retriever: ContextRetriever, sampler: TrackSampler):
+        self.sessions = sessions
+        self.retriever = retriever
+
+        self.fallback = Random(sampler)
 
-        self.fallback = Random(session_redis)
+    @classmethod
+    def from_resources(cls, resources):
+        return cls(resources.session, resources.retriever, resources.sampler)
 
     def recommend_next(self, user_id: int, prev_track_id: int, prev_track_time: float) -> int:
-        if self.session_redis.exists(user_id):
-            recommendations = from_bytes(self.session_redis.get(user_id))
-        else:
-            recommendations = self.calculate_recommendations(user_id, prev_track_id)
-            self.session_redis.set(user_id, to_bytes(recommendations))
+        recommendation = self.sessions.pop(user_id)
+        if recommendation is not None:
+            return recommendation
 
-        return random.choice(list(recommendations))
+        recommendations = self.calculate_recommendations(user_id, prev_track_id)
+        recommendation, rest = self.start_session(recommendations, prev_track_id)
+        if recommendation is None:
+            return self.fallback.recommend_next(user_id, prev_track_id, prev_track_time)
+        if rest:
+            self.sessions.put(user_id, rest)
+        return recommendation
 
-    def calculate_recommendations(self, user: int, prev_track: int) -> list:
-        with torch.no_grad():
-            context_embedding = self.model.get_context_embedding(
-                torch.tensor(user),
-                torch.tensor(prev_track)
+    async def recommend_next_async(self, user_id: int, prev_track_id: int, prev_track_time: float) -> int:
+        recommendation = await self.sessions.pop_async(user_id)
+        if recommendation is not None:
+            return recommendation
+
+        recommendations = await self.retriever.retrieve_async(user_id, prev_track_id)
+        recommendation, rest = self.start_session(recommendations, prev_track_id)
+        if recommendation is None:
+            return await self.fallback.recommend_next_async(user_id, prev_track_id, prev_track_time)
+        if rest:
+            await self.sessions.put_async(user_id, rest)
+        return recommendation
+
+    def recommend_many(self, users: List[int], prev_tracks: List[int], prev_track_times: List[float]) -> List[int]:
+        recommendations = self.sessions.pop_many(users)
+        missing = [i for i, recommendation in enumerate(recommendations) if recommendation is None]
+        if missing:
+            candidates = self.retriever.retrieve_many([users[i] for i in missing], [prev_tracks[i] for i in missing])
+            sessions = self.start_sessions(missing, candidates, prev_tracks, recommendations)
+            if sessions:
+                self.sessions.put_many([(users[i], rest) for i, rest in sessions])
+        return self.fill_fallback(recommendations, users, prev_tracks, prev_track_times)
+
+    async def recommend_many_async(self, users: List[int], prev_tracks: List[int],
+                                   prev_track_times: List[float]) -> List[int]:
+        recommendations = await self.sessions.pop_many_async(users)
+        missing = [i for i, recommendation in enumerate(recommendations) if recommendation is None]
+        if missing:
+            candidates = await self.retriever.retrieve_many_async(
+                [users[i] for i in missing], [prev_tracks[i] for i in missing]
             )
-            context_embedding = context_embedding.cpu().numpy()
+            sessions = self.start_sessions(missing, candidates, prev_tracks, recommendations)
+            if sessions:
+                await self.sessions.put_many_async([(users[i], rest) for i, rest in sessions])
+        return self.fill_fallback(recommendations, users, prev_tracks, prev_track_times)
+
+    def start_sessions(self, missing: List[int], candidates: List[List[int]], prev_tracks: List[int],
+                       recommendations: List[Optional[int]]) -> List[Tuple[int, List[int]]]:
+        """
+        Start the sessions of the events at the missing positions, filling
+        in their recommendations, and return the candidates left to store.
+        """
+        sessions = []
+        for i, event_candidates in zip(missing, candidates):
+            recommendations[i], rest = self.start_session(event_candidates, prev_tracks[i])
+            if rest:
+                sessions.append((i, rest))
+        return sessions
+
+    def fill_fallback(self, recommendations: List[Optional[int]], users: List[int], prev_tracks: List[int],
+                      prev_track_times: List[float]) -> List[int]:
+        return [
+            recommendation if recommendation is not None else self.fallback.recommend_next(*event)
+            for recommendation, event in zip(recommendations, zip(users, prev_tracks, prev_track_times))
+        ]
+
+    def calculate_recommendations(self, user: int, prev_track: int) -> list:
+        return self.retriever.retrieve(user, prev_track)
 
-            neighbours = np.argpartition(-np.dot(self.track_embeddings, context_embedding), self.top_tracks_per_user)[:self.top_tracks_per_user]
-            recommendations = neighbours.tolist()
+    @staticmethod
+    def start_session(recommendations: List[int], prev_track: int) -> Tuple[Optional[int], List[int]]:
+        candidates = [track for track in recommendations if track != prev_track]
+        if not candidates:
+            return None, []
 
-            return recommendations
+        index = random.randrange(len(candidates))
+        recommendation = candidates[index]
+        candidates[index] = candidates[-1]
+        candidates.pop()
+        return recommendation, candidates
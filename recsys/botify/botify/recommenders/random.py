@@ -1,14 +1,19 @@
-from typing import Union
-
-from flask_redis import Redis
-from redis.client import StrictRedis
-
 from .recommender import Recommender
+from ..sampler import TrackSampler
 
 
 class Random(Recommender):
-    def __init__(self, track_redis: Union[Redis, StrictRedis]):
-        self.track_redis = track_redis
+    """
+    Recommend a random track from the catalog. Sampling happens
+    in memory, so this fallback never touches the network.
+    """
+
+    def __init__(self, sampler: TrackSampler):
+        self.sampler = sampler
+
+    @classmethod
+    def from_resources(cls, resources):
+        return cls(resources.sampler)
 
     def recommend_next(self, user: int, prev_track: int, prev_track_time: float) -> int:
-        return int(self.track_redis.randomkey())
+        return self.sampler.sample()
@@ -1,3 +1,39 @@
+import asyncio
+from typing import List
+
+
 class Recommender:
+    @classmethod
+    def from_resources(cls, resources, **params):
+        """
+        Build the recommender from the shared server resources
+        (see botify.recommenders.registry.Resources) and
+        the parameters given for it in config.
+        """
+        raise NotImplementedError()
+
     def recommend_next(self, user: int, prev_track: int, prev_track_time: float) -> int:
-        raise NotImplementedError()
\ No newline at end of file
+        raise NotImplementedError()
+
+    async def recommend_next_async(self, user: int, prev_track: int, prev_track_time: float) -> int:
+        """
+        The asyncio counterpart of recommend_next used by the ASGI server.
+        Recommenders which talk to redis override it and expect
+        their redis clients to be asyncio clients.
+        """
+        return self.recommend_next(user, prev_track, prev_track_time)
+
+    def recommend_many(self, users: List[int], prev_tracks: List[int], prev_track_times: List[float]) -> List[int]:
+        """
+        Recommend the next track for every event of a batch request.
+        The users of one call are distinct, so recommenders may serve
+        them in any order: ContextualV2 pops all the sessions in one
+        round trip and retrieves candidates for the new ones at once.
+        """
+        return [self.recommend_next(*event) for event in zip(users, prev_tracks, prev_track_times)]
+
+    async def recommend_many_async(self, users: List[int], prev_tracks: List[int],
+                                   prev_track_times: List[float]) -> List[int]:
+        return list(await asyncio.gather(
+            *(self.recommend_next_async(*event) for event in zip(users, prev_tracks, prev_track_times))
+        ))
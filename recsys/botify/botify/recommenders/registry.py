@@ -0,0 +1,124 @@
+import importlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Type
+
+from .contextual import Contextual
+from .contextual_v2 import ContextualV2
+from .random import Random
+from .recommender import Recommender
+from .sticky_artist import StickyArtist
+from .top_pop import TopPop
+from .user_based import Collaborative
+from ..cache import LocalCache, ReadThroughCache
+from ..experiment import Experiment, Experiments, Treatment
+from ..retrieval import ContextRetriever
+from ..sampler import TrackSampler
+from ..session import SessionStore
+
+
+@dataclass
+class Resources:
+    """
+    Shared state recommenders are built from. The flask server
+    fills it with redis clients, the ASGI server with asyncio ones.
+    """
+
+    tracks_with_recs: ReadThroughCache
+    tracks_with_diverse_recs: ReadThroughCache
+    artists: ReadThroughCache
+    recommendations: object
+    recommendations_svd: object
+    session: SessionStore
+    sampler: TrackSampler
+    retriever: Optional[ContextRetriever] = None
+    top_tracks: List[int] = field(default_factory=list)
+
+
+def build_resources(redis: Dict[str, object], caches: Dict[str, LocalCache], sampler: TrackSampler,
+                    retriever: Optional[ContextRetriever] = None, top_tracks: Optional[List[int]] = None,
+                    session_ttl: Optional[int] = None) -> Resources:
+    """
+    Wrap redis clients, keyed by their config prefix, into resources.
+    """
+    return Resources(
+        tracks_with_recs=ReadThroughCache(
+            redis["REDIS_TRACKS_WITH_RECS"], caches["tracks_with_recs"], name="tracks_with_recs"
+        ),
+        tracks_with_diverse_recs=ReadThroughCache(
+            redis["REDIS_TRACKS_WITH_DIVERSE_RECS"], caches["tracks_with_diverse_recs"], name="tracks_with_diverse_recs"
+        ),
+        artists=ReadThroughCache(redis["REDIS_ARTIST"], caches["artists"], name="artists"),
+        recommendations=redis["REDIS_RECOMMENDATIONS"],
+        recommendations_svd=redis["REDIS_RECOMMENDATIONS_SVD"],
+        session=SessionStore(redis["REDIS_SESSION"], session_ttl),
+        sampler=sampler,
+        retriever=retriever,
+        top_tracks=top_tracks or [],
+    )
+
+
+RECOMMENDERS = {
+    "random": Random,
+    "top_pop": TopPop,
+    "sticky_artist": StickyArtist,
+    "collaborative": Collaborative,
+    "contextual": Contextual,
+    "contextual_v2": ContextualV2,
+}
+
+
+def resolve(recommender_type: str) -> Type[Recommender]:
+    """
+    Find a recommender class either by its short name or by
+    a fully qualified "package.module.Class" path, so new
+    recommenders can be plugged in from config.
+    """
+    if recommender_type in RECOMMENDERS:
+        return RECOMMENDERS[recommender_type]
+
+    module_name, _, class_name = recommender_type.rpartition(".")
+    if not module_name:
+        raise ValueError(f"Unknown recommender type: {recommender_type}")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def build_recommenders(config: Dict[str, dict], resources: Resources) -> Dict[str, Recommender]:
+    recommenders = {}
+    for name, params in config.items():
+        params = dict(params)
+        recommender_class = resolve(params.pop("type"))
+        recommenders[name] = recommender_class.from_resources(resources, **params)
+    return recommenders
+
+
+class Router:
+    """
+    A routing table from experiment treatments to recommender
+    instances. Recommenders are built once upon server startup
+    and reused by every request.
+    """
+
+    def __init__(self, experiment: Experiment, routes: Dict[Treatment, Recommender],
+                 names: Optional[Dict[Treatment, str]] = None):
+        self.experiment = experiment
+        self.routes = routes
+        self.names = names or {treatment: type(recommender).__name__ for treatment, recommender in routes.items()}
+
+    def route(self, user: int) -> Tuple[Treatment, Recommender]:
+        treatment = self.experiment.assign(user)
+        return treatment, self.routes[treatment]
+
+    @classmethod
+    def from_config(cls, config, resources: Resources):
+        recommenders = build_recommenders(config["RECOMMENDERS"], resources)
+
+        routing = config["ROUTING"]
+        experiment = getattr(Experiments, routing["experiment"])
+        names = {Treatment[treatment]: name for treatment, name in routing["treatments"].items()}
+        routes = {treatment: recommenders[name] for treatment, name in names.items()}
+
+        missing = [Treatment(i).name for i in range(experiment.split.value) if Treatment(i) not in routes]
+        if missing:
+            raise ValueError(f"No recommender configured for {experiment.name} treatments {missing}")
+
+        return cls(experiment, routes, names)
@@ -1,32 +1,41 @@
 import random
-from typing import Union
-
-from flask_redis import Redis
-from redis.client import StrictRedis
 
 from .random import Random
 from .recommender import Recommender
-from ..utils import from_bytes
+from ..cache import ReadThroughCache
+from ..sampler import TrackSampler
 
 
 class StickyArtist(Recommender):
-    def __init__(self, tracks_redis: Union[Redis, StrictRedis], artists_redis: Union[Redis, StrictRedis]):
-        self.fallback = Random(tracks_redis)
-        self.tracks_redis = tracks_redis
-        self.artists_redis = artists_redis
+    def __init__(self, tracks: ReadThroughCache, artists: ReadThroughCache, sampler: TrackSampler):
+        self.fallback = Random(sampler)
+        self.tracks = tracks
+        self.artists = artists
+
+    @classmethod
+    def from_resources(cls, resources):
+        return cls(resources.tracks_with_recs, resources.artists, resources.sampler)
 
     def recommend_next(self, user: int, prev_track: int, prev_track_time: float) -> int:
-        track_data = self.tracks_redis.get(prev_track)
-        if track_data is not None:
-            track = from_bytes(track_data)
-        else:
+        track = self.tracks.get(prev_track)
+        if track is None:
+            raise ValueError(f"Track not found: {prev_track}")
+
+        artist_tracks = self.artists.get(track.artist)
+        if artist_tracks is None:
+            raise ValueError(f"Artist not found: {prev_track}")
+
+        index = random.randint(0, len(artist_tracks) - 1)
+        return int(artist_tracks[index])
+
+    async def recommend_next_async(self, user: int, prev_track: int, prev_track_time: float) -> int:
+        track = await self.tracks.get_async(prev_track)
+        if track is None:
             raise ValueError(f"Track not found: {prev_track}")
 
-        artist_data = self.artists_redis.get(track.artist)
-        if artist_data is not None:
-            artist_tracks = from_bytes(artist_data)
-        else:
+        artist_tracks = await self.artists.get_async(track.artist)
+        if artist_tracks is None:
             raise ValueError(f"Artist not found: {prev_track}")
 
         index = random.randint(0, len(artist_tracks) - 1)
-        return artist_tracks[index]
+        return int(artist_tracks[index])
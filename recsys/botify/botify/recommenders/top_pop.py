@@ -1,18 +1,20 @@
 import random
-from typing import List, Union
-
-from flask_redis import Redis
-from redis.client import StrictRedis
+from typing import List
 
 from .random import Random
 from .recommender import Recommender
+from ..sampler import TrackSampler
 
 
 class TopPop(Recommender):
-    def __init__(self, tracks_redis: Union[Redis, StrictRedis], top_tracks: List[int]):
-        self.random = Random(tracks_redis)
+    def __init__(self, sampler: TrackSampler, top_tracks: List[int]):
+        self.random = Random(sampler)
         self.top_tracks = top_tracks
 
+    @classmethod
+    def from_resources(cls, resources, size=None):
+        return cls(resources.sampler, resources.top_tracks[:size])
+
     def recommend_next(self, user: int, prev_track: int, prev_track_time: float) -> int:
         if self.top_tracks:
             return random.choice(list(self.top_tracks))
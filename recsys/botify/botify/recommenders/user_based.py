@@ -2,17 +2,32 @@ import random
 
 from .random import Random
 from .recommender import Recommender
+from ..metrics import stage
+from ..sampler import TrackSampler
 from ..utils import from_bytes
 
 
 class Collaborative(Recommender):
-    def __init__(self, recommendations_redis, track_redis):
+    def __init__(self, recommendations_redis, sampler: TrackSampler):
         self.recommendations_redis = recommendations_redis
-        self.fallback = Random(track_redis)
+        self.fallback = Random(sampler)
+
+    @classmethod
+    def from_resources(cls, resources, recommendations="recommendations"):
+        return cls(getattr(resources, recommendations), resources.sampler)
 
     def recommend_next(self, user: int, prev_track: int, prev_track_time: float) -> int:
-        recommendations = self.recommendations_redis.get(user)
+        with stage("redis_get_recommendations"):
+            recommendations = self.recommendations_redis.get(user)
         if recommendations is not None:
-            return random.choice(list(from_bytes(recommendations)))
+            return int(random.choice(from_bytes(recommendations)))
         else:
             return self.fallback.recommend_next(user, prev_track, prev_track_time)
+
+    async def recommend_next_async(self, user: int, prev_track: int, prev_track_time: float) -> int:
+        with stage("redis_get_recommendations"):
+            recommendations = await self.recommendations_redis.get(user)
+        if recommendations is not None:
+            return int(random.choice(from_bytes(recommendations)))
+        else:
+            return await self.fallback.recommend_next_async(user, prev_track, prev_track_time)
@@ -0,0 +1,171 @@
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List
+
+import numpy as np
+
+from botify.index import TrackIndex
+from botify.metrics import stage
+
+
+class ContextRetriever:
+    """
+    Find candidate tracks for a (user, previous track) context:
+    embed the context with the model's context tower and look
+    up the closest tracks in the track index.
+
+    The encoder is anything with encode(users, tracks) returning
+    a numpy array of context embeddings, see botify.model.
+    """
+
+    def __init__(self, encoder, track_index: TrackIndex, top_tracks_per_user: int = 40):
+        self.encoder = encoder
+        self.track_index = track_index
+        self.top_tracks_per_user = top_tracks_per_user
+
+    def retrieve(self, user: int, prev_track: int) -> List[int]:
+        return self.retrieve_many([user], [prev_track])[0]
+
+    async def retrieve_async(self, user: int, prev_track: int) -> List[int]:
+        """
+        Run the encoder in the running loop's default executor
+        so that inference does not block other requests.
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(None, context.run, self.retrieve, user, prev_track)
+
+    def retrieve_many(self, users: List[int], prev_tracks: List[int]) -> List[List[int]]:
+        with stage("inference"):
+            context_embeddings = self.encoder.encode(np.array(users), np.array(prev_tracks))
+
+        with stage("top_k"):
+            neighbours = self.track_index.search(context_embeddings, self.top_tracks_per_user)
+        return [row[row >= 0].tolist() for row in neighbours]
+
+    async def retrieve_many_async(self, users: List[int], prev_tracks: List[int]) -> List[List[int]]:
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(None, context.run, self.retrieve_many, users, prev_tracks)
+
+    def close(self):
+        pass
+
+
+class BatchedContextRetriever(ContextRetriever):
+    """
+    Collect contexts from concurrent requests and retrieve
+    candidates for them with a single forward pass and
+    a single index search.
+
+    A batch is flushed once it reaches max_batch_size items
+    or when the oldest item has waited for max_wait_ms.
+    The worker thread is started on first use, so the
+    retriever can be created before the server forks.
+    Inference and top-k of a batch are timed without request
+    labels, since the batch mixes requests of many sessions.
+    Once closed, the worker finishes the pending batches and
+    stops, and late requests are served one by one.
+    """
+
+    def __init__(self, encoder, track_index: TrackIndex, top_tracks_per_user: int = 40,
+                 max_batch_size: int = 64, max_wait_ms: float = 2.0):
+        super().__init__(encoder, track_index, top_tracks_per_user)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self.pending = queue.Queue()
+        self.worker = None
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def retrieve(self, user: int, prev_track: int) -> List[int]:
+        with stage("batch_retrieve"):
+            return self.submit(user, prev_track).result()
+
+    async def retrieve_async(self, user: int, prev_track: int) -> List[int]:
+        with stage("batch_retrieve"):
+            # The worker thread resolves the future, the running loop is woken up
+            return await asyncio.wrap_future(self.submit(user, prev_track), loop=asyncio.get_running_loop())
+
+    def submit(self, user: int, prev_track: int) -> Future:
+        future = Future()
+        with self.lock:
+            if not self.closed:
+                if self.worker is None:
+                    self.worker = threading.Thread(target=self.run, name="context-retriever", daemon=True)
+                    self.worker.start()
+                self.pending.put((user, prev_track, future))
+                return future
+
+        self.process([(user, prev_track, future)])
+        return future
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            if self.worker is not None:
+                self.pending.put(None)
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch:
+                self.process(batch)
+            if self.closed and self.pending.empty():
+                return
+
+    def next_batch(self) -> list:
+        batch = []
+        deadline = None
+
+        while len(batch) < self.max_batch_size:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            try:
+                if timeout is None:
+                    item = self.pending.get()
+                    deadline = time.monotonic() + self.max_wait
+                elif timeout > 0:
+                    item = self.pending.get(timeout=timeout)
+                else:
+                    item = self.pending.get_nowait()
+            except queue.Empty:
+                break
+            # close() wakes the worker up with None
+            if item is None:
+                break
+            batch.append(item)
+
+        return batch
+
+    def process(self, batch: list):
+        users, prev_tracks, futures = zip(*batch)
+        try:
+            recommendations = self.retrieve_many(list(users), list(prev_tracks))
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        for future, tracks in zip(futures, recommendations):
+            future.set_result(tracks)
+
+
+def build_retriever(config, encoder, track_index: TrackIndex) -> ContextRetriever:
+    top_tracks_per_user = config.get("TOP_TRACKS_PER_USER", 40)
+    max_batch_size = config.get("CONTEXT_BATCH_MAX_SIZE", 1)
+
+    if max_batch_size <= 1:
+        return ContextRetriever(encoder, track_index, top_tracks_per_user)
+
+    return BatchedContextRetriever(
+        encoder,
+        track_index,
+        top_tracks_per_user,
+        max_batch_size,
+        config.get("CONTEXT_BATCH_MAX_WAIT_MS", 2.0),
+    )
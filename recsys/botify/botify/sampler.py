@@ -0,0 +1,74 @@
+import random
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+UNIFORM = "uniform"
+POPULARITY = "popularity"
+
+
+class TrackSampler:
+    """
+    Sample track ids in O(1) without touching redis.
+
+    Uniform sampling picks a random position in the id array.
+    Weighted sampling uses Vose's alias method: every slot holds
+    a track, an alias and the probability of keeping the track.
+    """
+
+    def __init__(self, track_ids: Sequence[int], weights: Optional[Sequence[float]] = None):
+        if len(track_ids) == 0:
+            raise ValueError("Can not sample from an empty catalog")
+
+        self.track_ids = [int(track) for track in track_ids]
+        self.size = len(self.track_ids)
+        self.probabilities = None
+        self.aliases = None
+
+        if weights is not None:
+            self.probabilities, self.aliases = self.build_alias_table(np.asarray(weights, dtype=np.float64))
+
+    def sample(self) -> int:
+        index = random.randrange(self.size)
+        if self.probabilities is None or random.random() < self.probabilities[index]:
+            return self.track_ids[index]
+        return self.track_ids[self.aliases[index]]
+
+    @staticmethod
+    def build_alias_table(weights: np.ndarray):
+        scaled = weights * len(weights) / weights.sum()
+        probabilities = np.ones(len(weights))
+        aliases = np.arange(len(weights))
+
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            probabilities[less] = scaled[less]
+            aliases[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+
+        return probabilities.tolist(), aliases.tolist()
+
+
+def popularity_weights(track_ids: Sequence[int], top_track_ids: List[int]) -> np.ndarray:
+    """
+    Weigh tracks by the inverse of their rank in the top tracks list.
+    Tracks that are not in the list share the weight of the last rank.
+    """
+    ranks = {track: rank for rank, track in enumerate(top_track_ids)}
+    default_rank = len(top_track_ids)
+    return np.array([1.0 / (ranks.get(track, default_rank) + 1) for track in track_ids])
+
+
+def build_sampler(config, track_ids: Sequence[int], top_track_ids: List[int]) -> TrackSampler:
+    sampler_type = config.get("FALLBACK_SAMPLER", UNIFORM)
+    if sampler_type == UNIFORM:
+        return TrackSampler(track_ids)
+    if sampler_type == POPULARITY:
+        return TrackSampler(track_ids, popularity_weights(track_ids, top_track_ids))
+    raise ValueError(f"Unknown fallback sampler: {sampler_type}")
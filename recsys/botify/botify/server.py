@@ -1,24 +1,34 @@
+import argparse
+import functools
 import json
 import logging
+import os
 import time
 from dataclasses import asdict
 from datetime import datetime
-from typing import Union
+from typing import Callable, Dict, Tuple
 
-import torch
-from flask import Flask
+import numpy as np
+from flask import Flask, Response, request
 from flask_redis import Redis
 from flask_restful import Resource, Api, abort, reqparse
 from flask_restful.reqparse import RequestParser
-from redis.client import StrictRedis
 
+from botify import batch
+from botify.cache import LocalCache, build_cache
 from botify.catalog import Catalog
 from botify.data import DataLogger, Datum
-from botify.experiment import Experiments, Treatment
-from botify.model.model import ContextualRanker, ModelConfig
-from botify.recommenders.contextual import Contextual
-from botify.recommenders.contextual_v2 import ContextualV2
-from botify.utils import from_bytes
+from botify.experiment import Experiments
+from botify.generation import DATASET_REDIS, Generation, Generations, namespaced, watched_paths
+from botify import metrics
+from botify.index import TrackIndex
+from botify.prefork import KeepAliveRequestHandler
+from botify.recommenders.registry import Router, build_resources
+from botify.retrieval import ContextRetriever, build_retriever
+from botify.sampler import build_sampler
+
+FLASK = "flask"
+ASGI = "asgi"
 
 
 class Hello(Resource):
@@ -30,75 +40,100 @@ class Hello(Resource):
 
 
 class Track(Resource):
-    def __init__(self, tracks_with_recs_redis: Union[Redis, StrictRedis]):
-        self.tracks_with_recs_redis = tracks_with_recs_redis
+    def __init__(self, generations: Generations):
+        self.generations = generations
 
     def get(self, track: int):
-        data = self.tracks_with_recs_redis.connection.get(track)
+        data = self.generations.current.resources.tracks_with_recs.get(track)
         if data is not None:
-            return asdict(from_bytes(data))
+            return dict(asdict(data), recommendations=[int(t) for t in data.recommendations])
         else:
             abort(404, description="Track not found")
 
 
+class CacheStats(Resource):
+    def __init__(self, generations: Generations):
+        self.generations = generations
+
+    def get(self):
+        return {name: cache.stats() for name, cache in self.generations.current.caches.items()}
+
+
+class Metrics(Resource):
+    def get(self):
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+class Reload(Resource):
+    def __init__(self, generations: Generations):
+        self.generations = generations
+
+    def post(self):
+        if not self.generations.reload():
+            return dict(self.generations.status(), message="A reload is already in progress"), 409
+        return self.generations.status(), 202
+
+
+class GenerationStatus(Resource):
+    def __init__(self, generations: Generations):
+        self.generations = generations
+
+    def get(self):
+        return self.generations.status()
+
+
 class NextTrack(Resource):
-    def __init__(
-            self,
-            parser: RequestParser,
-            tracks_with_recs_redis: Union[Redis, StrictRedis],
-            tracks_with_recs_contextual_v2_redis: Union[Redis, StrictRedis],
-            session_redis: Union[Redis, StrictRedis],
-            model: ContextualRanker,
-            track_embeddings: torch.Tensor,
-            data_logger: DataLogger
-    ):
+    def __init__(self, parser: RequestParser, generations: Generations, data_logger: DataLogger):
         self.parser = parser
-        self.tracks_with_recs_redis = tracks_with_recs_redis
-        self.tracks_with_recs_contextual_v2_redis = tracks_with_recs_contextual_v2_redis
-        self.session_redis = session_redis
-        self.model = model
-        self.track_embeddings = track_embeddings
-
+        self.generations = generations
         self.data_logger = data_logger
 
     def post(self, user: int):
         start = time.time()
 
         args = self.parser.parse_args()
-
-        treatment = Experiments.CONTEXTUAL_V2.assign(user)
-        if treatment == Treatment.T1:
-            recommender = ContextualV2(self.session_redis.connection, self.model, self.track_embeddings)
-        else:
-            recommender = Contextual(self.tracks_with_recs_redis.connection)
-
-        recommendation = recommender.recommend_next(user, args.track, args.time)
-
-        self.data_logger.log(
-            "next",
-            Datum(
-                int(datetime.now().timestamp() * 1000),
-                user,
-                args.track,
-                args.time,
-                time.time() - start,
-                recommendation,
-            ),
-        )
+        parsed = time.time()
+
+        router = self.generations.current.router
+        treatment, recommender = router.route(user)
+        routed = time.time()
+
+        with metrics.labelled(router.names[treatment], treatment.name):
+            metrics.observe("parse_args", parsed - start)
+            metrics.observe("assign", routed - parsed)
+
+            with metrics.stage("recommend"):
+                recommendation = recommender.recommend_next(user, args.track, args.time)
+
+            with metrics.stage("log"):
+                self.data_logger.log(
+                    "next",
+                    Datum(
+                        int(datetime.now().timestamp() * 1000),
+                        user,
+                        args.track,
+                        args.time,
+                        time.time() - start,
+                        recommendation,
+                    ),
+                    {router.experiment.name: treatment},
+                )
+
+            metrics.observe("request", time.time() - start)
         return {"user": user, "track": recommendation}
 
 
 class LastTrack(Resource):
-    def __init__(self, parser: RequestParser, session_redis: Union[Redis, StrictRedis], data_logger: DataLogger):
+    def __init__(self, parser: RequestParser, generations: Generations, data_logger: DataLogger):
         self.parser = parser
-        self.session_redis = session_redis
+        self.generations = generations
         self.data_logger = data_logger
 
     def post(self, user: int):
         start = time.time()
         args = self.parser.parse_args()
 
-        self.session_redis.delete(user)
+        self.generations.current.resources.session.delete(user)
 
         self.data_logger.log(
             "last",
@@ -114,64 +149,296 @@ class LastTrack(Resource):
         return {"user": user}
 
 
-def load_model(checkpoint_path: str):
-    model_config = ModelConfig(
-        unique_users_count=10000,
-        unique_tracks_count=50000,
-        unique_artists_count=12000,
-        user_embedding_dim=30,
-        context_track_embedding_dim=100,
-        track_embedding_dim=100,
-        artist_embedding_dim=30,
-        hidden_dims=[512, 256, 128],
-        dropout_prob=0.0
+class NextTracks(Resource):
+    """
+    Recommend the next track for every event of a batch. Events of
+    the same user are served in order, one per round, and the events
+    of a round are served by their recommenders with one call each.
+    """
+
+    def __init__(self, generations: Generations, data_logger: DataLogger, max_events: int):
+        self.generations = generations
+        self.data_logger = data_logger
+        self.max_events = max_events
+
+    def post(self):
+        start = time.time()
+        try:
+            events = batch.parse_events(request.get_json(silent=True), self.max_events)
+        except ValueError as e:
+            abort(400, message=str(e))
+
+        router = self.generations.current.router
+        recommendations = [None] * len(events)
+        for treatment, recommender, positions in batch.groups(router, events):
+            with metrics.labelled(router.names[treatment], treatment.name):
+                with metrics.stage("recommend_many"):
+                    tracks = recommender.recommend_many(*batch.columns(events, positions))
+                for i, track in zip(positions, tracks):
+                    recommendations[i] = track
+
+                with metrics.stage("log"):
+                    batch.log_events(
+                        self.data_logger, "next", events, positions, start, tracks, {router.experiment.name: treatment}
+                    )
+
+        metrics.observe("batch_request", time.time() - start)
+        return {
+            "recommendations": [
+                {"user": user, "track": track} for (user, _, _), track in zip(events, recommendations)
+            ]
+        }
+
+
+class LastTracks(Resource):
+    def __init__(self, generations: Generations, data_logger: DataLogger, max_events: int):
+        self.generations = generations
+        self.data_logger = data_logger
+        self.max_events = max_events
+
+    def post(self):
+        start = time.time()
+        try:
+            events = batch.parse_events(request.get_json(silent=True), self.max_events)
+        except ValueError as e:
+            abort(400, message=str(e))
+
+        users = [user for user, _, _ in events]
+        if users:
+            self.generations.current.resources.session.delete_many(users)
+
+        batch.log_events(self.data_logger, "last", events, range(len(events)), start)
+        return {"users": users}
+
+
+def load_encoder_and_index(app) -> Tuple[object, TrackIndex]:
+    """
+    Load the context encoder and the track index. The "numpy"
+    encoder reads the files written by botify.model.export and
+    memory-maps the index without importing torch at all, the
+    others load the checkpoint and build the index in memory.
+    """
+    if app.config["CONTEXT_ENCODER"] == "numpy":
+        from botify.model.numpy_encoder import load_exported
+
+        return load_exported(app.config["CONTEXT_ENCODER_PATH"]), TrackIndex.load(app.config)
+
+    import torch
+
+    from botify.model.checkpoint import load_model
+    from botify.model.encoder import build_context_encoder
+
+    model = load_model(app.config["CHECKPOINT_PATH"])
+    track_embeddings = torch.load(app.config["TRACK_EMBEDDINGS_PATH"]).cpu().numpy()
+
+    app.logger.info(f"Building {app.config['TRACK_INDEX_TYPE']} track index")
+    return build_context_encoder(app.config, model), TrackIndex.build(app.config, track_embeddings)
+
+
+def sample_context_embeddings(encoder, queries: int) -> np.ndarray:
+    users = np.random.randint(0, encoder.users_count, queries)
+    tracks = np.random.randint(0, encoder.tracks_count, queries)
+    return encoder.encode(users, tracks)
+
+
+def connect_redis(app) -> Dict[str, Redis]:
+    return {
+        prefix: Redis(app, config_prefix=prefix)
+        for prefix in [
+            "REDIS_TRACKS_WITH_RECS",
+            "REDIS_TRACKS_WITH_RECS_CONTEXTUAL_V2",
+            "REDIS_TRACKS_WITH_DIVERSE_RECS",
+            "REDIS_ARTIST",
+            "REDIS_RECOMMENDATIONS",
+            "REDIS_RECOMMENDATIONS_SVD",
+            "REDIS_SESSION",
+            "REDIS_CATALOG",
+        ]
+    }
+
+
+def build_caches(config) -> Dict[str, LocalCache]:
+    return {
+        "tracks_with_recs": build_cache(config, "TRACKS_CACHE"),
+        "tracks_with_diverse_recs": build_cache(config, "TRACKS_DIVERSE_CACHE"),
+        "artists": build_cache(config, "ARTISTS_CACHE"),
+    }
+
+
+def upload_catalog(app, redis: Dict[str, Redis], caches: Dict[str, LocalCache]) -> Catalog:
+    catalog = Catalog(app, redis["REDIS_CATALOG"].connection)
+    for cache in caches.values():
+        catalog.attach_cache(cache)
+    if app.config.get("CATALOG_FORMAT", "json") == "binary":
+        catalog.load_data_from_binary(app.config["CATALOG_BINARY_PATH"])
+    else:
+        catalog.load_data_from_filesystem(
+            app.config["TRACKS_CATALOG"],
+            app.config["TOP_TRACKS_CATALOG"],
+            app.config["TRACKS_WITH_DIVERSE_RECS_CATALOG"],
+            app.config["RECOMMENDATIONS_CONTEXTUAL_V2_FILE_PATH"],
+        )
+    catalog.upload_tracks_to_cache(
+        redis["REDIS_TRACKS_WITH_RECS"].connection,
+        redis["REDIS_TRACKS_WITH_DIVERSE_RECS"].connection,
+        redis["REDIS_TRACKS_WITH_RECS_CONTEXTUAL_V2"].connection,
     )
+    catalog.upload_artists_to_cache(redis["REDIS_ARTIST"].connection)
+    catalog.upload_recommendations_to_cache(redis["REDIS_RECOMMENDATIONS"].connection, "RECOMMENDATIONS_FILE_PATH")
+    catalog.upload_recommendations_to_cache(redis["REDIS_RECOMMENDATIONS_SVD"].connection, "RECOMMENDATIONS_SVD_FILE_PATH")
+    catalog.release()
+    return catalog
 
-    model = ContextualRanker.load_from_checkpoint(checkpoint_path, config=model_config)
-    model.eval()
-    return model
 
+def report_memory(app, step: str):
+    usage = metrics.memory_usage()
+    app.logger.info(f"After {step}: RSS {usage['rss_mb']:.0f} MB, peak RSS {usage['peak_rss_mb']:.0f} MB")
 
-if __name__ == "__main__":
-    root = logging.getLogger()
-    root.setLevel("INFO")
 
-    app = Flask(__name__)
-    app.config.from_file("config.json", load=json.load)
+def load_retriever(app) -> ContextRetriever:
+    encoder, track_index = load_encoder_and_index(app)
+    report = track_index.recall_report(
+        sample_context_embeddings(encoder, app.config["TRACK_INDEX_RECALL_QUERIES"]),
+        app.config["TOP_TRACKS_PER_USER"],
+    )
+    app.logger.info(
+        f"Track index {report.index_type} ({report.storage}): recall@{report.k} {report.recall:.3f} "
+        f"over {report.queries} queries, {report.latency_ms:.3f} ms per query vs {report.exact_latency_ms:.3f} ms exact, "
+        f"{report.code_bytes / 2 ** 20:.1f} MB of codes vs {report.float32_bytes / 2 ** 20:.1f} MB float32"
+    )
+
+    return build_retriever(app.config, encoder, track_index)
+
+
+def load_generation(app, redis: Dict[str, Redis], clients: Dict[str, object], number: int,
+                    memory_report: bool = False) -> Generation:
+    """
+    Upload the catalog to fresh namespaces and load the model
+    and the index, then build recommenders that read redis
+    through the given clients, sync or asyncio.
+    """
+    caches = build_caches(app.config)
+    catalog = upload_catalog(app, redis, caches)
+    if memory_report:
+        report_memory(app, f"catalog upload of generation {number}")
+    sampler = build_sampler(app.config, catalog.track_ids(), catalog.top_track_ids)
+    retriever = load_retriever(app)
+    if memory_report:
+        report_memory(app, f"retriever load of generation {number}")
+
+    resources = build_resources(
+        namespaced(clients, catalog.namespaces),
+        caches,
+        sampler,
+        retriever,
+        catalog.top_track_ids,
+        app.config.get("SESSION_TTL_SECONDS"),
+    )
+    return Generation(number, catalog, caches, resources, Router.from_config(app.config, resources))
+
+
+def dataset_redis(redis: Dict[str, Redis]) -> Dict[str, object]:
+    return {dataset: redis[prefix].connection for dataset, prefix in DATASET_REDIS.items()}
+
 
-    data_logger = DataLogger(app)
+def watch(app, generations: Generations):
+    interval = app.config.get("RELOAD_WATCH_INTERVAL_SECONDS")
+    if interval:
+        generations.watch(watched_paths(app.config), interval)
 
+
+def add_resources(app, generations: Generations, data_logger: DataLogger):
     parser = reqparse.RequestParser()
     parser.add_argument("track", type=int, location="json", required=True)
     parser.add_argument("time", type=float, location="json", required=True)
 
-    tracks_with_recs_redis = Redis(app, config_prefix="REDIS_TRACKS_WITH_RECS")
-    tracks_with_recs_contextual_v2_redis = Redis(app, config_prefix="REDIS_TRACKS_WITH_RECS_CONTEXTUAL_V2")
-    tracks_with_diverse_recs_redis = Redis(app, config_prefix="REDIS_TRACKS_WITH_DIVERSE_RECS")
-    artists_redis = Redis(app, config_prefix="REDIS_ARTIST")
-    recommendations_redis = Redis(app, config_prefix="REDIS_RECOMMENDATIONS")
-    recommendations_svd_redis = Redis(app, config_prefix="REDIS_RECOMMENDATIONS_SVD")
-    session_redis = Redis(app, config_prefix="REDIS_SESSION")
-
-    catalog = Catalog(app)
-    catalog.load_data_from_filesystem(
-        app.config["TRACKS_CATALOG"],
-        app.config["TOP_TRACKS_CATALOG"],
-        app.config["TRACKS_WITH_DIVERSE_RECS_CATALOG"],
-        app.config["RECOMMENDATIONS_CONTEXTUAL_V2_FILE_PATH"],
+    api = Api(app)
+    api.add_resource(Hello, "/")
+    api.add_resource(Track, "/track/<int:track>", resource_class_args=(generations,))
+    api.add_resource(NextTrack, "/next/<int:user>", resource_class_args=(parser, generations, data_logger))
+    api.add_resource(LastTrack, "/last/<int:user>", resource_class_args=(parser, generations, data_logger))
+    batch_resource_args = (generations, data_logger, app.config.get("BATCH_MAX_EVENTS", 1024))
+    api.add_resource(NextTracks, "/next", resource_class_args=batch_resource_args)
+    api.add_resource(LastTracks, "/last", resource_class_args=batch_resource_args)
+    api.add_resource(CacheStats, "/stats/cache", resource_class_args=(generations,))
+    api.add_resource(Metrics, "/metrics")
+    api.add_resource(Reload, "/admin/reload", resource_class_args=(generations,))
+    api.add_resource(GenerationStatus, "/admin/generation", resource_class_args=(generations,))
+
+
+def start_generations(app, redis: Dict[str, Redis],
+                      load: Callable[[Dict[str, object], int], Generation]) -> Generations:
+    clients = {prefix: client.connection for prefix, client in redis.items()}
+    generations = Generations(
+        lambda number: load(clients, number),
+        dataset_redis(redis),
+        app.logger,
+        app.config.get("RELOAD_GRACE_SECONDS", 10.0),
     )
-    catalog.upload_tracks_to_cache(tracks_with_recs_redis.connection, tracks_with_diverse_recs_redis.connection, tracks_with_recs_contextual_v2_redis.connection)
-    catalog.upload_artists_to_cache(artists_redis.connection)
-    catalog.upload_recommendations_to_cache(recommendations_redis.connection, "RECOMMENDATIONS_FILE_PATH")
-    catalog.upload_recommendations_to_cache(recommendations_svd_redis.connection, "RECOMMENDATIONS_SVD_FILE_PATH")
+    generations.start()
+    watch(app, generations)
+    return generations
 
-    model = load_model(app.config["CHECKPOINT_PATH"])
-    track_embeddings = torch.load(app.config["TRACK_EMBEDDINGS_PATH"])
 
-    api = Api(app)
-    api.add_resource(Hello, "/")
-    api.add_resource(Track, "/track/<int:track>", resource_class_args=(tracks_with_recs_redis,))
-    api.add_resource(NextTrack, "/next/<int:user>", resource_class_args=(parser, tracks_with_recs_redis, tracks_with_recs_contextual_v2_redis, session_redis, model, track_embeddings, data_logger))
-    api.add_resource(LastTrack, "/last/<int:user>", resource_class_args=(parser, session_redis.connection, data_logger))
+def run_flask(app, redis: Dict[str, Redis], load: Callable[[Dict[str, object], int], Generation],
+              data_logger: DataLogger):
+    add_resources(app, start_generations(app, redis, load), data_logger)
+    app.run(host="0.0.0.0", port=7777, request_handler=KeepAliveRequestHandler)
+
+
+def run_prefork(app, redis: Dict[str, Redis], load: Callable[[Dict[str, object], int], Generation],
+                workers: int):
+    from botify.prefork import Prefork, WorkerGenerations
+
+    def build(generations: WorkerGenerations, index: int):
+        data_logger = DataLogger(app, worker=index)
+        add_resources(app, generations, data_logger)
+        return app, data_logger.close
+
+    Prefork(start_generations(app, redis, load), build, workers, "0.0.0.0", 7777, app.logger,
+            drain_seconds=app.config.get("PREFORK_DRAIN_SECONDS", 30.0)).run()
+
+
+def run_asgi(app, redis: Dict[str, Redis], load: Callable[[Dict[str, object], int], Generation],
+             data_logger: DataLogger):
+    import uvicorn
+
+    from botify.server_async import create_asgi_app
+
+    asgi_app = create_asgi_app(app, load, dataset_redis(redis), data_logger)
+    uvicorn.run(asgi_app, host="0.0.0.0", port=7777)
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser()
+    arguments.add_argument("--mode", choices=[FLASK, ASGI], default=FLASK, help="Server implementation to run")
+    arguments.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes forked after the generation is loaded, 0 for one per core; flask only",
+    )
+    arguments.add_argument(
+        "--memory-report", action="store_true", help="Log peak and steady-state RSS after every startup step"
+    )
+    args = arguments.parse_args()
+    if args.workers != 1 and args.mode != FLASK:
+        arguments.error("--workers is only supported in flask mode")
+
+    root = logging.getLogger()
+    root.setLevel("INFO")
+
+    app = Flask(__name__)
+    app.config.from_file("config.json", load=json.load)
+
+    Experiments.precompute(app.config.get("EXPERIMENT_TABLE_USERS", 0))
+
+    redis = connect_redis(app)
+    load = functools.partial(load_generation, app, redis, memory_report=args.memory_report)
 
-    app.run(host="0.0.0.0", port=7777)
+    if args.workers != 1:
+        run_prefork(app, redis, load, args.workers or os.cpu_count())
+    elif args.mode == ASGI:
+        run_asgi(app, redis, load, DataLogger(app))
+    else:
+        run_flask(app, redis, load, DataLogger(app))
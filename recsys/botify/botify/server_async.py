@@ -0,0 +1,268 @@
+import asyncio
+import contextlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from datetime import datetime
+from typing import Callable, Dict
+
+import redis.asyncio as aioredis
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from botify import batch, metrics
+from botify.data import DataLogger, Datum
+from botify.generation import Generation, Generations, watched_paths
+
+REDIS_PREFIXES = [
+    "REDIS_TRACKS_WITH_RECS",
+    "REDIS_TRACKS_WITH_RECS_CONTEXTUAL_V2",
+    "REDIS_TRACKS_WITH_DIVERSE_RECS",
+    "REDIS_ARTIST",
+    "REDIS_RECOMMENDATIONS",
+    "REDIS_RECOMMENDATIONS_SVD",
+    "REDIS_SESSION",
+]
+
+
+def connect_redis_async(config, prefix: str) -> aioredis.Redis:
+    pool = aioredis.BlockingConnectionPool(
+        host=config[f"{prefix}_HOST"],
+        port=config[f"{prefix}_PORT"],
+        db=config[f"{prefix}_DB"],
+        max_connections=config.get("ASYNC_REDIS_MAX_CONNECTIONS", 64),
+    )
+    return aioredis.Redis(connection_pool=pool)
+
+
+class BadRequest(Exception):
+    def __init__(self, message: dict):
+        self.message = message
+
+
+class AsyncBotify:
+    """
+    The asyncio implementation of the botify API.
+
+    Serves the same endpoints as the Flask server using
+    asyncio redis clients and the async recommender methods.
+    Model inference runs in a thread pool of INFERENCE_THREADS
+    workers so the event loop keeps serving other sessions.
+
+    Generations are loaded with the asyncio clients, which only
+    exist within the event loop, so the first one is loaded
+    on startup of the application.
+    """
+
+    def __init__(self, app, load: Callable[[Dict[str, object], int], Generation], redis: Dict[str, object],
+                 data_logger: DataLogger):
+        self.app = app
+        self.load = load
+        self.data_logger = data_logger
+        self.max_events = app.config.get("BATCH_MAX_EVENTS", 1024)
+
+        self.redis = {}
+        self.generations = Generations(
+            lambda number: self.load(self.redis, number),
+            redis,
+            app.logger,
+            app.config.get("RELOAD_GRACE_SECONDS", 10.0),
+        )
+
+    @contextlib.asynccontextmanager
+    async def lifespan(self, _):
+        config = self.app.config
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=config.get("INFERENCE_THREADS", 4), thread_name_prefix="inference")
+        )
+
+        self.redis = {prefix: connect_redis_async(config, prefix) for prefix in REDIS_PREFIXES}
+        self.generations.start()
+        interval = config.get("RELOAD_WATCH_INTERVAL_SECONDS")
+        if interval:
+            self.generations.watch(watched_paths(config), interval)
+        yield
+
+        for redis in self.redis.values():
+            await redis.connection_pool.disconnect()
+
+    async def hello(self, request: Request):
+        return JSONResponse({
+            "status": "alive",
+            "message": "welcome to botify, the best toy music recommender",
+        })
+
+    async def track(self, request: Request):
+        data = await self.generations.current.resources.tracks_with_recs.get_async(request.path_params["track"])
+        if data is None:
+            return JSONResponse({"message": "Track not found"}, status_code=404)
+        return JSONResponse(dict(asdict(data), recommendations=[int(t) for t in data.recommendations]))
+
+    async def next(self, request: Request):
+        start = time.time()
+        user = request.path_params["user"]
+        try:
+            args = await self.parse_args(request)
+        except BadRequest as e:
+            return JSONResponse({"message": e.message}, status_code=400)
+        parsed = time.time()
+
+        router = self.generations.current.router
+        treatment, recommender = router.route(user)
+        routed = time.time()
+
+        with metrics.labelled(router.names[treatment], treatment.name):
+            metrics.observe("parse_args", parsed - start)
+            metrics.observe("assign", routed - parsed)
+
+            with metrics.stage("recommend"):
+                recommendation = await recommender.recommend_next_async(user, args["track"], args["time"])
+
+            with metrics.stage("log"):
+                self.data_logger.log(
+                    "next",
+                    Datum(
+                        int(datetime.now().timestamp() * 1000),
+                        user,
+                        args["track"],
+                        args["time"],
+                        time.time() - start,
+                        recommendation,
+                    ),
+                    {router.experiment.name: treatment},
+                )
+
+            metrics.observe("request", time.time() - start)
+        return JSONResponse({"user": user, "track": recommendation})
+
+    async def last(self, request: Request):
+        start = time.time()
+        user = request.path_params["user"]
+        try:
+            args = await self.parse_args(request)
+        except BadRequest as e:
+            return JSONResponse({"message": e.message}, status_code=400)
+
+        await self.generations.current.resources.session.delete_async(user)
+
+        self.data_logger.log(
+            "last",
+            Datum(
+                int(datetime.now().timestamp() * 1000),
+                user,
+                args["track"],
+                args["time"],
+                time.time() - start,
+            ),
+        )
+        return JSONResponse({"user": user})
+
+    async def next_many(self, request: Request):
+        start = time.time()
+        try:
+            events = batch.parse_events(await self.parse_json(request), self.max_events)
+        except BadRequest as e:
+            return JSONResponse({"message": e.message}, status_code=400)
+        except ValueError as e:
+            return JSONResponse({"message": str(e)}, status_code=400)
+
+        router = self.generations.current.router
+        recommendations = [None] * len(events)
+        for treatment, recommender, positions in batch.groups(router, events):
+            with metrics.labelled(router.names[treatment], treatment.name):
+                with metrics.stage("recommend_many"):
+                    tracks = await recommender.recommend_many_async(*batch.columns(events, positions))
+                for i, track in zip(positions, tracks):
+                    recommendations[i] = track
+
+                with metrics.stage("log"):
+                    batch.log_events(
+                        self.data_logger, "next", events, positions, start, tracks, {router.experiment.name: treatment}
+                    )
+
+        metrics.observe("batch_request", time.time() - start)
+        return JSONResponse({
+            "recommendations": [
+                {"user": user, "track": track} for (user, _, _), track in zip(events, recommendations)
+            ]
+        })
+
+    async def last_many(self, request: Request):
+        start = time.time()
+        try:
+            events = batch.parse_events(await self.parse_json(request), self.max_events)
+        except BadRequest as e:
+            return JSONResponse({"message": e.message}, status_code=400)
+        except ValueError as e:
+            return JSONResponse({"message": str(e)}, status_code=400)
+
+        users = [user for user, _, _ in events]
+        if users:
+            await self.generations.current.resources.session.delete_many_async(users)
+
+        batch.log_events(self.data_logger, "last", events, range(len(events)), start)
+        return JSONResponse({"users": users})
+
+    async def cache_stats(self, request: Request):
+        return JSONResponse({name: cache.stats() for name, cache in self.generations.current.caches.items()})
+
+    async def reload(self, request: Request):
+        if not self.generations.reload():
+            return JSONResponse(
+                dict(self.generations.status(), message="A reload is already in progress"), status_code=409
+            )
+        return JSONResponse(self.generations.status(), status_code=202)
+
+    async def generation(self, request: Request):
+        return JSONResponse(self.generations.status())
+
+    async def prometheus_metrics(self, request: Request):
+        return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+    @staticmethod
+    async def parse_json(request: Request):
+        try:
+            return await request.json()
+        except ValueError:
+            raise BadRequest("Failed to decode JSON object")
+
+    @classmethod
+    async def parse_args(cls, request: Request) -> dict:
+        body = await cls.parse_json(request)
+
+        args = {}
+        errors = {}
+        for name, kind in [("track", int), ("time", float)]:
+            try:
+                args[name] = kind(body[name])
+            except (KeyError, TypeError, ValueError):
+                errors[name] = f"Missing required parameter or invalid {kind.__name__} in the JSON body"
+
+        if errors:
+            raise BadRequest(errors)
+        return args
+
+    def routes(self) -> list:
+        return [
+            Route("/", self.hello, methods=["GET"]),
+            Route("/track/{track:int}", self.track, methods=["GET"]),
+            Route("/next/{user:int}", self.next, methods=["POST"]),
+            Route("/last/{user:int}", self.last, methods=["POST"]),
+            Route("/next", self.next_many, methods=["POST"]),
+            Route("/last", self.last_many, methods=["POST"]),
+            Route("/stats/cache", self.cache_stats, methods=["GET"]),
+            Route("/metrics", self.prometheus_metrics, methods=["GET"]),
+            Route("/admin/reload", self.reload, methods=["POST"]),
+            Route("/admin/generation", self.generation, methods=["GET"]),
+        ]
+
+
+def create_asgi_app(app, load: Callable[[Dict[str, object], int], Generation], redis: Dict[str, object],
+                    data_logger: DataLogger) -> Starlette:
+    """
+    redis maps datasets to sync clients, used to delete stale namespaces.
+    """
+    botify = AsyncBotify(app, load, redis, data_logger)
+    return Starlette(routes=botify.routes(), lifespan=botify.lifespan)
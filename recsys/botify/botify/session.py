@@ -0,0 +1,114 @@
+from typing import List, Optional, Tuple, Union
+
+from flask_redis import Redis
+from redis.client import StrictRedis
+from redis.exceptions import ResponseError
+
+from botify.metrics import stage
+
+
+class SessionStore:
+    """
+    Keep the candidate tracks of every user session in a redis set.
+
+    Each step pops a random candidate with SPOP and refreshes
+    the session TTL in the same pipeline, so serving a track takes
+    a single round trip and a served track is never offered again.
+    Abandoned sessions expire after ttl seconds.
+    """
+
+    def __init__(self, redis: Union[Redis, StrictRedis], ttl: Optional[int] = None):
+        self.redis = redis
+        self.ttl = ttl
+
+    def pop(self, user: int) -> Optional[int]:
+        pipeline = self.redis.pipeline(transaction=False)
+        self.queue_pop(pipeline, user)
+        with stage("session_pop"):
+            return self.parse_pop(pipeline.execute(raise_on_error=False))
+
+    def put(self, user: int, candidates: List[int]):
+        pipeline = self.redis.pipeline(transaction=False)
+        self.queue_put(pipeline, user, candidates)
+        with stage("session_put"):
+            pipeline.execute()
+
+    def delete(self, user: int):
+        with stage("session_delete"):
+            self.redis.delete(user)
+
+    def pop_many(self, users: List[int]) -> List[Optional[int]]:
+        """Pop a candidate for each of the users in a single round trip"""
+        pipeline = self.redis.pipeline(transaction=False)
+        for user in users:
+            self.queue_pop(pipeline, user)
+        with stage("session_pop"):
+            return self.parse_pop_many(pipeline.execute(raise_on_error=False))
+
+    def put_many(self, sessions: List[Tuple[int, List[int]]]):
+        pipeline = self.redis.pipeline(transaction=False)
+        for user, candidates in sessions:
+            self.queue_put(pipeline, user, candidates)
+        with stage("session_put"):
+            pipeline.execute()
+
+    def delete_many(self, users: List[int]):
+        with stage("session_delete"):
+            self.redis.delete(*users)
+
+    async def pop_async(self, user: int) -> Optional[int]:
+        pipeline = self.redis.pipeline(transaction=False)
+        self.queue_pop(pipeline, user)
+        with stage("session_pop"):
+            return self.parse_pop(await pipeline.execute(raise_on_error=False))
+
+    async def put_async(self, user: int, candidates: List[int]):
+        pipeline = self.redis.pipeline(transaction=False)
+        self.queue_put(pipeline, user, candidates)
+        with stage("session_put"):
+            await pipeline.execute()
+
+    async def delete_async(self, user: int):
+        with stage("session_delete"):
+            await self.redis.delete(user)
+
+    async def pop_many_async(self, users: List[int]) -> List[Optional[int]]:
+        pipeline = self.redis.pipeline(transaction=False)
+        for user in users:
+            self.queue_pop(pipeline, user)
+        with stage("session_pop"):
+            return self.parse_pop_many(await pipeline.execute(raise_on_error=False))
+
+    async def put_many_async(self, sessions: List[Tuple[int, List[int]]]):
+        pipeline = self.redis.pipeline(transaction=False)
+        for user, candidates in sessions:
+            self.queue_put(pipeline, user, candidates)
+        with stage("session_put"):
+            await pipeline.execute()
+
+    async def delete_many_async(self, users: List[int]):
+        with stage("session_delete"):
+            await self.redis.delete(*users)
+
+    def queue_pop(self, pipeline, user: int):
+        pipeline.spop(user)
+        if self.ttl is not None:
+            pipeline.expire(user, self.ttl)
+
+    def queue_put(self, pipeline, user: int, candidates: List[int]):
+        pipeline.delete(user)
+        pipeline.sadd(user, *candidates)
+        if self.ttl is not None:
+            pipeline.expire(user, self.ttl)
+
+    @staticmethod
+    def parse_pop(results: list) -> Optional[int]:
+        track = results[0]
+        if isinstance(track, ResponseError):
+            # A session stored in the old pickled format, put() replaces it
+            return None
+        return int(track) if track is not None else None
+
+    def parse_pop_many(self, results: list) -> List[Optional[int]]:
+        step = 1 if self.ttl is None else 2
+        return [self.parse_pop(results[i:i + step]) for i in range(0, len(results), step)]
@@ -1,10 +1,19 @@
-from dataclasses import dataclass, field
-from typing import List
+from dataclasses import dataclass
+from typing import Sequence
 
 
 @dataclass
 class Track:
+    __slots__ = ("track", "artist", "title", "recommendations")
+
     track: int
     artist: str
     title: str
-    recommendations: List[int] = field(default=lambda: [])
+    recommendations: Sequence[int]
+
+    def __setstate__(self, state):
+        # Pickles of the unslotted Track of the previous releases carry a plain dict
+        if isinstance(state, tuple):
+            state = state[1]
+        for name, value in state.items():
+            setattr(self, name, value)
@@ -1,9 +1,89 @@
 import pickle
+import struct
+
+import numpy as np
+
+from botify.track import Track
+
+# Binary values start with the format version. Pickles written by
+# the previous releases start with the PROTO opcode, so both kinds
+# of values can live in redis side by side during migration.
+VERSION = 1
+PICKLE_PROTO = 0x80
+
+KIND_TRACK = 1
+KIND_INTS = 2
+
+# Track ids are stored as uint16 whenever they fit, int32 otherwise
+UINT16 = np.dtype("<u2")
+INT32 = np.dtype("<i4")
+DTYPES = {UINT16.itemsize: UINT16, INT32.itemsize: INT32}
+
+# version, kind, id size, padding, track, number of recommendations, artist bytes, title bytes
+TRACK_HEADER = struct.Struct("<BBBxiIII")
+# version, kind, id size, padding, number of items
+INTS_HEADER = struct.Struct("<BBBxI")
 
 
 def to_bytes(instance):
+    if isinstance(instance, Track):
+        return encode_track(instance)
+    if isinstance(instance, (list, tuple, np.ndarray)):
+        return encode_ints(instance)
     return pickle.dumps(instance)
 
 
 def from_bytes(bts):
-    return pickle.loads(bts)
+    if bts[0] == PICKLE_PROTO:
+        return pickle.loads(bts)
+
+    version, kind = bts[0], bts[1]
+    if version != VERSION:
+        raise ValueError(f"Unsupported encoding version: {version}")
+
+    if kind == KIND_TRACK:
+        return decode_track(bts)
+    if kind == KIND_INTS:
+        return decode_ints(bts)
+    raise ValueError(f"Unsupported encoding kind: {kind}")
+
+
+def encode_track(track: Track) -> bytes:
+    recommendations = as_id_array(track.recommendations)
+    artist = track.artist.encode("utf-8")
+    title = track.title.encode("utf-8")
+
+    header = TRACK_HEADER.pack(
+        VERSION, KIND_TRACK, recommendations.itemsize, track.track, len(recommendations), len(artist), len(title)
+    )
+    return b"".join((header, recommendations.tobytes(), artist, title))
+
+
+def decode_track(bts) -> Track:
+    _, _, itemsize, track, recommendations_count, artist_size, title_size = TRACK_HEADER.unpack_from(bts)
+
+    offset = TRACK_HEADER.size
+    recommendations = np.frombuffer(bts, dtype=DTYPES[itemsize], count=recommendations_count, offset=offset)
+    offset += recommendations.nbytes
+    artist = bytes(bts[offset:offset + artist_size]).decode("utf-8")
+    offset += artist_size
+    title = bytes(bts[offset:offset + title_size]).decode("utf-8")
+
+    return Track(track, artist, title, recommendations)
+
+
+def encode_ints(values) -> bytes:
+    values = as_id_array(values)
+    return INTS_HEADER.pack(VERSION, KIND_INTS, values.itemsize, len(values)) + values.tobytes()
+
+
+def decode_ints(bts) -> np.ndarray:
+    _, _, itemsize, count = INTS_HEADER.unpack_from(bts)
+    return np.frombuffer(bts, dtype=DTYPES[itemsize], count=count, offset=INTS_HEADER.size)
+
+
+def as_id_array(values) -> np.ndarray:
+    values = np.asarray(values, dtype=INT32)
+    if len(values) > 0 and values.min() >= 0 and values.max() <= np.iinfo(UINT16).max:
+        return values.astype(UINT16)
+    return values
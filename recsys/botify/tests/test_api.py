@@ -0,0 +1,166 @@
+"""
+The same checks of the API against the Flask server and the ASGI
+one, both backed by fakeredis and a catalog of a few tracks::
+
+    python -m pytest tests
+
+Every user is routed to Contextual and every track has a single
+recommendation, so both servers must answer exactly the same.
+"""
+import functools
+import json
+import os
+from types import SimpleNamespace
+
+import fakeredis
+import fakeredis.aioredis
+import pytest
+from flask import Flask
+from starlette.testclient import TestClient
+
+from botify import server, server_async
+from botify.data import DataLogger
+
+CONFIG = os.path.join(os.path.dirname(__file__), os.pardir, "botify", "config.json")
+TRACKS = [
+    {"track": 0, "artist": "Jack Johnson", "title": "The Cove", "recommendations": [1]},
+    {"track": 1, "artist": "Billy Preston", "title": "Nothing from Nothing", "recommendations": [2]},
+    {"track": 2, "artist": "Jack Johnson", "title": "Banana Pancakes", "recommendations": [0]},
+]
+USER_RECOMMENDATIONS = [{"user": 7, "tracks": [2, 0]}]
+
+
+def write_lines(path, records: list) -> str:
+    path.write_text("".join(json.dumps(record) + "\n" for record in records))
+    return str(path)
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask("botify")
+    app.config.from_file(CONFIG, load=json.load)
+    tracks = write_lines(tmp_path / "tracks.json", TRACKS)
+    recommendations = write_lines(tmp_path / "recommendations.json", USER_RECOMMENDATIONS)
+    (tmp_path / "top_tracks.json").write_text(json.dumps([2, 0, 1]))
+    app.config.update(
+        CATALOG_FORMAT="json",
+        TRACKS_CATALOG=tracks,
+        TRACKS_WITH_DIVERSE_RECS_CATALOG=tracks,
+        RECOMMENDATIONS_CONTEXTUAL_V2_FILE_PATH=tracks,
+        TOP_TRACKS_CATALOG=str(tmp_path / "top_tracks.json"),
+        RECOMMENDATIONS_FILE_PATH=recommendations,
+        RECOMMENDATIONS_SVD_FILE_PATH=recommendations,
+        DATA_LOG_FILE=str(tmp_path / "data.json"),
+        RELOAD_GRACE_SECONDS=0,
+        RELOAD_WATCH_INTERVAL_SECONDS=None,
+        RECOMMENDERS={"contextual": {"type": "contextual"}},
+        ROUTING={"experiment": "CONTEXTUAL_V2", "treatments": {"C": "contextual", "T1": "contextual"}},
+    )
+    return app
+
+
+@pytest.fixture
+def redis_server(app, monkeypatch):
+    redis_server = fakeredis.FakeServer()
+    # Contextual reads no model, so none is loaded
+    monkeypatch.setattr(server, "load_retriever", lambda app: None)
+    monkeypatch.setattr(
+        server_async,
+        "connect_redis_async",
+        lambda config, prefix: fakeredis.aioredis.FakeRedis(server=redis_server, db=config[f"{prefix}_DB"]),
+    )
+    return redis_server
+
+
+def connect_redis(app, redis_server) -> dict:
+    """Stand-ins for the flask_redis clients, which only expose their connection"""
+    return {
+        prefix: SimpleNamespace(connection=fakeredis.FakeRedis(server=redis_server, db=app.config[f"{prefix}_DB"]))
+        for prefix in server_async.REDIS_PREFIXES + ["REDIS_CATALOG"]
+    }
+
+
+def flask_client(app, redis_server):
+    redis = connect_redis(app, redis_server)
+    load = functools.partial(server.load_generation, app, redis)
+    server.add_resources(app, server.start_generations(app, redis, load), DataLogger(app))
+    client = app.test_client()
+
+    def request(method: str, path: str, body=None):
+        response = client.open(path, method=method, json=body)
+        return response.status_code, response.get_json()
+
+    yield request
+
+
+def asgi_client(app, redis_server):
+    redis = connect_redis(app, redis_server)
+    load = functools.partial(server.load_generation, app, redis)
+    asgi_app = server_async.create_asgi_app(app, load, server.dataset_redis(redis), DataLogger(app))
+
+    with TestClient(asgi_app) as client:
+        def request(method: str, path: str, body=None):
+            response = client.request(method, path, json=body)
+            return response.status_code, response.json()
+
+        yield request
+
+
+@pytest.fixture(params=[flask_client, asgi_client], ids=["flask", "asgi"])
+def api(app, redis_server, request):
+    yield from request.param(app, redis_server)
+
+
+def test_hello(api):
+    status, body = api("GET", "/")
+    assert status == 200
+    assert body["status"] == "alive"
+
+
+def test_track(api):
+    status, body = api("GET", "/track/1")
+    assert status == 200
+    assert body == {"track": 1, "artist": "Billy Preston", "title": "Nothing from Nothing", "recommendations": [2]}
+
+
+def test_track_not_found(api):
+    status, _ = api("GET", "/track/100")
+    assert status == 404
+
+
+def test_next(api):
+    status, body = api("POST", "/next/7", {"track": 0, "time": 0.5})
+    assert status == 200
+    assert body == {"user": 7, "track": 1}
+
+
+@pytest.mark.parametrize("body, invalid", [({"track": 0}, "time"), ({"track": "first", "time": 0.5}, "track")])
+def test_next_invalid(api, body, invalid):
+    status, response = api("POST", "/next/7", body)
+    assert status == 400
+    assert invalid in response["message"]
+
+
+def test_last(api):
+    status, body = api("POST", "/last/7", {"track": 2, "time": 1.0})
+    assert status == 200
+    assert body == {"user": 7}
+
+
+def test_next_many(api):
+    events = [
+        {"user": 7, "track": 0, "time": 0.5},
+        {"user": 8, "track": 2, "time": 1.0},
+        {"user": 7, "track": 1, "time": 0.1},
+    ]
+    status, body = api("POST", "/next", {"events": events})
+    assert status == 200
+    assert body == {
+        "recommendations": [{"user": 7, "track": 1}, {"user": 8, "track": 0}, {"user": 7, "track": 2}]
+    }
+
+
+def test_last_many(api):
+    status, body = api("POST", "/last", {"events": [{"user": 7, "track": 2, "time": 1.0}]})
+    assert status == 200
+    assert body == {"users": [7]}
@@ -0,0 +1,69 @@
+"""
+Build, save, load and report the track index for every
+index type and storage, on random embeddings.
+"""
+import numpy as np
+import pytest
+
+from botify.index import FLAT, HNSW, IVF, STORAGE, TrackIndex
+
+TRACKS = 2000
+DIMENSION = 16
+CODE_SIZE = {"float32": 4 * DIMENSION, "float16": 2 * DIMENSION, "int8": DIMENSION}
+
+
+@pytest.fixture
+def embeddings():
+    return np.random.default_rng(0).standard_normal((TRACKS, DIMENSION), dtype=np.float32)
+
+
+def index_config(tmp_path, index_type: str, storage: str) -> dict:
+    return {
+        "TRACK_INDEX_PATH": str(tmp_path / "track_index.faiss"),
+        "TRACK_EMBEDDINGS_STORE_PATH": str(tmp_path / "track_embeddings.npy"),
+        "TRACK_INDEX_TYPE": index_type,
+        "TRACK_INDEX_STORAGE": storage,
+        "TRACK_INDEX_RERANK": 4,
+        "TRACK_INDEX_IVF_LISTS": 16,
+        "TRACK_INDEX_HNSW_NEIGHBOURS": 16,
+    }
+
+
+@pytest.mark.parametrize("storage", list(STORAGE))
+@pytest.mark.parametrize("index_type", [FLAT, IVF, HNSW])
+def test_save_load_report(tmp_path, embeddings, index_type, storage):
+    config = index_config(tmp_path, index_type, storage)
+    TrackIndex.build(config, embeddings).save(config)
+
+    track_index = TrackIndex.load(config)
+    assert (track_index.index_type, track_index.storage, track_index.rerank) == (index_type, storage, 4)
+
+    report = track_index.recall_report(embeddings[:20], 10)
+    assert report.recall > 0.5
+    if index_type == IVF:
+        # Every IVF code also carries the number of its list
+        assert report.code_bytes > TRACKS * CODE_SIZE[storage]
+    else:
+        assert report.code_bytes == TRACKS * CODE_SIZE[storage]
+    assert report.float32_bytes == TRACKS * DIMENSION * 4
+
+
+@pytest.mark.parametrize(
+    "index_type, key, value",
+    [(IVF, "TRACK_INDEX_IVF_LISTS", 32), (HNSW, "TRACK_INDEX_HNSW_NEIGHBOURS", 8),
+     (HNSW, "TRACK_INDEX_HNSW_EF_CONSTRUCTION", 40), (FLAT, "TRACK_INDEX_STORAGE", "int8")],
+)
+def test_load_refuses_other_build_parameters(tmp_path, embeddings, index_type, key, value):
+    config = index_config(tmp_path, index_type, "float32")
+    TrackIndex.build(config, embeddings).save(config)
+
+    with pytest.raises(ValueError, match="built with other parameters"):
+        TrackIndex.load(dict(config, **{key: value}))
+
+
+def test_load_applies_search_parameters(tmp_path, embeddings):
+    config = index_config(tmp_path, HNSW, "int8")
+    TrackIndex.build(config, embeddings).save(config)
+
+    track_index = TrackIndex.load(dict(config, TRACK_INDEX_HNSW_EF_SEARCH=128))
+    assert track_index.index.hnsw.efSearch == 128
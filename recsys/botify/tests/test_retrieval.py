@@ -0,0 +1,60 @@
+"""
+Async retrieval from coroutines of a running event loop, one by one
+and batched across concurrent requests.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from botify.index import TrackIndex
+from botify.retrieval import BatchedContextRetriever, ContextRetriever
+
+TRACKS = 500
+
+
+class TrackEncoder:
+    """Embeds a context as its previous track and records the threads it runs in"""
+
+    def __init__(self, embeddings: np.ndarray):
+        self.embeddings = embeddings
+        self.threads = set()
+
+    def encode(self, users: np.ndarray, tracks: np.ndarray) -> np.ndarray:
+        self.threads.add(threading.current_thread().name)
+        return self.embeddings[tracks]
+
+
+@pytest.fixture
+def embeddings():
+    return np.random.default_rng(0).standard_normal((TRACKS, 16), dtype=np.float32)
+
+
+def retrieve_concurrently(retriever: ContextRetriever, tracks: list) -> list:
+    async def main():
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=2, thread_name_prefix="inference")
+        )
+        return await asyncio.gather(*(retriever.retrieve_async(user, track) for user, track in enumerate(tracks)))
+
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("batched", [False, True], ids=["single", "batched"])
+def test_retrieve_async(embeddings, batched):
+    track_index = TrackIndex.build({}, embeddings)
+    encoder = TrackEncoder(embeddings)
+    if batched:
+        retriever = BatchedContextRetriever(encoder, track_index, 10, max_batch_size=8)
+    else:
+        retriever = ContextRetriever(encoder, track_index, 10)
+    tracks = list(range(0, TRACKS, 25))
+
+    results = retrieve_concurrently(retriever, tracks)
+    retriever.close()
+    threads = {thread.split("_")[0] for thread in encoder.threads}
+
+    assert results == ContextRetriever(encoder, track_index, 10).retrieve_many(list(range(len(tracks))), tracks)
+    assert threads == ({"context-retriever"} if batched else {"inference"})
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import socket
+import time
+from typing import Dict, Optional, Tuple
+
+from ..envs import RemoteRecommenderConfig
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, body: bytes):
+        super().__init__(f"HTTP {status}: {body[:200]!r}")
+        self.status = status
+
+
+class ConnectionPool:
+    """
+    At most size keep-alive HTTP/1.1 connections to one server.
+
+    A request waits for an idle connection, so no more than size
+    requests are in flight however many coroutines send them.
+    Connections are opened on first use and reopened when the
+    server closes them; a request on a reused connection the
+    server has closed in the meantime is retried once.
+
+    Only what botify answers is supported: JSON bodies with
+    Content-Length, no chunked transfer encoding.
+    """
+
+    def __init__(self, host: str, port: int, size: int):
+        self.host = host
+        self.port = port
+        self.idle = asyncio.Queue()
+        for _ in range(size):
+            self.idle.put_nowait(None)
+
+    async def post(self, path: str, payload: dict) -> Tuple[dict, float]:
+        """Send the request and return the response with its latency in seconds"""
+        body = json.dumps(payload).encode()
+        request = (
+            f"POST {path} HTTP/1.1\r\n"
+            f"Host: {self.host}:{self.port}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n"
+        ).encode() + body
+
+        connection = await self.idle.get()
+        try:
+            start = time.perf_counter()
+            try:
+                status, data, connection = await self.exchange(connection, request)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                if connection is None:
+                    raise
+                # The server has closed the idle connection, open a new one
+                self.close(connection)
+                connection = None
+                start = time.perf_counter()
+                status, data, connection = await self.exchange(connection, request)
+            latency = time.perf_counter() - start
+        except BaseException:
+            self.close(connection)
+            connection = None
+            raise
+        finally:
+            self.idle.put_nowait(connection)
+
+        if status != 200:
+            raise HTTPError(status, data)
+        return json.loads(data), latency
+
+    async def exchange(self, connection, request: bytes):
+        if connection is None:
+            connection = await asyncio.open_connection(self.host, self.port)
+            connection[1].get_extra_info("socket").setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_NODELAY, 1
+            )
+        reader, writer = connection
+        writer.write(request)
+        await writer.drain()
+
+        version, status, _ = (await reader.readuntil(b"\r\n")).decode().split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode().partition(":")
+            headers[name.strip().lower()] = value.strip()
+        data = await reader.readexactly(int(headers.get("content-length", 0)))
+
+        if version != "HTTP/1.1" or headers.get("connection", "").lower() == "close":
+            self.close(connection)
+            connection = None
+        return int(status), data, connection
+
+    @staticmethod
+    def close(connection):
+        if connection is not None:
+            connection[1].close()
+
+    async def aclose(self):
+        while not self.idle.empty():
+            self.close(self.idle.get_nowait())
+
+
+class AsyncRemoteRecommender:
+    """
+    Call the remote recommender service from asyncio coroutines,
+    so that many sessions can wait for it at the same time.
+
+    recommend returns the recommended track (None for the last
+    call of a session) and the client-side latency of the request.
+    """
+
+    def __init__(self, config: RemoteRecommenderConfig, connections: int):
+        self.host = config.host
+        self.port = config.port
+        self.pool = ConnectionPool(config.host, config.port, connections)
+
+    async def recommend(
+        self, observation: Dict[str, int], reward: float, done: bool
+    ) -> Tuple[Optional[int], float]:
+        data = {"track": int(observation["track"]), "time": float(reward)}
+        endpoint = "next" if not done else "last"
+        response, latency = await self.pool.post(
+            f"/{endpoint}/{observation['user']}", data
+        )
+        return response.get("track"), latency
+
+    async def close(self):
+        await self.pool.aclose()
+
+    def __repr__(self):
+        return f"async_remote({self.host}, {self.port})"
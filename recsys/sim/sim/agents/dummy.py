@@ -1,5 +1,7 @@
 from typing import Dict
 
+import numpy as np
+
 from .recommender import Recommender
 
 
@@ -12,5 +14,13 @@ class DummyRecommender(Recommender):
     def recommend(self, observation: Dict[str, int], reward: float, done: bool) -> int:
         return self.action_space.sample()
 
+    def recommend_batch(
+        self,
+        observations: Dict[str, np.ndarray],
+        rewards: np.ndarray,
+        dones: np.ndarray,
+    ) -> np.ndarray:
+        return np.random.randint(self.action_space.n, size=len(rewards))
+
     def __repr__(self):
         return "dummy"
@@ -1,6 +1,26 @@
 from typing import Dict
 
+import numpy as np
+
 
 class Recommender(object):
     def recommend(self, observation: Dict[str, int], reward: float, done: bool) -> int:
         raise NotImplementedError()
+
+    def recommend_batch(
+        self,
+        observations: Dict[str, np.ndarray],
+        rewards: np.ndarray,
+        dones: np.ndarray,
+    ) -> np.ndarray:
+        """Recommend for many sessions at once, one recommend call per session by default"""
+        return np.array(
+            [
+                self.recommend(
+                    {"user": int(user), "track": int(track)}, float(reward), bool(done)
+                )
+                for user, track, reward, done in zip(
+                    observations["user"], observations["track"], rewards, dones
+                )
+            ]
+        )
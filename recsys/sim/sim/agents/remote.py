@@ -1,6 +1,9 @@
-import requests
+import os
 from typing import Dict
 
+import numpy as np
+import requests
+
 from .recommender import Recommender
 from ..envs import RemoteRecommenderConfig
 
@@ -10,19 +13,77 @@ SCHEME = "http"
 
 
 class RemoteRecommender(Recommender):
-    """Call the remote recommender service"""
+    """
+    Call the remote recommender service.
+
+    Requests go through a persistent session, so consecutive calls
+    reuse a keep-alive connection. recommend_batch sends the events of
+    all the sessions of a step to the batch endpoints, in requests of
+    up to batch_size events; a batch_size of 0 calls the service once
+    per session instead.
+    """
 
     def __init__(self, config: RemoteRecommenderConfig):
         self.host = config.host
         self.port = config.port
+        self.batch_size = config.batch_size
+
+        self.pid = None
+        self.http = None
+
+    @property
+    def session(self) -> requests.Session:
+        # Forked workers must not share the connections of their parent
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.http = requests.Session()
+        return self.http
 
     def recommend(self, observation: Dict[str, int], reward: float, done: bool) -> int:
         data = {"track": int(observation["track"]), "time": reward}
         endpoint = "next" if not done else "last"
         url = self.get_request_url(f"{endpoint}/{observation['user']}", {})
-        response = requests.post(url, json=data)
+        response = self.session.post(url, json=data)
         return response.json().get("track")
 
+    def recommend_batch(
+        self,
+        observations: Dict[str, np.ndarray],
+        rewards: np.ndarray,
+        dones: np.ndarray,
+    ) -> np.ndarray:
+        if self.batch_size <= 0:
+            return super().recommend_batch(observations, rewards, dones)
+
+        events = [
+            {"user": int(user), "track": int(track), "time": float(reward)}
+            for user, track, reward in zip(
+                observations["user"], observations["track"], rewards
+            )
+        ]
+        # Finish sessions first: a new session of the same user may be running
+        finished = np.flatnonzero(dones)
+        for chunk in self.chunks(finished):
+            self.post("last", [events[i] for i in chunk])
+
+        actions = np.zeros(len(events), dtype=np.int64)
+        for chunk in self.chunks(np.flatnonzero(~dones)):
+            response = self.post("next", [events[i] for i in chunk])
+            actions[chunk] = [item["track"] for item in response["recommendations"]]
+        return actions
+
+    def chunks(self, indices: np.ndarray):
+        return [
+            indices[start : start + self.batch_size]
+            for start in range(0, len(indices), self.batch_size)
+        ]
+
+    def post(self, endpoint: str, events: list) -> dict:
+        url = self.get_request_url(endpoint, {})
+        response = self.session.post(url, json={"events": events})
+        response.raise_for_status()
+        return response.json()
+
     def get_request_url(self, path, query_params):
         query = urlencode(query_params)
         return urlunsplit((SCHEME, f"{self.host}:{self.port}", path, query, ""))
@@ -0,0 +1,142 @@
+"""
+Compare RecEnv with VectorRecEnv at several numbers of sessions:
+episodes per second, and mean reward and steps per episode with
+a Welch t-test and a Kolmogorov-Smirnov test of the per-episode
+rewards against RecEnv, which should not tell the two apart::
+
+    python -m sim.bench.envs --envs 1 16 256 4096
+
+Sessions are driven by a random recommender over the whole
+catalog and by one drawing from a small pool of tracks, which
+repeats tracks and artists and exercises the discounts. Without
+the track embeddings of the config, random ones are generated.
+
+VectorRecEnv searches the nearest tracks of a user interest once
+and reuses them; the searches are done before the measurement,
+so it shows the steady state of a long simulation. Until every
+interest has been drawn, a new session costs about as much
+as one in RecEnv.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import scipy.stats as ss
+import yaml
+
+from sim.agents import DummyRecommender, Recommender
+from sim.envs import RecEnv, VectorRecEnv
+from sim.envs.config import RecEnvConfigSchema
+from sim.run import run_episode, run_vector_episodes
+
+
+class PoolRecommender(Recommender):
+    def __init__(self, pool: np.ndarray):
+        self.pool = pool
+
+    def recommend(self, observation, reward, done):
+        return int(np.random.choice(self.pool))
+
+    def recommend_batch(self, observations, rewards, dones):
+        return np.random.choice(self.pool, size=len(rewards))
+
+
+def with_embeddings(config, directory: str, dims: int, seed: int):
+    """Point config to random track embeddings if it has none"""
+    track_config = config.track_catalog_config
+    if not os.path.exists(track_config.track_embeddings_path):
+        tracks = sum(1 for _ in open(track_config.track_meta_path))
+        path = os.path.join(directory, "tracks.npy")
+        random = np.random.RandomState(seed)
+        np.save(path, random.randn(tracks, dims).astype(np.float32))
+        track_config.track_embeddings_path = path
+
+
+def recommenders(env):
+    pool = np.random.RandomState(0).choice(env.action_space.n, 50, replace=False)
+    return {"random": DummyRecommender(env.action_space), "pool": PoolRecommender(pool)}
+
+
+def summarize(stats, elapsed):
+    rewards = np.array([s.reward for s in stats])
+    steps = np.array([s.steps for s in stats])
+    return {
+        "episodes_per_second": len(stats) / elapsed,
+        "rewards": rewards,
+        "reward": rewards.mean(),
+        "reward_sem": ss.sem(rewards),
+        "steps": steps.mean(),
+    }
+
+
+def run_sequential(env, recommender, episodes):
+    start = time.perf_counter()
+    stats = [run_episode(1, episode, env, recommender) for episode in range(episodes)]
+    return summarize(stats, time.perf_counter() - start)
+
+
+def run_vector(env, recommender, episodes):
+    start = time.perf_counter()
+    stats = run_vector_episodes(1, env, episodes, recommender)
+    return summarize(stats, time.perf_counter() - start)
+
+
+def print_row(name, result, baseline):
+    line = (
+        f"{name:<10}{result['episodes_per_second']:>12.0f}"
+        f"{result['episodes_per_second'] / baseline['episodes_per_second']:>9.1f}x"
+        f"{result['reward']:>9.3f} ± {result['reward_sem']:.3f}{result['steps']:>8.2f}"
+    )
+    if result is not baseline:
+        t_test = ss.ttest_ind(result["rewards"], baseline["rewards"], equal_var=False)
+        ks_test = ss.ks_2samp(result["rewards"], baseline["rewards"])
+        line += f"{t_test.pvalue:>9.3f}{ks_test.pvalue:>9.3f}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, default="config/env.yml")
+    parser.add_argument("--envs", type=int, nargs="+", default=[1, 16, 256, 4096])
+    parser.add_argument("--episodes", type=int, default=2000)
+    parser.add_argument("--vector-episodes", type=int, default=20000)
+    parser.add_argument("--dims", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = RecEnvConfigSchema().load(yaml.full_load(config_file))
+
+    with tempfile.TemporaryDirectory() as directory:
+        with_embeddings(config, directory, args.dims, args.seed)
+        env = RecEnv(config)
+        vector_envs = {n: VectorRecEnv(config, n) for n in args.envs}
+
+    # The catalogs are the same, so are the nearest tracks of interests
+    warm = next(iter(vector_envs.values()))
+    warm.nearest(np.arange(len(warm.interests)))
+    for vector_env in vector_envs.values():
+        vector_env.interest_nearest = warm.interest_nearest
+        vector_env.interest_searched = warm.interest_searched
+
+    print(
+        f"{'env':<10}{'episodes/s':>12}{'speedup':>10}{'reward':>17}{'steps':>8}"
+        f"{'t-test p':>9}{'KS p':>9}"
+    )
+    for name, recommender in recommenders(env).items():
+        print(f"## {name} recommender")
+        env.seed(args.seed)
+        baseline = run_sequential(env, recommender, args.episodes)
+        print_row("RecEnv", baseline, baseline)
+        for n, vector_env in vector_envs.items():
+            vector_env.seed(args.seed)
+            episodes = max(args.episodes, min(args.vector_episodes, 20 * n))
+            result = run_vector(vector_env, recommender, episodes)
+            print_row(f"N={n}", result, baseline)
+
+
+if __name__ == "__main__":
+    main()
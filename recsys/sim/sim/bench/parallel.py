@@ -0,0 +1,67 @@
+"""
+Measure how run_parallel_experiment scales with worker processes:
+episodes per second for every number of workers, and whether two
+runs with the same seed give the same episodes::
+
+    python -m sim.bench.parallel --workers 1 2 4 8 --envs 1 256
+
+Workers are forked from the process that loaded the env, so the
+time to load the catalogs and build the index is not measured.
+Without the track embeddings of the config, random ones are used.
+"""
+
+import argparse
+import tempfile
+import time
+
+import yaml
+
+from sim.bench.envs import with_embeddings
+from sim.envs import RecEnv, VectorRecEnv
+from sim.envs.config import RecEnvConfigSchema
+from sim.run import DUMMY, run_parallel_experiment
+
+
+def run(env, config, episodes, seed, workers):
+    start = time.perf_counter()
+    stats = run_parallel_experiment(1, env, episodes, DUMMY, config, seed, workers)
+    elapsed = time.perf_counter() - start
+    return elapsed, [(s.episode, s.reward, s.steps) for s in stats]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, default="config/env.yml")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--envs", type=int, nargs="+", default=[1, 256])
+    parser.add_argument("--episodes", type=int, default=4000)
+    parser.add_argument("--dims", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = RecEnvConfigSchema().load(yaml.full_load(config_file))
+    with tempfile.TemporaryDirectory() as directory:
+        with_embeddings(config, directory, args.dims, args.seed)
+        envs = {
+            n: VectorRecEnv(config, n) if n > 1 else RecEnv(config) for n in args.envs
+        }
+
+    print(
+        f"{'envs':>6}{'workers':>9}{'episodes/s':>12}{'scaling':>9}{'reproducible':>14}"
+    )
+    for n, env in envs.items():
+        base = None
+        for workers in args.workers:
+            elapsed, stats = run(env, config, args.episodes, args.seed, workers)
+            _, repeated = run(env, config, args.episodes, args.seed, workers)
+            throughput = args.episodes / elapsed
+            base = base or throughput / workers
+            print(
+                f"{n:>6}{workers:>9}{throughput:>12.0f}{throughput / base:>8.2f}x"
+                f"{str(stats == repeated):>14}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Time User.consume over long sessions with Session and with the
+list-based session it replaced, which scans every playback for
+membership and counts artists from scratch on every step::
+
+    python -m sim.bench.session --lengths 100 1000 5000 20000
+
+A user with a budget that never runs out is recommended random
+tracks of a small pool, so tracks and artists repeat. Both
+sessions get the same recommendations and the same random state
+and must come out with the same playback times.
+"""
+
+import argparse
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+import yaml
+
+from sim.bench.envs import with_embeddings
+from sim.envs.config import RecEnvConfigSchema
+from sim.envs.session import Playback, Session
+from sim.envs.track import TrackCatalog
+from sim.envs.user import User
+
+
+class ListSession:
+    def __init__(self, user, embedding, first_playback, budget):
+        self.user = user
+        self.embedding = embedding
+        self.budget = budget
+        self.playback = [first_playback]
+        self.finished = False
+
+    def update(self, playback, budget_decrement):
+        self.playback.append(playback)
+        self.budget -= budget_decrement
+
+    def finish(self):
+        self.finished = True
+
+    def artist_counts(self):
+        return Counter([pb.artist for pb in self.playback])
+
+    def __contains__(self, track):
+        return any([pb.track == track for pb in self.playback])
+
+
+def run(session_class, user, track_catalog, recommendations, seed):
+    first = int(recommendations[0])
+    session = session_class(
+        user.user,
+        track_catalog.get_embedding(first),
+        Playback(first, 1.0, track_catalog.get_artist(first)),
+        user.session_budget,
+    )
+    np.random.seed(seed)
+    times = np.empty(len(recommendations) - 1)
+    start = time.perf_counter()
+    for i, recommendation in enumerate(recommendations[1:]):
+        times[i] = user.consume(int(recommendation), session, track_catalog)
+    return time.perf_counter() - start, times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, default="config/env.yml")
+    parser.add_argument(
+        "--lengths", type=int, nargs="+", default=[100, 1000, 5000, 20000]
+    )
+    parser.add_argument("--pool", type=int, default=2000)
+    parser.add_argument("--dims", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = RecEnvConfigSchema().load(yaml.full_load(config_file))
+    with tempfile.TemporaryDirectory() as directory:
+        with_embeddings(config, directory, args.dims, args.seed)
+        track_catalog = TrackCatalog(config.track_catalog_config)
+
+    user = User(0, [0], 10, 0.0, 1.0, 10**9, 0.8)
+    random = np.random.RandomState(args.seed)
+    pool = random.choice(track_catalog.size(), args.pool, replace=False)
+
+    print(f"{'length':>8}{'list, us/step':>15}{'session, us/step':>18}{'speedup':>9}")
+    for length in args.lengths:
+        recommendations = random.choice(pool, length + 1)
+        list_seconds, list_times = run(
+            ListSession, user, track_catalog, recommendations, args.seed
+        )
+        seconds, times = run(Session, user, track_catalog, recommendations, args.seed)
+        assert np.array_equal(times, list_times), "Sessions diverged"
+        print(
+            f"{length:>8}{list_seconds / length * 1e6:>15.1f}"
+            f"{seconds / length * 1e6:>18.1f}{list_seconds / seconds:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
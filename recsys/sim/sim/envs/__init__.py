@@ -1,2 +1,3 @@
 from sim.envs.config import RecEnvConfig, RecEnvConfigSchema, RemoteRecommenderConfig
 from sim.envs.env import RecEnv
+from sim.envs.vector_env import VectorRecEnv
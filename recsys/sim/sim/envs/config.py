@@ -23,6 +23,7 @@ class UserCatalogConfig:
 class RemoteRecommenderConfig:
     host: str
     port: int
+    batch_size: int = 256
 
 
 @dataclass
@@ -49,3 +49,4 @@ class RecEnv(gym.Env):
 
     def seed(self, seed=None):
         np.random.seed(seed)
+        self.action_space.seed(seed)
@@ -2,6 +2,8 @@ from collections import Counter
 from dataclasses import dataclass
 import numpy as np
 
+INITIAL_CAPACITY = 16
+
 
 @dataclass
 class Playback:
@@ -11,30 +13,66 @@ class Playback:
 
 
 class Session:
+    """
+    Playbacks are kept in arrays grown by doubling, next to the set
+    of played tracks and the counts of played artists, which are
+    updated on every playback, so that membership and artist counts
+    do not depend on the length of the session.
+    """
+
     def __init__(
         self, user: int, embedding: np.array, first_playback: Playback, budget: int
     ):
         self.user = user
         self.embedding = embedding
         self.budget = budget
-        self.playback = [first_playback]
         self.finished = False
 
+        self.length = 0
+        self.tracks = np.empty(INITIAL_CAPACITY, dtype=np.int64)
+        self.times = np.empty(INITIAL_CAPACITY, dtype=np.float64)
+        self.artists = np.empty(INITIAL_CAPACITY, dtype=object)
+        self.played = set()
+        self.artist_counter = Counter()
+        self.append(first_playback)
+
     def observe(self):
-        return {"user": self.user, "track": self.playback[-1].track}
+        return {"user": self.user, "track": int(self.tracks[self.length - 1])}
 
     def update(self, playback: Playback, budget_decrement: int):
-        self.playback.append(playback)
+        self.append(playback)
         self.budget -= budget_decrement
 
+    def append(self, playback: Playback):
+        if self.length == len(self.tracks):
+            self.tracks = np.resize(self.tracks, 2 * self.length)
+            self.times = np.resize(self.times, 2 * self.length)
+            self.artists = np.resize(self.artists, 2 * self.length)
+
+        self.tracks[self.length] = playback.track
+        self.times[self.length] = playback.time
+        self.artists[self.length] = playback.artist
+        self.length += 1
+
+        self.played.add(int(playback.track))
+        self.artist_counter[playback.artist] += 1
+
     def finish(self):
         self.finished = True
 
+    @property
+    def playback(self):
+        return [
+            Playback(int(self.tracks[i]), float(self.times[i]), self.artists[i])
+            for i in range(self.length)
+        ]
+
     def artist_counts(self):
-        return Counter([pb.artist for pb in self.playback])
+        """Counts of played artists, kept up to date by the session: do not modify"""
+        return self.artist_counter
 
     def __contains__(self, track):
-        return any([pb.track == track for pb in self.playback])
+        return track in self.played
 
     def __repr__(self):
         return (
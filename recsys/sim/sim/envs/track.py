@@ -17,6 +17,8 @@ class TrackCatalog:
         # Check that meta is consistent with embeddings
         assert np.array_equal(track_meta["track"].values, np.arange(self.size()))
         self.track_artists = track_meta["artist"].values
+        # Integer artist ids for vectorized comparisons
+        self.track_artist_ids, self.artists = pd.factorize(self.track_artists)
 
     def build_track_index(self) -> faiss.Index:
         index = faiss.index_factory(
@@ -35,5 +37,9 @@ class TrackCatalog:
         dist, ind = self.index.search(query[np.newaxis, :], k)
         return ind
 
+    def get_nearest_batch(self, queries, k):
+        dist, ind = self.index.search(np.ascontiguousarray(queries), k)
+        return ind
+
     def size(self):
         return self.track_embeddings.shape[0]
@@ -0,0 +1,171 @@
+import gym
+import numpy as np
+import scipy.special as ss
+from gym.spaces import Discrete
+
+from .config import RecEnvConfig
+from .track import TrackCatalog
+from .user import UserCatalog
+
+
+class VectorRecEnv(gym.Env):
+    """
+    num_envs independent RecEnv sessions advanced in lockstep.
+
+    User parameters and session state live in arrays, so a step
+    scores every recommendation with one batched dot product and
+    applies expit and the artist discount to all of them at once.
+    Sessions follow the same model as User.consume / User.listen,
+    drawn from the global numpy random state.
+
+    reset and step take the slots to act on, so finished sessions
+    can be replaced while the others keep going. Observations are
+    dicts of arrays with one entry per slot.
+    """
+
+    metadata = {"render.modes": ["human"]}
+
+    def __init__(self, config: RecEnvConfig, num_envs: int):
+        super(VectorRecEnv, self).__init__()
+        self.config = config
+        self.num_envs = num_envs
+
+        self.track_catalog = TrackCatalog(config.track_catalog_config)
+        self.user_catalog = UserCatalog(config.user_catalog_config)
+
+        self.action_space = Discrete(self.track_catalog.size())
+
+        users = self.user_catalog.users
+        self.user_ids = np.array([user.user for user in users])
+        self.consume_bias = np.array([user.consume_bias for user in users])
+        self.consume_sharpness = np.array([user.consume_sharpness for user in users])
+        self.session_budget = np.array([user.session_budget for user in users])
+        self.discount_gamma = np.array([user.artist_discount_gamma for user in users])
+        self.neighbours = np.array([user.interest_neighbours for user in users])
+        self.interest_offsets = np.cumsum([0] + [len(user.interests) for user in users])
+        self.interests = np.concatenate([user.interests for user in users])
+
+        # Nearest tracks of every interest, searched the first time it is drawn
+        self.interest_nearest = np.full(
+            (len(self.interests), self.neighbours.max()), -1, dtype=np.int64
+        )
+        self.interest_searched = np.zeros(len(self.interests), dtype=bool)
+
+        dims = self.track_catalog.track_embeddings.shape[1]
+        self.users = np.zeros(num_envs, dtype=np.int64)
+        self.embeddings = np.zeros((num_envs, dims), dtype=np.float32)
+        self.budgets = np.zeros(num_envs, dtype=np.int64)
+        self.finished = np.ones(num_envs, dtype=bool)
+
+        # Playbacks of every session, grown when the longest one fills them
+        self.lengths = np.zeros(num_envs, dtype=np.int64)
+        self.tracks = np.zeros((num_envs, 16), dtype=np.int64)
+        self.artists = np.zeros((num_envs, 16), dtype=np.int64)
+
+    def reset(self, slots=None):
+        slots = self.all_slots(slots)
+        size = len(slots)
+        if size == 0:
+            return self.observe(slots)
+
+        users = np.random.randint(len(self.user_ids), size=size)
+
+        # A random interest of every user...
+        starts = self.interest_offsets[users]
+        counts = self.interest_offsets[users + 1] - starts
+        interests = starts + (np.random.random(size) * counts).astype(np.int64)
+        embeddings = self.track_catalog.get_embedding(self.interests[interests])
+
+        # ...and a random track among its nearest neighbours
+        neighbours = self.neighbours[users]
+        nearest = self.nearest(interests)
+        valid = (nearest >= 0) & (np.arange(nearest.shape[1]) < neighbours[:, None])
+        picks = (np.random.random(size) * valid.sum(axis=1)).astype(np.int64)
+        first_tracks = nearest[np.arange(size), picks]
+
+        self.users[slots] = users
+        self.embeddings[slots] = embeddings
+        self.budgets[slots] = self.session_budget[users]
+        self.finished[slots] = False
+        self.lengths[slots] = 1
+        self.tracks[slots, 0] = first_tracks
+        self.artists[slots, 0] = self.track_catalog.track_artist_ids[first_tracks]
+        return self.observe(slots)
+
+    def nearest(self, interests):
+        missing = np.unique(interests[~self.interest_searched[interests]])
+        if len(missing):
+            queries = self.track_catalog.get_embedding(self.interests[missing])
+            k = self.interest_nearest.shape[1]
+            self.interest_nearest[missing] = self.track_catalog.get_nearest_batch(
+                queries, k
+            )
+            self.interest_searched[missing] = True
+        return self.interest_nearest[interests]
+
+    def step(self, recommendations, slots=None):
+        slots = self.all_slots(slots)
+        recommendations = np.asarray(recommendations, dtype=np.int64)
+        assert len(recommendations) == len(slots), str(recommendations)
+        assert np.all(recommendations >= 0), str(recommendations)
+        assert np.all(recommendations < self.action_space.n), str(recommendations)
+        if len(slots) == 0:
+            return self.observe(slots), np.zeros(0), np.zeros(0, dtype=bool), None
+
+        lengths = self.lengths[slots]
+        played = np.arange(lengths.max()) < lengths[:, None]
+        tracks = self.tracks[slots, : played.shape[1]]
+        artists = self.artists[slots, : played.shape[1]]
+        artist = self.track_catalog.track_artist_ids[recommendations]
+
+        users = self.users[slots]
+        embeddings = self.track_catalog.get_embedding(recommendations)
+        scores = np.einsum("ij,ij->i", embeddings, self.embeddings[slots])
+        bias = self.consume_bias[users]
+        raw_times = ss.expit((scores - bias) * self.consume_sharpness[users])
+
+        # Users get upset when we recommend them the same artist multiple times
+        artist_counts = ((artists == artist[:, None]) & played).sum(axis=1)
+        discounts = np.power(self.discount_gamma[users], artist_counts)
+        times = np.around(raw_times * discounts, decimals=2)
+
+        # Users don't want to listen to the same track twice
+        times[((tracks == recommendations[:, None]) & played).any(axis=1)] = 0.0
+
+        self.budgets[slots] -= np.random.random(len(slots)) > times
+        self.append(slots, recommendations, artist)
+        finished = self.budgets[slots] <= 0
+        self.finished[slots] = finished
+
+        return self.observe(slots), times, finished, None
+
+    def append(self, slots, tracks, artists):
+        lengths = self.lengths[slots]
+        capacity = self.tracks.shape[1]
+        if lengths.max() >= capacity:
+            self.tracks = np.pad(self.tracks, ((0, 0), (0, capacity)))
+            self.artists = np.pad(self.artists, ((0, 0), (0, capacity)))
+        self.tracks[slots, lengths] = tracks
+        self.artists[slots, lengths] = artists
+        self.lengths[slots] = lengths + 1
+
+    def observe(self, slots):
+        return {
+            "user": self.user_ids[self.users[slots]],
+            "track": self.tracks[slots, self.lengths[slots] - 1],
+        }
+
+    def all_slots(self, slots):
+        if slots is None:
+            return np.arange(self.num_envs)
+        return np.asarray(slots, dtype=np.int64)
+
+    def render(self, mode="human", close=False):
+        for slot in np.flatnonzero(~self.finished):
+            playback = self.tracks[slot, : self.lengths[slot]].tolist()
+            user = self.user_ids[self.users[slot]]
+            print(f"Current session {slot}: {user}:{playback}:{self.budgets[slot]}")
+
+    def seed(self, seed=None):
+        np.random.seed(seed)
+        self.action_space.seed(seed)
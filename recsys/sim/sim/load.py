@@ -0,0 +1,219 @@
+"""
+Drive the remote recommender with concurrent sessions: K coroutines
+run RecEnv episodes at the same time, each waiting for the service
+on its own, over a bounded pool of keep-alive connections::
+
+    python sim/load.py --episodes 2000 --concurrency 1 8 32 --connections 8 --config config/env.yml
+
+Every request is recorded with its client-side latency and the
+reward the user gave to the recommended track. For every level of
+concurrency the driver prints the throughput, latency percentiles
+of /next and the mean reward, and appends them to --summary as
+json lines, so runs against different versions of botify (named
+with --label) can be compared.
+
+Sessions share the catalogs of one env and the global numpy random
+state. Which session draws next depends on the order responses
+arrive in, so the sessions of two runs differ even with the same
+seed, unlike those of sim/run.py.
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import time
+from dataclasses import dataclass, asdict
+from typing import Iterator, List
+
+import numpy as np
+import pandas as pd
+import scipy.stats as ss
+import yaml
+
+from sim.agents.async_remote import AsyncRemoteRecommender, HTTPError
+from sim.envs import RecEnv
+from sim.envs.config import RecEnvConfigSchema
+from sim.run import EpisodeStats
+
+NEXT = "next"
+LAST = "last"
+
+
+@dataclass
+class RequestStats:
+    episode: int
+    step: int
+    endpoint: str
+    latency: float
+    # Playback time of the recommended track, nan for the last call
+    reward: float
+
+
+async def run_episodes(
+    env: RecEnv,
+    recommender: AsyncRemoteRecommender,
+    episodes: Iterator[int],
+    stats: List[EpisodeStats],
+    requests: List[RequestStats],
+    errors: List[str],
+):
+    """Run episodes one after another until the shared iterator is exhausted"""
+    for episode in episodes:
+        observation = env.reset()
+        reward = 1.0
+        done = False
+        episode_stats = EpisodeStats(0, episode)
+
+        try:
+            while not done:
+                action, latency = await recommender.recommend(observation, reward, done)
+                observation, reward, done, _ = env.step(action)
+                requests.append(
+                    RequestStats(episode, episode_stats.steps, NEXT, latency, reward)
+                )
+                episode_stats.reward += reward
+                episode_stats.steps += 1
+
+            _, latency = await recommender.recommend(observation, reward, done)
+            requests.append(
+                RequestStats(episode, episode_stats.steps, LAST, latency, np.nan)
+            )
+        except (HTTPError, ConnectionError, asyncio.IncompleteReadError) as e:
+            # The session is abandoned, as a user would leave on an error
+            errors.append(str(e))
+            continue
+        stats.append(episode_stats)
+
+
+async def run_load(
+    env: RecEnv, config, episodes: int, concurrency: int, connections: int
+):
+    recommender = AsyncRemoteRecommender(config.remote_recommender_config, connections)
+    # Sessions of their own over the catalogs of env
+    envs = [copy.copy(env) for _ in range(concurrency)]
+    shared_episodes = iter(range(episodes))
+
+    stats, requests, errors = [], [], []
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            run_episodes(
+                session_env, recommender, shared_episodes, stats, requests, errors
+            )
+            for session_env in envs
+        )
+    )
+    duration = time.perf_counter() - start
+    await recommender.close()
+    return stats, requests, errors, duration
+
+
+def summarize(
+    stats: List[EpisodeStats],
+    requests: List[RequestStats],
+    errors: List[str],
+    duration: float,
+    concurrency: int,
+    args,
+) -> dict:
+    frame = pd.DataFrame([asdict(r) for r in requests])
+    rewards = pd.DataFrame([asdict(s) for s in stats])
+    latencies = frame.loc[frame["endpoint"] == NEXT, "latency"].to_numpy() * 1000
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return {
+        "label": args.label,
+        "concurrency": concurrency,
+        "connections": args.connections,
+        "episodes": len(stats),
+        "requests": len(frame),
+        "errors": len(errors),
+        "duration_s": duration,
+        "requests_per_s": len(frame) / duration,
+        "episodes_per_s": len(stats) / duration,
+        "latency_mean_ms": float(latencies.mean()),
+        "latency_p50_ms": p50,
+        "latency_p90_ms": p90,
+        "latency_p99_ms": p99,
+        "latency_max_ms": float(latencies.max()),
+        "reward": float(rewards["reward"].mean()),
+        "reward_sem": float(ss.sem(rewards["reward"])),
+        "steps": float(rewards["steps"].mean()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--episodes",
+        help="Number of episodes at every level of concurrency",
+        type=int,
+        default=1000,
+    )
+    parser.add_argument(
+        "--concurrency",
+        help="Numbers of sessions waiting for the service at the same time",
+        type=int,
+        nargs="+",
+        default=[1, 8, 32],
+    )
+    parser.add_argument(
+        "--connections",
+        help="Maximum number of keep-alive connections to the service",
+        type=int,
+        default=8,
+    )
+    parser.add_argument("--seed", help="Random seed for the env", type=int, default=42)
+    parser.add_argument(
+        "--config",
+        help="Path to environment config",
+        type=str,
+        default="config/env.yml",
+    )
+    parser.add_argument(
+        "--label", help="Name of the service version in the summary", type=str
+    )
+    parser.add_argument(
+        "--summary", help="File to append json lines of the summary to", type=str
+    )
+    parser.add_argument(
+        "--output", help="CSV file to write the stats of every request to", type=str
+    )
+    args = parser.parse_args()
+
+    config = RecEnvConfigSchema().load(yaml.full_load(open(args.config)))
+
+    summaries = []
+    frames = []
+    with RecEnv(config) as env:
+        for concurrency in args.concurrency:
+            env.seed(args.seed)
+            stats, requests, errors, duration = asyncio.run(
+                run_load(env, config, args.episodes, concurrency, args.connections)
+            )
+            if errors:
+                print(f"{len(errors)} failed sessions, the first one: {errors[0]}")
+            if not stats:
+                raise SystemExit(f"No session at concurrency {concurrency} succeeded")
+            summaries.append(
+                summarize(stats, requests, errors, duration, concurrency, args)
+            )
+            frames.append(
+                pd.DataFrame([asdict(r) for r in requests]).assign(
+                    concurrency=concurrency
+                )
+            )
+
+    result = pd.DataFrame(summaries).set_index("concurrency")
+    print(f"## Load summary\n\n{result.drop(columns=['label']).to_markdown()}")
+
+    if args.summary:
+        with open(args.summary, "a") as summary_file:
+            for summary in summaries:
+                summary_file.write(json.dumps(summary) + "\n")
+    if args.output:
+        pd.concat(frames).to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
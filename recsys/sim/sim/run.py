@@ -1,5 +1,8 @@
 import argparse
 import cmd
+import functools
+import gc
+import multiprocessing
 from dataclasses import dataclass, asdict
 import numpy as np
 import pandas as pd
@@ -10,13 +13,19 @@ import yaml
 
 from sim.agents import Recommender, DummyRecommender, RemoteRecommender
 from sim.agents.console import ConsoleRecommender
-from sim.envs import RecEnv
+from sim.envs import RecEnv, VectorRecEnv
 from sim.envs.config import RecEnvConfigSchema, RecEnvConfig
 
 DUMMY = "dummy"
 REMOTE = "remote"
 CONSOLE = "console"
 
+# Shards per worker process, so that the progress bar moves
+SHARDS_PER_WORKER = 4
+
+# The env of the parent process, inherited by forked workers
+shared_env = None
+
 
 @dataclass
 class EpisodeStats:
@@ -44,8 +53,74 @@ def run_episode(day: int, episode: int, env: RecEnv, recommender: Recommender):
     return stats
 
 
+def run_vector_episodes(
+    day: int,
+    env: VectorRecEnv,
+    episodes: int,
+    recommender: Recommender,
+    progress: bool = True,
+):
+    """Run episodes in the sessions of env, starting a new one whenever one finishes"""
+    slots = np.arange(min(env.num_envs, episodes))
+    observations = env.reset(slots)
+    rewards = np.ones(len(slots))
+    dones = np.zeros(len(slots), dtype=bool)
+
+    current = [EpisodeStats(day, episode) for episode in range(len(slots))]
+    started = len(slots)
+    stats = []
+
+    with tqdm.tqdm(total=episodes, disable=not progress) as bar:
+        while len(slots):
+            # Finished sessions get their last call, their actions are ignored
+            actions = recommender.recommend_batch(observations, rewards, dones)
+
+            running = ~dones
+            step_observations, step_rewards, step_dones, _ = env.step(
+                actions[running], slots[running]
+            )
+            for i, reward in zip(np.flatnonzero(running), step_rewards):
+                current[i].reward += reward
+                current[i].steps += 1
+
+            finished = np.flatnonzero(dones)
+            stats.extend(current[i] for i in finished)
+            bar.update(len(finished))
+
+            replaced = finished[: episodes - started]
+            retired = finished[episodes - started :]
+            for i in replaced:
+                current[i] = EpisodeStats(day, started)
+                started += 1
+            reset_observations = env.reset(slots[replaced])
+
+            for key in observations:
+                observations[key][running] = step_observations[key]
+                observations[key][replaced] = reset_observations[key]
+            rewards[running] = step_rewards
+            rewards[replaced] = 1.0
+            dones[running] = step_dones
+            dones[replaced] = False
+
+            if len(retired):
+                keep = np.ones(len(slots), dtype=bool)
+                keep[retired] = False
+                slots = slots[keep]
+                observations = {key: value[keep] for key, value in observations.items()}
+                rewards = rewards[keep]
+                dones = dones[keep]
+                current = [stat for stat, kept in zip(current, keep) if kept]
+
+    return stats
+
+
 def run_experiment(
-    day: int, env: RecEnv, episodes: int, recommender: str, config: RecEnvConfig
+    day: int,
+    env: RecEnv,
+    episodes: int,
+    recommender: str,
+    config: RecEnvConfig,
+    progress: bool = True,
 ):
     if recommender == DUMMY:
         recommender = DummyRecommender(env.action_space)
@@ -56,12 +131,72 @@ def run_experiment(
     else:
         raise ValueError(f"Unknown recommender type: {recommender}")
 
+    if isinstance(env, VectorRecEnv):
+        return run_vector_episodes(day, env, episodes, recommender, progress)
+
     stats = []
-    for episode_id in tqdm.trange(episodes):
+    for episode_id in tqdm.trange(episodes, disable=not progress):
         stats.append(run_episode(day, episode_id, env, recommender))
     return stats
 
 
+def run_shard(shard, day: int, recommender: str, config: RecEnvConfig):
+    first_episode, episodes, seed = shard
+    shared_env.seed(seed)
+    stats = run_experiment(
+        day, shared_env, episodes, recommender, config, progress=False
+    )
+    for episode_stats in stats:
+        episode_stats.episode += first_episode
+    return stats
+
+
+def run_parallel_experiment(
+    day: int,
+    env: RecEnv,
+    episodes: int,
+    recommender: str,
+    config: RecEnvConfig,
+    seed: int,
+    workers: int,
+):
+    """
+    Run the episodes of a day in shards on forked worker processes,
+    which share the catalogs and the index of env with the parent.
+    Every shard seeds the env with its own seed derived from seed
+    and day, so for the same seed and number of workers the results
+    do not depend on which worker runs which shard.
+    """
+    global shared_env
+
+    sizes = [
+        len(shard)
+        for shard in np.array_split(np.arange(episodes), workers * SHARDS_PER_WORKER)
+    ]
+    seeds = np.random.SeedSequence([seed, day]).spawn(len(sizes))
+    shards = [
+        (int(first_episode), size, int(seed_sequence.generate_state(1)[0]))
+        for first_episode, size, seed_sequence in zip(
+            np.cumsum([0] + sizes), sizes, seeds
+        )
+        if size > 0
+    ]
+
+    shared_env = env
+    # Keep the collector of workers off the objects inherited from the parent
+    gc.collect()
+    gc.freeze()
+
+    stats = []
+    run = functools.partial(run_shard, day=day, recommender=recommender, config=config)
+    with multiprocessing.get_context("fork").Pool(workers) as pool:
+        with tqdm.tqdm(total=episodes) as bar:
+            for shard_stats in pool.imap(run, shards):
+                stats.extend(shard_stats)
+                bar.update(len(shard_stats))
+    return sorted(stats, key=lambda episode_stats: episode_stats.episode)
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -73,6 +208,18 @@ def main():
     parser.add_argument(
         "--seed", help="Random seed for the env", type=int, default=42,
     )
+    parser.add_argument(
+        "--envs",
+        help="Number of sessions to simulate in lockstep",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of processes to run episodes in",
+        type=int,
+        default=1,
+    )
     parser.add_argument(
         "--config",
         help="Path to environment config",
@@ -80,18 +227,34 @@ def main():
         default="config/env.yml",
     )
     args = parser.parse_args()
+    if args.workers > 1 and args.recommender == CONSOLE:
+        parser.error("The console recommender can not run in parallel")
 
     config = RecEnvConfigSchema().load(yaml.full_load(open(args.config)))
 
     stats = []
-    with RecEnv(config) as env:
+    env = VectorRecEnv(config, args.envs) if args.envs > 1 else RecEnv(config)
+    with env:
         env.seed(args.seed)
 
         day = 1
         while True:
-            stats.extend(
-                run_experiment(day, env, args.episodes, args.recommender, config)
-            )
+            if args.workers > 1:
+                stats.extend(
+                    run_parallel_experiment(
+                        day,
+                        env,
+                        args.episodes,
+                        args.recommender,
+                        config,
+                        args.seed,
+                        args.workers,
+                    )
+                )
+            else:
+                stats.extend(
+                    run_experiment(day, env, args.episodes, args.recommender, config)
+                )
 
             time_control = TimeControl()
             time_control.cmdloop(